@@ -0,0 +1,289 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Scheduler of a batch of image builds
+
+    The builds run in the child processes forked from the one of the batch,
+    so they share what it has set up: the plugins, the configuration, the
+    repo metadata and the repo indexes. Each one takes its own package
+    backend, as libzypp is one per process. A build is started when there
+    are the loop devices, the disk space and the CPU for it.
+"""
+
+from __future__ import with_statement
+import os
+import sys
+import glob
+import time
+import errno
+import signal
+import traceback
+
+from mic import msger, kickstart
+from mic.utils import misc, runner
+
+# seconds between the checks of the running builds
+POLL_INTERVAL = 2
+
+# the disk space of a build without the size in kickstart, in MB
+DEFAULT_DISK = 4096
+
+class BatchBuild(object):
+    """ One build of a batch: the kickstart, the image format and what it
+        takes to build
+    """
+
+    def __init__(self, ksfile, argv, fmt, loops = 1, disk = DEFAULT_DISK):
+        self.ksfile = ksfile
+        self.name = os.path.splitext(os.path.basename(ksfile))[0]
+        # the args of 'mic create' to build it
+        self.argv = argv
+        self.format = fmt
+        self.loops = loops
+        self.disk = disk
+
+        self.pid = None
+        self.status = None
+        self.start = None
+        self.end = None
+        self.logfile = None
+
+    def __get_duration(self):
+        if self.start is None:
+            return 0
+        return (self.end or time.time()) - self.start
+    duration = property(__get_duration)
+
+    def __get_result(self):
+        if self.status is None:
+            return "not run"
+        if self.status == 0:
+            return "ok"
+        return "failed (%d)" % self.status
+    result = property(__get_result)
+
+def estimate_resources(ks, fmt):
+    """ The loop devices and the disk space in MB a build of ks takes
+
+        return: (loops, disk)
+    """
+
+    parts = [part for part in kickstart.get_partitions(ks)
+             if part.fstype != "swap"]
+
+    if fmt == "fs":
+        loops = 0
+    elif fmt == "raw":
+        loops = len(set([part.disk for part in parts])) or 1
+    elif fmt == "loop":
+        loops = len(parts) or 1
+    else:
+        loops = 1
+
+    disk = sum([int(part.size or 0) for part in parts])
+    if not disk:
+        disk = kickstart.get_image_size(ks, DEFAULT_DISK * 1024L * 1024) \
+               / 1024 / 1024
+
+    return (loops, disk)
+
+def count_free_loops():
+    """ The loop devices of the host which aren't in use """
+
+    loops = glob.glob("/dev/loop[0-9]*")
+    (rc, out) = runner.runtool(["losetup", "-a"])
+    if rc == 0:
+        used = len([line for line in out.splitlines() if line.strip()])
+    else:
+        used = 0
+
+    return max(len(loops) - used, 0)
+
+class BatchScheduler(object):
+    """ Run the builds in parallel, as many as the limits allow
+
+        run_build: the function to build one BatchBuild in the child
+                   process, returns the exit code
+        jobs: the builds at most running at once
+        max_loops: the loop devices at most in use, 0 for the free ones
+        max_load: the load average under which a build is started, 0 for
+                  the number of CPUs
+        min_free_disk: the disk space in MB to leave free in tmpdir
+    """
+
+    def __init__(self, run_build, jobs = 1, max_loops = 0, max_load = 0,
+                 min_free_disk = 0, tmpdir = "/var/tmp", logdir = "."):
+        self.run_build = run_build
+        self.jobs = max(jobs, 1)
+        self.max_loops = max_loops or max(count_free_loops(), 1)
+        self.max_load = max_load or _cpu_count()
+        self.min_free_disk = min_free_disk
+        self.tmpdir = tmpdir
+        self.logdir = logdir
+
+        self.running = {}
+
+    def _reserved(self, attr):
+        return sum([getattr(build, attr) for build in self.running.values()])
+
+    def _can_start(self, build):
+        if len(self.running) >= self.jobs:
+            return False
+
+        # a build more than the limits runs alone
+        if not self.running:
+            return True
+
+        if self._reserved('loops') + build.loops > self.max_loops:
+            return False
+
+        tmpdir = self.tmpdir
+        while not os.path.exists(tmpdir):
+            tmpdir = os.path.dirname(tmpdir)
+        avail = misc.get_filesystem_avail(tmpdir) / 1024 / 1024
+        # the running builds take the rest of their space later
+        if avail - self._reserved('disk') - build.disk < self.min_free_disk:
+            return False
+
+        if os.getloadavg()[0] >= self.max_load:
+            return False
+
+        return True
+
+    def _start(self, build):
+        build.logfile = os.path.join(self.logdir, "%s.log" % build.name)
+        build.start = time.time()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(build)
+
+        build.pid = pid
+        self.running[pid] = build
+        msger.info("Started the build of %s (%s), log: %s"
+                   % (build.name, build.format, build.logfile))
+
+    def _run_child(self, build):
+        status = 1
+        try:
+            try:
+                fd = os.open(build.logfile,
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+                os.dup2(fd, 1)
+                os.dup2(fd, 2)
+                os.close(fd)
+                msger.set_interactive(False)
+
+                status = self.run_build(build) or 0
+            except SystemExit, err:
+                if err.code is None:
+                    status = 0
+                elif isinstance(err.code, int):
+                    status = err.code
+                else:
+                    sys.stderr.write("%s\n" % err.code)
+            except:
+                traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _reap(self, block):
+        while self.running:
+            try:
+                (pid, status) = os.waitpid(-1, block and 0 or os.WNOHANG)
+            except OSError, err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+
+            if not pid:
+                return
+            if pid not in self.running:
+                continue
+
+            build = self.running.pop(pid)
+            build.end = time.time()
+            if os.WIFEXITED(status):
+                build.status = os.WEXITSTATUS(status)
+            else:
+                build.status = 128 + os.WTERMSIG(status)
+            msger.info("Finished the build of %s: %s in %d seconds"
+                       % (build.name, build.result, build.duration))
+            return
+
+    def _terminate(self):
+        for pid in self.running.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        while self.running:
+            self._reap(True)
+
+    def run(self, builds):
+        """ Run all the builds but the failed ones, return when they're all
+            done
+        """
+
+        if not os.path.isdir(self.logdir):
+            os.makedirs(self.logdir)
+
+        # the ones failed already aren't run
+        pending = [build for build in builds if build.status is None]
+        try:
+            while pending or self.running:
+                for build in list(pending):
+                    if not self._can_start(build):
+                        continue
+                    pending.remove(build)
+                    self._start(build)
+
+                if self.running:
+                    self._reap(False)
+                    time.sleep(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            msger.warning("terminating the running builds ...")
+            self._terminate()
+            raise
+
+        return builds
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def format_summary(builds):
+    """ The summary of the builds of a batch, one line for each """
+
+    lines = ["%-32s %-8s %-12s %8s  %s"
+             % ("NAME", "FORMAT", "RESULT", "SECONDS", "LOG")]
+    for build in builds:
+        lines.append("%-32s %-8s %-12s %8d  %s"
+                     % (build.name, build.format, build.result,
+                        build.duration, build.logfile or ""))
+    return "\n".join(lines) + "\n"
+
+def write_summary(builds, path):
+    with open(path, 'w') as wf:
+        wf.write(format_summary(builds))
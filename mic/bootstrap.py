@@ -222,7 +222,8 @@ class Bootstrap(object):
             pkg_manager.close()
 
         # Copy bootstrap repo files
-        srcdir = "%s/etc/zypp/repos.d/" % self.cachedir
+        srcdir = getattr(pkg_manager, 'reposdir',
+                         "%s/etc/zypp/repos.d" % self.cachedir) + "/"
         destdir= "%s/etc/zypp/repos.d/" % os.path.abspath(self.rootdir)
         shutil.rmtree(destdir, ignore_errors = True)
         shutil.copytree(srcdir, destdir)
@@ -60,6 +60,20 @@ class ConfigMgr(object):
                     "proxy": None,
                     "no_proxy": None,
                     "copy_kernel": False,
+                    "metadata_threads": 4,
+                    "metadata_expire": 0,
+                    "offline": False,
+                    "download_threads": 8,
+                    "download_rate": 0,
+                    "install_pipeline": False,
+                    "cache_quota": 0,
+                    "fresh_solve": False,
+                    "base_snapshot": True,
+                    "base_packages": None,
+                    "checkpoint": False,
+                    "resume": False,
+                    "formats": None,
+                    "package_threads": 1,
 
                     "runtime": None,
                 },
@@ -155,6 +169,25 @@ class ConfigMgr(object):
 
         proxy.set_proxies(self.create['proxy'], self.create['no_proxy'])
 
+        # normalize the type of metadata cache options
+        try:
+            self.create['metadata_expire'] = \
+                    int(self.create['metadata_expire'])
+        except ValueError:
+            msger.error("%s: metadata_expire should be seconds in integer"
+                        % siteconf)
+        for key in ('download_threads', 'download_rate', 'cache_quota',
+                    'package_threads'):
+            try:
+                self.create[key] = int(self.create[key])
+            except ValueError:
+                msger.error("%s: %s should be an integer" % (siteconf, key))
+        for key in ('offline', 'install_pipeline', 'fresh_solve',
+                    'base_snapshot', 'checkpoint', 'resume'):
+            if isinstance(self.create[key], basestring):
+                self.create[key] = \
+                        self.create[key].lower() in ('1', 'yes', 'true', 'on')
+
         for section in parser.sections():
             if section.startswith('bootstrap'):
                 name = section
@@ -203,8 +236,11 @@ class ConfigMgr(object):
             raise errors.KsError('no valid repos found in ks file')
 
         self.create['repomd'] = misc.get_metadata_from_repos(
-                                                    ksrepos,
-                                                    self.create['cachedir'])
+                                            ksrepos,
+                                            self.create['cachedir'],
+                                            self.create['metadata_threads'],
+                                            self.create['metadata_expire'],
+                                            self.create['offline'])
         msger.raw(" DONE")
 
         self.create['rpmver'] = misc.get_rpmver_in_repo(self.create['repomd'])
@@ -18,11 +18,34 @@
 import os, sys, re
 from optparse import SUPPRESS_HELP
 
-from mic import msger
-from mic.utils import cmdln, errors, rpmmisc
+from mic import msger, kickstart, batch
+from mic.utils import cmdln, errors, misc, rpmmisc, snapshot
+from mic.imager import multi
 from conf import configmgr
 from plugin import pluginmgr
 
+def parse_magic_line(re_str, pstr, ptype='mic'):
+    ptn = re.compile(re_str)
+    m = ptn.match(pstr)
+    if not m or not m.groups():
+        return None
+
+    inline_argv = m.group(1).strip()
+    if ptype == 'mic':
+        m2 = re.search('(?P<format>\w+)', inline_argv)
+    elif ptype == 'mic2':
+        m2 = re.search('(-f|--format(=)?)\s*(?P<format>\w+)',
+                       inline_argv)
+    else:
+        return None
+
+    if m2:
+        cmdname = m2.group('format')
+        inline_argv = inline_argv.replace(m2.group(0), '')
+        return (cmdname, inline_argv)
+
+    return None
+
 class Creator(cmdln.Cmdln):
     """${name}: create an image
 
@@ -108,6 +131,45 @@ class Creator(cmdln.Cmdln):
                              dest='copy_kernel',
                              help='Copy kernel files from image /boot directory'
                                   ' to the image output directory.')
+        optparser.add_option('', '--offline', action='store_true',
+                             dest='offline', default=False,
+                             help='Use the cached repo metadata only, without'
+                                  ' retrieving it; the packages not cached'
+                                  ' are still downloaded')
+        optparser.add_option('', '--metadata-expire', type='int',
+                             dest='metadata_expire', default=None,
+                             metavar='SECONDS',
+                             help='Seconds to trust the cached repo metadata'
+                                  ' before revalidating it')
+        optparser.add_option('', '--download-rate', type='int',
+                             dest='download_rate', default=None,
+                             metavar='KBPS',
+                             help='Cap the total bandwidth of package'
+                                  ' downloads, in KB/s')
+        optparser.add_option('', '--fresh-solve', action='store_true',
+                             dest='fresh_solve', default=False,
+                             help='Resolve the dependencies again even if'
+                                  ' the result is cached')
+        optparser.add_option('', '--no-base-snapshot', action='store_false',
+                             dest='base_snapshot', default=True,
+                             help='Install the %basepackages of kickstart'
+                                  ' along with the others, not from the'
+                                  ' cached snapshot')
+        optparser.add_option('', '--checkpoint', action='store_true',
+                             dest='checkpoint', default=False,
+                             help='Keep a checkpoint of the build after its'
+                                  ' packages were installed, to resume it'
+                                  ' from if it fails')
+        optparser.add_option('', '--resume', action='store_true',
+                             dest='resume', default=False,
+                             help='Resume a failed build from the checkpoint'
+                                  ' after its packages were installed,'
+                                  ' implies --checkpoint')
+        optparser.add_option('', '--formats', type='string', dest='formats',
+                             default=None, metavar='FORMATS',
+                             help='Create the images of these formats as'
+                                  ' well from the same install, joined by'
+                                  ' ",", valid values: "loop", "raw", "fs"')
         return optparser
 
     def preoptparse(self, argv):
@@ -212,6 +274,35 @@ class Creator(cmdln.Cmdln):
         if self.options.copy_kernel:
             configmgr.create['copy_kernel'] = self.options.copy_kernel
 
+        if self.options.offline:
+            configmgr.create['offline'] = True
+
+        if self.options.metadata_expire is not None:
+            configmgr.create['metadata_expire'] = self.options.metadata_expire
+
+        if self.options.download_rate is not None:
+            configmgr.create['download_rate'] = self.options.download_rate
+
+        if self.options.fresh_solve:
+            configmgr.create['fresh_solve'] = True
+
+        if not self.options.base_snapshot:
+            configmgr.create['base_snapshot'] = False
+
+        if self.options.resume:
+            configmgr.create['resume'] = True
+            configmgr.create['checkpoint'] = True
+
+        if self.options.checkpoint:
+            configmgr.create['checkpoint'] = True
+
+        if self.options.formats is not None:
+            try:
+                configmgr.create['formats'] = \
+                        multi.parse_formats(self.options.formats)
+            except errors.CreatorError, err:
+                raise errors.Usage(str(err))
+
     def main(self, argv=None):
         if argv is None:
             argv = sys.argv
@@ -253,28 +344,6 @@ class Creator(cmdln.Cmdln):
 
         ${cmd_option_list}
         """
-        def parse_magic_line(re_str, pstr, ptype='mic'):
-            ptn = re.compile(re_str)
-            m = ptn.match(pstr)
-            if not m or not m.groups():
-                return None
-
-            inline_argv = m.group(1).strip()
-            if ptype == 'mic':
-                m2 = re.search('(?P<format>\w+)', inline_argv)
-            elif ptype == 'mic2':
-                m2 = re.search('(-f|--format(=)?)\s*(?P<format>\w+)',
-                               inline_argv)
-            else:
-                return None
-
-            if m2:
-                cmdname = m2.group('format')
-                inline_argv = inline_argv.replace(m2.group(0), '')
-                return (cmdname, inline_argv)
-
-            return None
-
         if not args:
             self.do_help(['help', subcmd])
             return None
@@ -282,10 +351,20 @@ class Creator(cmdln.Cmdln):
         if len(args) != 1:
             raise errors.Usage("Extra arguments given")
 
-        if not os.path.exists(args[0]):
-            raise errors.CreatorError("Can't find the file: %s" % args[0])
+        result = self._get_magic_argv(args[0])
+        argv = ' '.join(result + args).split()
+        self.main(argv)
+
+    def _get_magic_argv(self, ksfile):
+        """ The format and the inline options in the magic line of ksfile
 
-        with open(args[0], 'r') as rf:
+            return: (format, inline_argv)
+        """
+
+        if not os.path.exists(ksfile):
+            raise errors.CreatorError("Can't find the file: %s" % ksfile)
+
+        with open(ksfile, 'r') as rf:
             first_line = rf.readline()
 
         mic_re = '^#\s*-\*-mic-options-\*-\s+(.*)\s+-\*-mic-options-\*-'
@@ -294,12 +373,134 @@ class Creator(cmdln.Cmdln):
         result = parse_magic_line(mic_re, first_line, 'mic') \
                  or parse_magic_line(mic2_re, first_line, 'mic2')
         if not result:
-            raise errors.KsError("Invalid magic line in file: %s" % args[0])
+            raise errors.KsError("Invalid magic line in file: %s" % ksfile)
 
         if result[0] not in self._subcmds:
             raise errors.KsError("Unsupport format '%s' in %s"
-                                 % (result[0], args[0]))
+                                 % (result[0], ksfile))
+
+        return result
+
+    @cmdln.option("-j", "--jobs", type='int', dest="jobs", default=1,
+                  help="Run at most JOBS builds at once, 1 by default")
+    @cmdln.option("--format", type='string', dest="format", default=None,
+                  help="Create the images of this format, by default the one"
+                       " in the magic line of each ks file")
+    @cmdln.option("--max-loops", type='int', dest="max_loops", default=0,
+                  help="Use at most MAX_LOOPS loop devices at once, by"
+                       " default the free ones")
+    @cmdln.option("--max-load", type='float', dest="max_load", default=0,
+                  help="Start no build while the load average is above"
+                       " MAX_LOAD, by default the number of CPUs")
+    @cmdln.option("--min-free-disk", type='int', dest="min_free_disk",
+                  default=1024,
+                  help="Start no build which would leave less than"
+                       " MIN_FREE_DISK MB free in the tmp dir")
+    def do_batch(self, subcmd, opts, *args):
+        """${cmd_name}: create the images of several ks files
+
+        The repo metadata and indexes are retrieved once for all the builds,
+        which run in parallel in the processes forked from this one, as many
+        as the loop devices, the disk space and the load allow. The packages
+        all the ks files share are installed once into a snapshot, which
+        the builds start from. The log of each build and the summary of the
+        batch are written in the output dir.
+
+        Usage:
+            ${name} ${cmd_name} <ksfile>... [OPTS]
+
+        ${cmd_option_list}
+        """
+
+        if not args:
+            self.do_help(['help', subcmd])
+            return None
+
+        if opts.format is not None and opts.format not in self._subcmds:
+            raise errors.Usage("Unsupport format '%s', valid ones: %s"
+                               % (opts.format, ', '.join(self._subcmds)))
+
+        creatoropts = configmgr.create
+        builds = []
+        pkglists = []
+        for ksfile in args:
+            if opts.format:
+                if not os.path.exists(ksfile):
+                    raise errors.CreatorError("Can't find the file: %s"
+                                              % ksfile)
+                argv = [opts.format, ksfile]
+            else:
+                argv = ' '.join(self._get_magic_argv(ksfile) + (ksfile,)) \
+                       .split()
+
+            build = batch.BatchBuild(ksfile, argv, argv[0])
+            if build.name in [b.name for b in builds]:
+                raise errors.Usage("More than one ks file named %s"
+                                   % os.path.basename(ksfile))
+
+            # the metadata is retrieved here once, for the builds to share
+            ksconf = misc.normalize_ksfile(ksfile, creatoropts['release'],
+                                           creatoropts['arch'])
+            try:
+                ks = kickstart.read_kickstart(ksconf)
+                pkglists.append(kickstart.get_packages(ks))
+                (build.loops, build.disk) = \
+                        batch.estimate_resources(ks, build.format)
+
+                msger.info("Retrieving repo metadata of %s:" % build.name)
+                repomd = misc.get_metadata_from_repos(
+                                            misc.get_repostrs_from_ks(ks),
+                                            creatoropts['cachedir'],
+                                            creatoropts['metadata_threads'],
+                                            creatoropts['metadata_expire'],
+                                            creatoropts['offline'])
+                misc.get_arch(repomd)
+                msger.raw(" DONE")
+            except errors.CreatorError, err:
+                msger.warning("%s, left to the build of %s"
+                              % (err, build.name))
+            except SystemExit, err:
+                # msger.error() of one ks fails its build only
+                msger.warning("failed to prepare the build of %s"
+                              % build.name)
+                if isinstance(err.code, int) and err.code:
+                    build.status = err.code
+                else:
+                    build.status = 1
+
+            builds.append(build)
+
+        # the packages all the kickstarts share are installed once, the
+        # builds start from the snapshot of them
+        if creatoropts['base_snapshot'] and len(pkglists) > 1 and \
+           len(pkglists) == len(builds):
+            creatoropts['base_packages'] = \
+                    snapshot.common_packages(pkglists)
+            msger.info("%d packages shared by the kickstarts are the base of"
+                       " their builds" % len(creatoropts['base_packages']))
+
+        outdir = creatoropts['outdir']
+        scheduler = batch.BatchScheduler(
+                        lambda build: self.main(build.argv),
+                        jobs = opts.jobs,
+                        max_loops = opts.max_loops,
+                        max_load = opts.max_load,
+                        min_free_disk = opts.min_free_disk,
+                        tmpdir = creatoropts['tmpdir'],
+                        logdir = os.path.join(outdir, "batch-logs"))
+        scheduler.run(builds)
+
+        summary = os.path.join(outdir, "batch-summary.txt")
+        batch.write_summary(builds, summary)
+        msger.raw(batch.format_summary(builds))
+        msger.info("The summary of the batch can be found here:\n  %s"
+                   % summary)
+
+        failed = [build for build in builds if build.status != 0]
+        if failed:
+            msger.warning("%d of %d builds failed"
+                          % (len(failed), len(builds)))
+            return 1
+        return 0
 
-        argv = ' '.join(result + args).split()
-        self.main(argv)
 
@@ -26,13 +26,20 @@ import subprocess
 import re
 import tarfile
 import glob
+import cPickle as pickle
 
 import rpm
 
 from mic import kickstart
 from mic import msger
 from mic.utils.errors import CreatorError, Abort
-from mic.utils import misc, rpmmisc, runner, fs_related as fs
+from mic.utils import misc, rpmmisc, runner, transcache, pkgmatch, \
+                      snapshot, fs_related as fs
+
+CHECKPOINT_DIR = "checkpoints"
+
+# the checkpoints of the failed builds kept
+CHECKPOINT_KEEP = 4
 
 class BaseImageCreator(object):
     """Installs a system to a chroot directory.
@@ -75,6 +82,11 @@ class BaseImageCreator(object):
         self.target_arch = "noarch"
         self._local_pkgs_path = None
         self.pack_to = None
+        self._checkpoint_key = None
+
+        # the packages required by the images of other formats, which are
+        # built from the install root of this one
+        self._extra_pkgs = []
 
         # If the kernel is save to the destdir when copy_kernel cmd is called.
         self._need_copy_kernel = False
@@ -236,6 +248,21 @@ class BaseImageCreator(object):
         """
         pass
 
+    def _configure_format(self):
+        """Apply the configuration specific to the image format.
+
+        This is the hook where subclasses may adjust the install root for
+        their format, e.g. the permissions of the files the format needs.
+
+        This hook is called while the install root is still mounted, after the
+        packages have been installed, either by configure() or by
+        install_from() when the install root is copied from another creator.
+
+        There is no default implementation.
+
+        """
+        pass
+
     def _create_bootconfig(self):
         """Configure the image so that it's bootable.
 
@@ -774,24 +801,27 @@ class BaseImageCreator(object):
         self.__builddir = None
 
     def __is_excluded_pkg(self, pkg):
-        if pkg in self._excluded_pkgs:
+        if self._excluded_matcher is None:
+            self._excluded_matcher = \
+                    pkgmatch.PackageMatcher(self._excluded_pkgs)
+
+        if pkg in self._excluded_matcher.exact:
+            self._excluded_matcher.discard(pkg)
             self._excluded_pkgs.remove(pkg)
             return True
 
-        for xpkg in self._excluded_pkgs:
-            if xpkg.endswith('*'):
-                if pkg.startswith(xpkg[:-1]):
-                    return True
-            elif xpkg.startswith('*'):
-                if pkg.endswith(xpkg[1:]):
-                    return True
+        if self._excluded_matcher.match(pkg):
+            return True
 
         return None
 
-    def __select_packages(self, pkg_manager):
+    def __select_packages(self, pkg_manager, pkgs = None):
+        if pkgs is None:
+            pkgs = self._required_pkgs
+
         skipped_pkgs = []
-        for pkg in self._required_pkgs:
-            e = pkg_manager.selectPackage(pkg)
+        errors = pkg_manager.selectPackages(pkgs)
+        for (pkg, e) in zip(pkgs, errors):
             if e:
                 if kickstart.ignore_missing(self.ks):
                     skipped_pkgs.append(pkg)
@@ -823,8 +853,7 @@ class BaseImageCreator(object):
             pkg_manager.deselectPackage(pkg)
 
     def __localinst_packages(self, pkg_manager):
-        for rpm_path in self._get_local_packages():
-            pkg_manager.installLocal(rpm_path)
+        pkg_manager.installLocalPkgs(self._get_local_packages())
 
     def __preinstall_packages(self, pkg_manager):
         if not self.ks:
@@ -834,6 +863,180 @@ class BaseImageCreator(object):
         for pkg in self._preinstall_pkgs:
             pkg_manager.preInstall(pkg)
 
+    def __get_repo_inputs(self, repo_urls):
+        """ The inputs of the solver besides the selection and the repo
+            metadata: the repo options and the pre-install packages
+        """
+
+        extra = []
+        for (name, baseurl, mirrorlist, inc, exc,
+             proxy, proxy_username, proxy_password, debuginfo,
+             source, gpgkey, disable, ssl_verify, cost, priority) \
+                in kickstart.get_repos(self.ks, repo_urls):
+            extra.append(("repo", name, baseurl, mirrorlist,
+                          sorted(inc or []), sorted(exc or []),
+                          cost, priority))
+        for pkg in kickstart.get_pre_packages(self.ks):
+            extra.append(("pre", pkg))
+
+        return extra
+
+    def __get_transaction_key(self, pkg_manager, repo_urls):
+        """ The key to memoize the dependency resolution of this build, None
+            if the repo metadata is unknown
+        """
+
+        if not self.ks or not getattr(self, 'repomd', None):
+            return None
+
+        extra = self.__get_repo_inputs(repo_urls)
+        for rpm_path in self._get_local_packages():
+            st = os.stat(rpm_path)
+            extra.append(("local", rpm_path, st.st_size, int(st.st_mtime)))
+        if self._base_key:
+            extra.append(("base", self._base_key))
+
+        return transcache.get_key(self.repomd, self.target_arch,
+                    self._required_pkgs,
+                    [(group.name, group.include)
+                     for group in self._required_groups],
+                    self._excluded_pkgs, pkg_manager.name, extra)
+
+    def __get_base_packages(self):
+        """ The base package set of the kickstart, or else the one shared
+            by the kickstarts of the batch, [] if there isn't one or the
+            snapshots can't be used
+        """
+
+        if not self.ks or not getattr(self, 'base_snapshot', False) or \
+           not getattr(self, 'repomd', None):
+            return []
+
+        base_pkgs = kickstart.get_base_packages(self.ks) or \
+                    getattr(self, 'base_packages', None) or []
+        excluded = pkgmatch.PackageMatcher(self._excluded_pkgs)
+        return [pkg for pkg in base_pkgs if not excluded.match(pkg)]
+
+    def __get_base_key(self, base_pkgs, repo_urls):
+        """ The key of the snapshot of the base packages: the inputs of their
+            resolution with the checksums of the repo metadata, so any
+            change of the resolved packages invalidates it
+        """
+
+        extra = self.__get_repo_inputs(repo_urls)
+        extra.append(("excludedocs", kickstart.exclude_docs(self.ks)))
+        extra.append(("langs", kickstart.inst_langs(self.ks)))
+
+        return transcache.get_key(self.repomd, self.target_arch, base_pkgs,
+                                  [], self._excluded_pkgs, self.pkgmgr.name,
+                                  extra)
+
+    def __add_repositories(self, pkg_manager, repo_urls):
+        for repo in kickstart.get_repos(self.ks, repo_urls):
+            (name, baseurl, mirrorlist, inc, exc,
+             proxy, proxy_username, proxy_password, debuginfo,
+             source, gpgkey, disable, ssl_verify, cost, priority) = repo
+
+            yr = pkg_manager.addRepository(name, baseurl, mirrorlist, proxy,
+                        proxy_username, proxy_password, inc, exc, ssl_verify,
+                        cost, priority)
+
+    def __build_base(self, base_pkgs, base_key, repo_urls):
+        """ Install the base packages into the install root
+
+            It's done in a child process, so the state of the package manager
+            doesn't leak into the install of the rest.
+
+            return: the manifest of the snapshot
+        """
+
+        (fd, manifest_file) = self._mkstemp(prefix = "base-")
+        os.close(fd)
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                pkg_manager = self.get_pkg_manager()
+                try:
+                    pkg_manager.setup()
+                    self.__add_repositories(pkg_manager, repo_urls)
+                    self.__preinstall_packages(pkg_manager)
+                    self.__select_packages(pkg_manager, base_pkgs)
+                    self.__deselect_packages(pkg_manager)
+                    if self.target_arch:
+                        pkg_manager._add_prob_flags(
+                                rpm.RPMPROB_FILTER_IGNOREARCH)
+                    pkg_manager.trans_key = base_key
+                    pkg_manager.fresh_solve = getattr(self, 'fresh_solve',
+                                                      False)
+                    pkg_manager.runInstall()
+
+                    content = pkg_manager.getAllContent()
+                    with open(manifest_file, 'wb') as wf:
+                        pickle.dump({'packages': sorted(content.keys()),
+                                     'content': content,
+                                     'license': pkg_manager.getPkgsLicense()},
+                                    wf, pickle.HIGHEST_PROTOCOL)
+                    status = 0
+                finally:
+                    pkg_manager.close()
+            except Exception, err:
+                msger.warning("failed to install the base packages: %s" % err)
+            finally:
+                os._exit(status)
+
+        (pid, status) = os.waitpid(pid, 0)
+        if status != 0:
+            raise CreatorError("Failed to install the base packages")
+
+        with open(manifest_file, 'rb') as rf:
+            return pickle.load(rf)
+
+    def __install_base(self, base_pkgs, repo_urls):
+        """ Start the install root from the snapshot of the base packages,
+            or install them and save the snapshot for the next builds
+        """
+
+        base_key = self.__get_base_key(base_pkgs, repo_urls)
+        store = snapshot.SnapshotStore(self.cachedir)
+
+        skip = []
+        if self.qemu_emulator:
+            skip.append(self.qemu_emulator)
+
+        # the builds of the same base wait for the first to save it
+        with store.lock(base_key):
+            manifest = store.restore(base_key, self._instroot)
+            if manifest is not None:
+                msger.info("Start from the snapshot of %d base packages"
+                           % len(manifest['packages']))
+            else:
+                msger.info("Installing %d base packages for the snapshot ..."
+                           % len(base_pkgs))
+                manifest = self.__build_base(base_pkgs, base_key, repo_urls)
+                store.save(base_key, self._instroot, manifest, skip)
+
+        self._base_key = base_key
+        self._base_content = manifest['content']
+        self._base_license = manifest['license']
+        self._root_fs_avail = misc.get_filesystem_avail(self._instroot)
+
+    def __merge_base_records(self, content, license):
+        """ Add the records of the base packages to the ones of the rest """
+
+        pkgs_content = dict(self._base_content)
+        pkgs_content.update(content)
+
+        pkgs_license = {}
+        for records in (self._base_license, license):
+            for (lic, pkgs) in records.iteritems():
+                pkgs_license.setdefault(lic, [])
+                pkgs_license[lic].extend([pkg for pkg in pkgs
+                                          if pkg not in pkgs_license[lic]])
+
+        return (pkgs_content, pkgs_license)
+
     def __attachment_packages(self, pkg_manager):
         if not self.ks:
             return
@@ -874,45 +1077,107 @@ class BaseImageCreator(object):
                     fpath = os.path.join(root, fname)
                     self._attachment.append(fpath)
 
-    def install(self, repo_urls = {}):
-        """Install packages into the install root.
-
-        This function installs the packages listed in the supplied kickstart
-        into the install root. By default, the packages are installed from the
-        repository URLs specified in the kickstart.
+    def __get_checkpoint_key(self, repo_urls):
+        """ The key of the checkpoint of this build by all the inputs of its
+            install: the same ones as of its transaction, with the imager
+            and the partition layout, but not the %post scripts
+        """
 
-        repo_urls -- a dict which maps a repository name to a repository URL;
-                     if supplied, this causes any repository URLs specified in
-                     the kickstart to be overridden.
+        if not self.ks:
+            return None
 
+        extra = self.__get_repo_inputs(repo_urls)
+        for rpm_path in self._get_local_packages():
+            st = os.stat(rpm_path)
+            extra.append(("local", rpm_path, st.st_size, int(st.st_mtime)))
+        extra.append(("base", self.__get_base_packages()))
+        extra.append(("excludedocs", kickstart.exclude_docs(self.ks)))
+        extra.append(("langs", kickstart.inst_langs(self.ks)))
+        extra.append(("imager", self.__class__.__name__, self.name))
+        extra.append(("layout", [str(part).strip() for part in
+                                 kickstart.get_partitions(self.ks)]))
+
+        return transcache.get_key(getattr(self, 'repomd', None),
+                    self.target_arch, self._required_pkgs,
+                    [(group.name, group.include)
+                     for group in self._required_groups],
+                    self._excluded_pkgs, self.pkgmgr.name, extra)
+
+    def __get_checkpoints(self):
+        return snapshot.SnapshotStore(self.cachedir, CHECKPOINT_KEEP,
+                                      CHECKPOINT_DIR)
+
+    def __save_checkpoint(self):
+        """ Keep the install root and the state of the creator after the
+            install, to resume from there if a later phase fails
         """
 
-        # initialize pkg list to install
-        if self.ks:
-            self.__sanity_check()
-
-            self._required_pkgs = \
-                kickstart.get_packages(self.ks, self._get_required_packages())
-            self._excluded_pkgs = \
-                kickstart.get_excluded(self.ks, self._get_excluded_packages())
-            self._required_groups = kickstart.get_groups(self.ks)
-        else:
-            self._required_pkgs = None
-            self._excluded_pkgs = None
-            self._required_groups = None
+        if not self._checkpoint_key:
+            return
 
-        pkg_manager = self.get_pkg_manager()
-        pkg_manager.setup()
+        attachment = []
+        files = []
+        for fpath in getattr(self, '_attachment', []):
+            if fpath.startswith(self._instroot + "/"):
+                attachment.append(fpath[len(self._instroot):])
+            elif os.path.isfile(fpath):
+                files.append(fpath)
+
+        state = {'phase': 'install',
+                 'content': self._pkgs_content,
+                 'license': self._pkgs_license,
+                 'attachment': attachment}
+
+        skip = []
+        if self.qemu_emulator:
+            skip.append(self.qemu_emulator)
+
+        msger.info("Saving the checkpoint of the install root ...")
+        store = self.__get_checkpoints()
+        with store.lock(self._checkpoint_key):
+            store.save(self._checkpoint_key, self._instroot, state, skip,
+                       files)
+
+    def __resume_install(self):
+        """ Restore the install root and the state of the creator from the
+            checkpoint of this build
+
+            return: False if there isn't one
+        """
 
-        for repo in kickstart.get_repos(self.ks, repo_urls):
-            (name, baseurl, mirrorlist, inc, exc,
-             proxy, proxy_username, proxy_password, debuginfo,
-             source, gpgkey, disable, ssl_verify, cost, priority) = repo
+        store = self.__get_checkpoints()
+        if not self._checkpoint_key or \
+           not store.has(self._checkpoint_key):
+            msger.warning("No checkpoint of this build to resume, "
+                          "install it from scratch")
+            return False
+
+        msger.info("Resuming from the checkpoint of the install root ...")
+        with store.lock(self._checkpoint_key):
+            state = store.restore(self._checkpoint_key, self._instroot)
+            if state is None:
+                return False
+            files = store.get_files(self._checkpoint_key,
+                                    self._mkdtemp("attachment-"))
+
+        self._pkgs_content = state['content']
+        self._pkgs_license = state['license']
+        self._attachment = [self._instroot + path
+                            for path in state['attachment']] + files
+        msger.info("%d packages installed before" % len(self._pkgs_content))
+        return True
+
+    def drop_checkpoint(self):
+        """Drop the checkpoint of this build.
+
+        Call it once the image is done, it's only needed to resume a failed
+        build.
 
-            yr = pkg_manager.addRepository(name, baseurl, mirrorlist, proxy,
-                        proxy_username, proxy_password, inc, exc, ssl_verify,
-                        cost, priority)
+        """
+        if self._checkpoint_key:
+            self.__get_checkpoints().discard(self._checkpoint_key)
 
+    def __install_packages(self, repo_urls):
         if kickstart.exclude_docs(self.ks):
             rpm.addMacro("_excludedocs", "1")
         rpm.addMacro("_dbpath", "/var/lib/rpm")
@@ -920,6 +1185,18 @@ class BaseImageCreator(object):
         if kickstart.inst_langs(self.ks) != None:
             rpm.addMacro("_install_langs", kickstart.inst_langs(self.ks))
 
+        self._base_key = None
+        self._base_content = {}
+        self._base_license = {}
+        base_pkgs = self.__get_base_packages()
+        if base_pkgs:
+            self.__install_base(base_pkgs, repo_urls)
+
+        pkg_manager = self.get_pkg_manager()
+        pkg_manager.setup()
+
+        self.__add_repositories(pkg_manager, repo_urls)
+
         try:
             try:
                 self.__preinstall_packages(pkg_manager)
@@ -934,16 +1211,58 @@ class BaseImageCreator(object):
                     checksize -= BOOT_SAFEGUARD
                 if self.target_arch:
                     pkg_manager._add_prob_flags(rpm.RPMPROB_FILTER_IGNOREARCH)
+                pkg_manager.trans_key = \
+                    self.__get_transaction_key(pkg_manager, repo_urls)
+                pkg_manager.fresh_solve = getattr(self, 'fresh_solve', False)
                 pkg_manager.runInstall(checksize)
             except CreatorError, e:
                 raise
         finally:
-            self._pkgs_content = pkg_manager.getAllContent()
-            self._pkgs_license = pkg_manager.getPkgsLicense()
+            (self._pkgs_content, self._pkgs_license) = \
+                self.__merge_base_records(pkg_manager.getAllContent(),
+                                          pkg_manager.getPkgsLicense())
             self.__attachment_packages(pkg_manager)
 
             pkg_manager.close()
 
+    def install(self, repo_urls = {}):
+        """Install packages into the install root.
+
+        This function installs the packages listed in the supplied kickstart
+        into the install root. By default, the packages are installed from the
+        repository URLs specified in the kickstart.
+
+        repo_urls -- a dict which maps a repository name to a repository URL;
+                     if supplied, this causes any repository URLs specified in
+                     the kickstart to be overridden.
+
+        """
+
+        # initialize pkg list to install
+        if self.ks:
+            self.__sanity_check()
+
+            self._required_pkgs = \
+                kickstart.get_packages(self.ks, self._get_required_packages()
+                                                + self._extra_pkgs)
+            self._excluded_pkgs = \
+                kickstart.get_excluded(self.ks, self._get_excluded_packages())
+            self._excluded_matcher = None
+            self._required_groups = kickstart.get_groups(self.ks)
+        else:
+            self._required_pkgs = None
+            self._excluded_pkgs = None
+            self._excluded_matcher = None
+            self._required_groups = None
+
+        self._checkpoint_key = self.__get_checkpoint_key(repo_urls)
+        if not getattr(self, 'resume', False) or \
+           not self.__resume_install():
+            self.__install_packages(repo_urls)
+            if getattr(self, 'checkpoint', False) or \
+               getattr(self, 'resume', False):
+                self.__save_checkpoint()
+
         # hook post install
         self.postinstall()
 
@@ -959,6 +1278,39 @@ class BaseImageCreator(object):
     def postinstall(self):
         self.copy_attachment()
 
+    def install_from(self, creator):
+        """Install the system by copying the install root of another creator.
+
+        The system installed and configured by creator is copied into the
+        install root of this one, instead of installing and configuring it
+        again, then the bootloader of this image is set up. Both of the
+        install roots must be mounted.
+
+        creator -- the BaseImageCreator which has done install() and
+                   configure()
+
+        """
+        skip = []
+        for emulator in (creator.qemu_emulator, self.qemu_emulator):
+            if emulator:
+                skip.append(emulator)
+
+        msger.info("Copying the install root to %s ..." % self._instroot)
+        snapshot.copy_tree(creator._instroot, self._instroot,
+                           snapshot.SKIP_PATHS + tuple(skip))
+
+        self._pkgs_content = creator._pkgs_content
+        self._pkgs_license = creator._pkgs_license
+        self._attachment = []
+        for fpath in getattr(creator, '_attachment', []):
+            if fpath.startswith(creator._instroot + "/"):
+                fpath = self._instroot + fpath[len(creator._instroot):]
+            self._attachment.append(fpath)
+
+        self._configure_format()
+        self.postinstall()
+        self._create_bootconfig()
+
     def __run_post_scripts(self):
         msger.info("Running scripts ...")
         if os.path.exists(self._instroot + "/tmp"):
@@ -1020,6 +1372,8 @@ class BaseImageCreator(object):
         """
         ksh = self.ks.handler
 
+        self._configure_format()
+
         msger.info('Applying configurations ...')
         try:
             kickstart.LanguageConfig(self._instroot).apply(ksh.lang)
@@ -0,0 +1,140 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+
+from mic import msger
+from mic.utils import threadpool
+from mic.utils.errors import CreatorError
+
+from loop import LoopImageCreator
+from raw import RawImageCreator
+from fs import FsImageCreator
+
+# the formats which can be built from the install root of another one
+FORMATS = {
+    'loop': LoopImageCreator,
+    'raw': RawImageCreator,
+    'fs': FsImageCreator,
+}
+
+def parse_formats(formats):
+    """ Parse the comma separated list of formats
+
+        return: the list of the formats, without the duplicated ones
+    """
+
+    result = []
+    for fmt in formats.split(','):
+        fmt = fmt.strip()
+        if not fmt:
+            continue
+        if fmt not in FORMATS:
+            raise CreatorError("Unsupported format '%s' to build at once, "
+                               "valid ones: %s"
+                               % (fmt, ', '.join(sorted(FORMATS.keys()))))
+        if fmt not in result:
+            result.append(fmt)
+    return result
+
+class MultiImageCreator(object):
+    """Builds the images of several formats from one install.
+
+    The primary creator installs and configures the system as usual, then
+    the creator of each other format mounts its own image and copies the
+    finished install root into it. The images of the other formats are
+    packaged into a subdirectory of the output directory named by the
+    format, by 'workers' threads, one by default as packaging isn't known
+    to be thread safe.
+
+    It's used in place of the primary creator, the attributes it doesn't
+    handle are the ones of the primary creator.
+    """
+
+    def __init__(self, primary, formats, creatoropts, pkgmgr, workers = 1):
+        self.primary = primary
+        self.workers = workers
+
+        # [(format, creator)]
+        self.others = []
+        for fmt in formats:
+            if type(primary) is FORMATS[fmt]:
+                continue
+
+            creator = FORMATS[fmt](creatoropts, pkgmgr)
+            creator.destdir = os.path.join(primary.destdir, fmt)
+            creator._recording_pkgs = primary._recording_pkgs
+            self.others.append((fmt, creator))
+
+            primary._extra_pkgs.extend(creator._get_required_packages())
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def get_output_dirs(self):
+        """ The output dirs of the other formats """
+
+        return [fmt for (fmt, creator) in self.others]
+
+    def get_creators(self):
+        return [self.primary] + [creator for (fmt, creator) in self.others]
+
+    def check_depend_tools(self):
+        for creator in self.get_creators():
+            creator.check_depend_tools()
+
+    def configure(self, repodata = None):
+        self.primary.configure(repodata)
+
+        for (fmt, creator) in self.others:
+            msger.info("Creating %s image from the install root ..." % fmt)
+            creator.mount(None, self.primary.cachedir)
+            creator.install_from(self.primary)
+
+    def unmount(self):
+        for creator in self.get_creators():
+            creator.unmount()
+
+    def package(self, destdir = "."):
+        jobs = [(self.primary, destdir)]
+        for (fmt, creator) in self.others:
+            jobs.append((creator, os.path.join(destdir, fmt)))
+
+        def _package(job):
+            (creator, dest) = job
+            creator.package(dest)
+
+        results = threadpool.map_parallel(_package, jobs, self.workers)
+
+        for ((creator, dest), (ret, err)) in zip(jobs, results):
+            if err is not None:
+                raise CreatorError("Failed to package the image in %s: %s"
+                                   % (dest, err))
+
+    def print_outimage_info(self):
+        outimage = []
+        for creator in self.get_creators():
+            outimage.extend(creator.outimage)
+
+        msg = "The new images can be found here:\n"
+        for fpath in sorted(outimage):
+            msg += '  %s\n' % os.path.abspath(fpath)
+        msger.info(msg)
+
+    def cleanup(self):
+        for creator in reversed(self.get_creators()):
+            creator.cleanup()
@@ -59,7 +59,7 @@ class RawImageCreator(BaseImageCreator):
 
         self._dep_checks.extend(["sync", "kpartx", "parted", "extlinux"])
 
-    def configure(self, repodata = None):
+    def _configure_format(self):
         import subprocess
         def chroot():
             os.chroot(self._instroot)
@@ -69,8 +69,6 @@ class RawImageCreator(BaseImageCreator):
             subprocess.call(["/bin/chmod", "u+s", "/usr/bin/Xorg"],
                             preexec_fn = chroot)
 
-        BaseImageCreator.configure(self, repodata)
-
     def _get_fstab(self):
         s = ""
         for mp in self.__instloop.mountOrder:
@@ -23,7 +23,7 @@ import time
 import string
 
 from mic import msger
-from mic.utils import errors, misc, runner, fs_related as fs
+from mic.utils import errors, misc, runner, repoindex, fs_related as fs
 
 import pykickstart.sections as kssections
 import pykickstart.commands as kscommands
@@ -54,6 +54,21 @@ class PrepackageSection(kssections.Section):
     def handleHeader(self, lineno, args):
         kssections.Section.handleHeader(self, lineno, args)
 
+class BasePackageSection(kssections.Section):
+    sectionOpen = "%basepackages"
+
+    def handleLine(self, line):
+        if not self.handler:
+            return
+
+        (h, s, t) = line.partition('#')
+        line = h.rstrip()
+
+        self.handler.basepackages.add([line])
+
+    def handleHeader(self, lineno, args):
+        kssections.Section.handleHeader(self, lineno, args)
+
 class AttachmentSection(kssections.Section):
     sectionOpen = "%attachment"
 
@@ -111,10 +126,12 @@ def read_kickstart(path):
             superclass.__init__(self, mapping=commandMap[using_version])
             self.prepackages = ksparser.Packages()
             self.attachment = ksparser.Packages()
+            self.basepackages = ksparser.Packages()
 
     ks = ksparser.KickstartParser(KSHandlers(), errorsAreFatal=False)
     ks.registerSection(PrepackageSection(ks.handler))
     ks.registerSection(AttachmentSection(ks.handler))
+    ks.registerSection(BasePackageSection(ks.handler))
 
     try:
         ks.readKickstart(path)
@@ -805,6 +822,9 @@ def get_attachment(ks, required = []):
 def get_pre_packages(ks, required = []):
     return ks.handler.prepackages.packageList + required
 
+def get_base_packages(ks, required = []):
+    return ks.handler.basepackages.packageList + required
+
 def get_packages(ks, required = []):
     return ks.handler.packages.packageList + required
 
@@ -893,23 +913,25 @@ def resolve_groups(creatoropts, repometadata):
         groupfile = None
         if iszypp and repo["comps"]:
             groupfile = repo["comps"]
-            get_pkglist_handler = misc.get_pkglist_in_comps
+            kind = "comps"
         if not iszypp and repo["patterns"]:
             groupfile = repo["patterns"]
-            get_pkglist_handler = misc.get_pkglist_in_patterns
+            kind = "patterns"
 
         if groupfile:
-            i = 0
-            while True:
-                if i >= len(ks.handler.packages.groupList):
-                    break
-                pkglist = get_pkglist_handler(
-                                        ks.handler.packages.groupList[i].name,
-                                        groupfile)
-                if pkglist:
-                    del ks.handler.packages.groupList[i]
-                    for pkg in pkglist:
-                        if pkg not in ks.handler.packages.packageList:
-                            ks.handler.packages.packageList.append(pkg)
-                else:
-                    i = i + 1
+            groupidx = repoindex.get_group_index(groupfile, kind)
+            pkglist = ks.handler.packages.packageList
+            pkgset = set(pkglist)
+            remaining = []
+            for group in ks.handler.packages.groupList:
+                grppkgs = groupidx.get_packages(group.name)
+                if not grppkgs:
+                    remaining.append(group)
+                    continue
+
+                for pkg in grppkgs:
+                    if pkg not in pkgset:
+                        pkgset.add(pkg)
+                        pkglist.append(pkg)
+
+            ks.handler.packages.groupList[:] = remaining
@@ -88,9 +88,29 @@ class BackendPlugin(_Plugin):
         import rpm
         rpm.setVerbosity(rpm.RPMLOG_ERR)
 
+    # the key of the memoized dependency resolution, None to disable it,
+    # see mic.utils.transcache
+    trans_key = None
+    # solve again even if the resolved transaction is memoized
+    fresh_solve = False
+
     def addRepository(self):
         pass
 
+    def selectPackages(self, pkgs):
+        """ Select a list of packages, the backends may do it in batch
+
+            return: a list of None or the error for each of pkgs
+        """
+
+        return [self.selectPackage(pkg) for pkg in pkgs]
+
+    def installLocalPkgs(self, pkgs):
+        """ Add a list of local rpms, the backends may do it in batch """
+
+        for pkg in pkgs:
+            self.installLocal(pkg)
+
 def get_plugins(typen):
     ps = ImagerPlugin.get_plugins()
     if typen in ps:
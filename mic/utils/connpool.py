@@ -0,0 +1,132 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Process-wide pool of keep-alive http(s) connections
+
+    The pooled handlers are shared per proxy setting, and each of them keeps
+    the idle connections per host, so one connection is reused by all the
+    requests to the same (scheme, host, proxy).
+"""
+
+from __future__ import with_statement
+import socket
+import threading
+import urllib2
+
+from pykickstart.urlgrabber import keepalive
+
+_stats = {'created': 0, 'reused': 0}
+_stats_lock = threading.Lock()
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+# the timeout of the request being opened in this thread
+_local = threading.local()
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+def get_stats():
+    """ Get the counters of connections: 'created' and 'reused' """
+
+    with _stats_lock:
+        return dict(_stats)
+
+def _get_ssl_context():
+    # skip ssl verification, the same as what myurlgrab does
+    try:
+        import ssl
+        return ssl._create_unverified_context()
+    except (ImportError, AttributeError):
+        return None
+
+def _connection_args():
+    timeout = getattr(_local, 'timeout', None)
+    if timeout is None or timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        return {}
+    return {'timeout': timeout}
+
+class _PoolMixin:
+    def _open(self, req):
+        _local.timeout = getattr(req, 'timeout', None)
+        return self.do_open(req)
+
+    def _reuse_connection(self, h, req, host):
+        r = keepalive.KeepAliveHandler._reuse_connection(self, h, req, host)
+        if r:
+            _count('reused')
+        return r
+
+class HTTPHandler(_PoolMixin, keepalive.HTTPHandler):
+    def http_open(self, req):
+        return self._open(req)
+
+    def _get_connection(self, host):
+        _count('created')
+        return keepalive.HTTPConnection(host, **_connection_args())
+
+class HTTPSHandler(_PoolMixin, keepalive.KeepAliveHandler,
+                   urllib2.HTTPSHandler):
+    def __init__(self):
+        keepalive.KeepAliveHandler.__init__(self)
+        urllib2.HTTPSHandler.__init__(self)
+        self._context = _get_ssl_context()
+
+    def https_open(self, req):
+        return self._open(req)
+
+    def _get_connection(self, host):
+        _count('created')
+        kwargs = _connection_args()
+        if self._context:
+            kwargs['context'] = self._context
+        return keepalive.HTTPSConnection(host, **kwargs)
+
+def _get_handlers(proxies):
+    key = tuple(sorted((proxies or {}).items()))
+    with _handlers_lock:
+        if key not in _handlers:
+            handlers = [HTTPHandler()]
+            if 'https' in (proxies or {}):
+                # https through proxy needs CONNECT tunnel, which keepalive
+                # can't do, use the stock handler for it
+                context = _get_ssl_context()
+                if context:
+                    handlers.append(urllib2.HTTPSHandler(context = context))
+            else:
+                handlers.append(HTTPSHandler())
+            _handlers[key] = handlers
+        return _handlers[key]
+
+def build_opener(proxies = None, *handlers):
+    """ Build urllib2 opener on the pooled connections of proxies """
+
+    handlers = list(handlers)
+    handlers.append(urllib2.ProxyHandler(proxies or {}))
+    handlers.extend(_get_handlers(proxies))
+    return urllib2.build_opener(*handlers)
+
+def close_all():
+    """ Close all the idle connections in the pool """
+
+    with _handlers_lock:
+        for handlers in _handlers.values():
+            for handler in handlers:
+                if isinstance(handler, keepalive.KeepAliveHandler):
+                    handler.close_all()
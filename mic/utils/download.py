@@ -0,0 +1,281 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from __future__ import with_statement
+import os
+import time
+import urlparse
+import threading
+import Queue
+
+from mic import msger
+from errors import CreatorError
+from rpmmisc import terminal_width
+import urlfetch
+import threadpool
+import mirror
+import locks
+
+DEFAULT_THREADS = 8
+MAX_PER_HOST = 4
+RETRIES = 3
+BACKOFF = 1.0
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "%.1f%s" % (size, unit)
+        size /= 1024.0
+    return "%.1fGB" % size
+
+class DownloadProgress(object):
+    """ One status line for all the parallel downloads, instead of one line
+        per file as TextProgress does
+    """
+
+    # seconds between two refreshes of the status line
+    interval = 0.5
+
+    def __init__(self, total, totalsize = 0):
+        self.total = total
+        self.totalsize = totalsize
+        self.done = 0
+        self.received = 0
+        self.started = time.time()
+        self._shown = 0
+        self._lock = threading.Lock()
+
+    def update(self, size):
+        with self._lock:
+            self.received += size
+            if time.time() - self._shown >= self.interval:
+                self._show()
+
+    def finish(self, name):
+        with self._lock:
+            self.done += 1
+            msger.verbose("\rRetrieved %s" % name)
+            self._show()
+            if self.done == self.total:
+                msger.raw("\n")
+
+    def _show(self):
+        self._shown = time.time()
+        elapsed = max(self._shown - self.started, 0.001)
+        if self.totalsize:
+            size = "%s/%s" % (_format_size(self.received),
+                              _format_size(self.totalsize))
+        else:
+            size = _format_size(self.received)
+
+        line = "Retrieving packages [%d/%d] %s %s/s" \
+               % (self.done, self.total, size,
+                  _format_size(self.received / elapsed))
+        msger.info("\r%-*s" % (terminal_width() - 10, line))
+
+class BandwidthLimiter(object):
+    """ A token bucket shared by all the downloads, rate in bytes/s """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = 0
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            # allow one second of burst at most
+            self._tokens = min(self._tokens + (now - self._last) * self.rate,
+                               self.rate)
+            self._last = now
+            self._tokens -= size
+            wait = -self._tokens / float(self.rate)
+
+        if wait > 0:
+            time.sleep(wait)
+
+class Downloader(object):
+    """ Download many files concurrently with at most 'threads' transfers in
+        total and 'per_host' ones to the same host, each file is retried
+        with exponential backoff and fails over to the other mirrors.
+
+        rate: global bandwidth cap in bytes/s, 0 for unlimited
+    """
+
+    def __init__(self, threads = DEFAULT_THREADS, per_host = MAX_PER_HOST,
+                 rate = 0, retries = RETRIES, backoff = BACKOFF):
+        self.threads = threads
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = BandwidthLimiter(rate)
+        self.progress = None
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse.urlparse(url)[1]
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.per_host)
+            return self._hosts[host]
+
+    def _transfer(self, url, filename, proxies, sumtype = None,
+                  checksum = None):
+        # continue the partial file left by the former try, if any
+        partfile = filename + ".part"
+        offset = 0
+        headers = []
+        if os.path.exists(partfile):
+            offset = os.path.getsize(partfile)
+            if offset:
+                headers.append(('Range', 'bytes=%d-' % offset))
+
+        slot = self._host_slot(url)
+        slot.acquire()
+        try:
+            try:
+                fobj = urlfetch.urlopen(url, proxies, headers)
+            except urlfetch.RangeNotSatisfiable:
+                # nothing more to get, the checksum tells if it's right
+                fobj = None
+
+            if fobj:
+                mode = 'wb'
+                if offset and getattr(fobj, 'code', None) == 206:
+                    msger.verbose("resume %s from %d" % (url, offset))
+                    mode = 'ab'
+                try:
+                    with open(partfile, mode) as wf:
+                        while True:
+                            data = fobj.read(urlfetch.BLOCK_SIZE)
+                            if not data:
+                                break
+                            self.limiter.consume(len(data))
+                            wf.write(data)
+                            if self.progress:
+                                self.progress.update(len(data))
+                except (IOError, OSError), err:
+                    raise CreatorError("URLGrabber error: %s: %s"
+                                       % (url, err))
+                finally:
+                    fobj.close()
+        finally:
+            slot.release()
+
+        if sumtype and checksum and \
+           urlfetch.file_checksum(partfile, sumtype) != checksum:
+            # corrupted, the next try starts from scratch
+            os.unlink(partfile)
+            raise CreatorError("Checksum mismatch of %s" % url)
+
+        os.rename(partfile, filename)
+        return filename
+
+    def fetch(self, baseurl, relpath, filename, proxies = None,
+              sumtype = None, checksum = None):
+        """ Download relpath under baseurl to filename, with retries, the
+            file is verified if checksum is given
+        """
+
+        dirn = os.path.dirname(filename)
+        if not os.path.exists(dirn):
+            os.makedirs(dirn)
+
+        # one process fetches it, the others sharing the cachedir wait and
+        # reuse the file
+        with locks.artifact_lock(filename):
+            if self._is_done(filename, sumtype, checksum):
+                msger.verbose("reuse %s" % filename)
+                return filename
+
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    return mirror.fetch_from_mirrors(baseurl, relpath,
+                                lambda url: self._transfer(url, filename,
+                                                           proxies, sumtype,
+                                                           checksum),
+                                spread = True)
+                except CreatorError, err:
+                    if attempt == self.retries:
+                        raise
+                    msger.verbose("retry %s in %.1fs: %s"
+                                  % (relpath, delay, err))
+                    time.sleep(delay)
+                    delay *= 2
+
+    def _is_done(self, filename, sumtype, checksum):
+        if not os.path.exists(filename):
+            return False
+        if not sumtype or not checksum:
+            return True
+        return urlfetch.file_checksum(filename, sumtype) == checksum
+
+    def iter_download(self, jobs, totalsize = 0):
+        """ Download jobs of (baseurl, relpath, filename, proxies), or with
+            (sumtype, checksum) appended to verify the files, in background
+
+            yield: (index, filename, error) of each job once it's finished,
+                   in the order of completion
+        """
+
+        self.progress = DownloadProgress(len(jobs), totalsize)
+        finished = Queue.Queue()
+
+        def _download(item):
+            (index, job) = item
+            try:
+                filename = self.fetch(*job)
+            except Exception, err:
+                finished.put((index, None, err))
+            else:
+                self.progress.finish(os.path.basename(filename))
+                finished.put((index, filename, None))
+
+        t = threading.Thread(target = threadpool.map_parallel,
+                             args = (_download, enumerate(jobs),
+                                     self.threads))
+        t.setDaemon(True)
+        t.start()
+
+        try:
+            for i in range(len(jobs)):
+                # get with timeout, else ^C can't interrupt the main thread
+                while True:
+                    try:
+                        yield finished.get(True, 0.5)
+                        break
+                    except Queue.Empty:
+                        continue
+        finally:
+            self.progress = None
+
+    def download(self, jobs, totalsize = 0):
+        """ Download all the jobs, see iter_download
+
+            return: a list of (filename, error) in the order of jobs
+        """
+
+        results = [None] * len(jobs)
+        for (index, filename, err) in self.iter_download(jobs, totalsize):
+            results[index] = (filename, err)
+        return results
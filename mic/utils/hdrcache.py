@@ -0,0 +1,201 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Cache of rpm headers
+
+    A header is read from the rpm once, then kept with the fields mic uses
+    and its blob, by the (path, size, mtime) of the rpm: in memory for the
+    build and on disk in <cachedir>/<xx>/<sha1 of path> for the next ones.
+    Many headers are read in parallel by a pool of processes.
+"""
+
+from __future__ import with_statement
+import os
+import tempfile
+import hashlib
+import cPickle as pickle
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+import rpm
+
+from mic import msger
+from errors import CreatorError
+
+# the header fields mic uses
+FIELDS = ('name', 'arch', 'version', 'release', 'epoch', 'license')
+
+# bump it when the layout of the cache files changes
+CACHE_VERSION = 1
+
+_ts = None
+
+def _get_ts():
+    global _ts
+    if _ts is None:
+        _ts = rpm.TransactionSet()
+        _ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
+    return _ts
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_size, int(st.st_mtime))
+
+def _read_header(path):
+    """ Read the header of rpm 'path', run in the worker processes
+
+        return: (path, key, fields, blob), or (path, None, error, None)
+    """
+
+    try:
+        key = _stat_key(path)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            hdr = _get_ts().hdrFromFdno(fd)
+        finally:
+            os.close(fd)
+    except (OSError, rpm.error), err:
+        return (path, None, str(err), None)
+
+    fields = dict([(field, hdr[field]) for field in FIELDS])
+    return (path, key, fields, hdr.unload())
+
+def _load_blob(blob):
+    if hasattr(rpm, 'headerLoad'):
+        return rpm.headerLoad(blob)
+    return rpm.hdr(blob)
+
+class HeaderCache(object):
+    def __init__(self, cachedir = None, workers = None):
+        self.cachedir = cachedir
+        self.workers = workers
+        self._info = {}
+        self._blobs = {}
+
+    def _cache_file(self, path):
+        digest = hashlib.sha1(path).hexdigest()
+        return os.path.join(self.cachedir, digest[:2], digest)
+
+    def _load_cached(self, path, key):
+        if not self.cachedir:
+            return False
+
+        try:
+            with open(self._cache_file(path), 'rb') as rf:
+                data = pickle.load(rf)
+        except Exception:
+            return False
+
+        if data.get('version') != CACHE_VERSION or data.get('key') != key:
+            return False
+
+        self._info[path] = (key, data['fields'])
+        self._blobs[path] = data['blob']
+        return True
+
+    def _save_cached(self, path, key, fields, blob):
+        if not self.cachedir:
+            return
+
+        cachefile = self._cache_file(path)
+        try:
+            if not os.path.isdir(os.path.dirname(cachefile)):
+                os.makedirs(os.path.dirname(cachefile))
+            (fd, tmpfile) = tempfile.mkstemp(dir = os.path.dirname(cachefile))
+            with os.fdopen(fd, 'wb') as wf:
+                pickle.dump({'version': CACHE_VERSION, 'key': key,
+                             'fields': fields, 'blob': blob},
+                            wf, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpfile, 0644)
+            os.rename(tmpfile, cachefile)
+        except (IOError, OSError), err:
+            msger.debug("failed to cache header of %s: %s" % (path, err))
+
+    def _is_fresh(self, path, key):
+        return path in self._info and self._info[path][0] == key
+
+    def load(self, paths):
+        """ Get the headers of paths ready, the ones not cached are read
+            in parallel
+        """
+
+        toread = []
+        for path in paths:
+            try:
+                key = _stat_key(path)
+            except OSError:
+                continue
+            if self._is_fresh(path, key) and path in self._blobs:
+                continue
+            if not self._load_cached(path, key):
+                toread.append(path)
+
+        if not toread:
+            return
+
+        workers = self.workers
+        if workers is None and multiprocessing:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+
+        if multiprocessing and workers > 1 and len(toread) > 1:
+            msger.verbose("reading %d rpm headers by %d processes"
+                          % (len(toread), workers))
+            pool = multiprocessing.Pool(min(workers, len(toread)))
+            try:
+                results = pool.map(_read_header, toread,
+                                   max(1, len(toread) / (workers * 4)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_read_header, toread)
+
+        for (path, key, fields, blob) in results:
+            if key is None:
+                msger.debug("failed to read header of %s: %s"
+                            % (path, fields))
+                continue
+            self._info[path] = (key, fields)
+            self._blobs[path] = blob
+            self._save_cached(path, key, fields, blob)
+
+    def get_info(self, path):
+        """ Get the fields of the header of path, see FIELDS """
+
+        if not self._is_fresh(path, _stat_key(path)):
+            self.load([path])
+        if path not in self._info:
+            raise CreatorError("Failed to read rpm header of %s" % path)
+        return self._info[path][1]
+
+    def get_header(self, path):
+        """ Get the header object of path, its blob is dropped from memory
+            as the header goes to the transaction at once
+        """
+
+        if path not in self._blobs or \
+           not self._is_fresh(path, _stat_key(path)):
+            self.load([path])
+        if path not in self._blobs:
+            raise CreatorError("Failed to read rpm header of %s" % path)
+        return _load_blob(self._blobs.pop(path))
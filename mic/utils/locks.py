@@ -0,0 +1,174 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" File locks for sharing one cachedir among several mic processes
+
+    The locks are flock(2) based: they're released by the kernel when the
+    process dies, so a crashed build never leaves a stale lock behind.
+"""
+
+import os
+import fcntl
+import errno
+import threading
+
+from mic import msger
+
+LOCK_DIR = "locks"
+
+class FileLock(object):
+    """ An inter-process lock on 'path', shared (reader) or exclusive
+        (writer), usable in 'with' statement
+
+        flock is per open file, so the threads of one process get the lock
+        in turn by the thread lock as well.
+    """
+
+    def __init__(self, path, shared = False, unlink = False):
+        self.path = path
+        self.shared = shared
+        # remove the lock file when released, for the exclusive ones only
+        self.unlink = unlink and not shared
+        self._fd = None
+        self._tlock = threading.Lock()
+
+    def _lock_fd(self, blocking):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        flags = fcntl.LOCK_EX
+        if self.shared:
+            flags = fcntl.LOCK_SH
+
+        try:
+            try:
+                fcntl.flock(fd, flags | fcntl.LOCK_NB)
+            except IOError, err:
+                if err.errno not in (errno.EAGAIN, errno.EACCES) or \
+                   not blocking:
+                    raise
+                msger.verbose("waiting for the lock of %s" % self.path)
+                fcntl.flock(fd, flags)
+        except IOError:
+            os.close(fd)
+            raise
+
+        return fd
+
+    def _is_current(self, fd):
+        """ Whether fd is still the lock file at path, not one unlinked by
+            its last holder while waiting for it
+        """
+
+        try:
+            return os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return False
+
+    def acquire(self, blocking = True):
+        if not self._tlock.acquire(blocking):
+            return False
+
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    self._tlock.release()
+                    raise
+
+        while True:
+            try:
+                fd = self._lock_fd(blocking)
+            except IOError:
+                self._tlock.release()
+                if not blocking:
+                    return False
+                raise
+
+            if not self.unlink or self._is_current(fd):
+                break
+            os.close(fd)
+
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+
+        try:
+            if self.unlink:
+                # still holding it, the waiters see the inode changed
+                try:
+                    os.unlink(self.path)
+                except OSError:
+                    pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        finally:
+            self._fd = None
+            self._tlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def pid_alive(pid):
+    """ Check whether the process of pid is still running """
+
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno == errno.EPERM
+    return True
+
+def artifact_lock(filename):
+    """ The exclusive lock of one cached file: only one process fetches it,
+        the others wait and reuse the result. The lock file is removed when
+        released, not to be left next to every cached file.
+    """
+
+    (dirname, basename) = os.path.split(filename)
+    return FileLock(os.path.join(dirname, ".%s.lock" % basename),
+                    unlink = True)
+
+def repo_lock(cachedir, reponame, shared = False):
+    """ The reader/writer lock of the cache of one repo in cachedir """
+
+    return FileLock(os.path.join(cachedir, LOCK_DIR, "repo-%s.lock" % reponame),
+                    shared)
+
+def store_lock(cachedir):
+    """ The exclusive lock of the package store in cachedir, taken while
+        ingesting into it or evicting from it
+    """
+
+    return FileLock(os.path.join(cachedir, LOCK_DIR, "pkgstore.lock"))
+
+def packages_lock(cachedir, reponame, shared = False):
+    """ The reader/writer lock of the downloaded packages of one repo: the
+        builds hold it shared while using them, the store takes it exclusive
+        to drop or replace them
+    """
+
+    return FileLock(os.path.join(cachedir, LOCK_DIR,
+                                 "packages-%s.lock" % reponame), shared)
@@ -0,0 +1,227 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from __future__ import with_statement
+import os
+import time
+import threading
+
+from mic import msger
+from errors import CreatorError
+import urlfetch
+import threadpool
+
+# the file used to measure the latency and throughput of a mirror
+PROBE_FILE = "repodata/repomd.xml"
+PROBE_TIMEOUT = 10
+
+# package downloads are spread across this many best mirrors
+MIRROR_TOP = 3
+
+_mirrorsets = {}
+_mirrorsets_lock = threading.Lock()
+
+def parse_mirrorlist(data):
+    """ Get the mirror urls of a mirrorlist file, one url per line """
+
+    urls = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line not in urls:
+            urls.append(line.rstrip("/"))
+    return urls
+
+def probe(url, proxies = None, timeout = PROBE_TIMEOUT):
+    """ Measure one mirror by fetching its repomd.xml
+
+        return: (latency, throughput), in seconds and bytes per second
+    """
+
+    start = time.time()
+    fobj = urlfetch.urlopen(os.path.join(url, PROBE_FILE), proxies,
+                            timeout = timeout)
+    try:
+        latency = time.time() - start
+        size = 0
+        try:
+            while True:
+                data = fobj.read(urlfetch.BLOCK_SIZE)
+                if not data:
+                    break
+                size += len(data)
+        except Exception, err:
+            raise CreatorError("URLGrabber error: %s: %s" % (url, err))
+    finally:
+        fobj.close()
+
+    elapsed = max(time.time() - start - latency, 0.001)
+    return (latency, size / elapsed)
+
+def rank_mirrors(urls, proxies = None, threads = None):
+    """ Sort the mirrors by measured latency and throughput, the dead ones
+        are dropped unless all of them are dead
+    """
+
+    if threads is None:
+        threads = threadpool.DEFAULT_WORKERS
+
+    results = threadpool.map_parallel(lambda url: probe(url, proxies),
+                                      urls, threads)
+    alive = []
+    for (url, (result, err)) in zip(urls, results):
+        if err:
+            msger.verbose("mirror %s is unavailable: %s" % (url, err))
+            continue
+
+        (latency, throughput) = result
+        msger.verbose("mirror %s: latency %.3fs, %.1f KB/s"
+                      % (url, latency, throughput / 1024))
+        # the time to fetch a 64K block, it's fine for both tiny
+        # metadata files and packages
+        alive.append((latency + urlfetch.BLOCK_SIZE / throughput, url))
+
+    if not alive:
+        return list(urls)
+
+    alive.sort()
+    return [url for (score, url) in alive]
+
+class MirrorSet(object):
+    """ The ranked mirrors of one repo, which fails over to the next mirror
+        on errors and spreads the downloads over the best ones
+    """
+
+    def __init__(self, urls, top = MIRROR_TOP):
+        self.urls = list(urls)
+        self.top = top
+        self.failures = dict([(url, 0) for url in self.urls])
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return url in self.failures
+
+    def get_mirrors(self):
+        """ The mirrors in rank order, the failed ones are moved back """
+
+        with self._lock:
+            return sorted(self.urls, key = lambda url: self.failures[url])
+
+    def pick(self):
+        """ The mirrors ordered for the next download: round robin over the
+            top healthy ones, then the rest for failover
+        """
+
+        mirrors = self.get_mirrors()
+        top = [url for url in mirrors[:self.top] if not self.failures[url]]
+        if len(top) <= 1:
+            return mirrors
+
+        with self._lock:
+            index = self._next % len(top)
+            self._next += 1
+
+        first = top[index]
+        return [first] + [url for url in mirrors if url != first]
+
+    def failed(self, url):
+        with self._lock:
+            if url in self.failures:
+                self.failures[url] += 1
+
+    def fetch(self, relpath, func, spread = False):
+        """ Call func with the url of relpath on each mirror until it
+            succeeds, the CreatorError of the last mirror is raised if all
+            of them failed
+        """
+
+        if spread:
+            mirrors = self.pick()
+        else:
+            mirrors = self.get_mirrors()
+
+        error = None
+        for url in mirrors:
+            try:
+                return func(os.path.join(url, relpath))
+            except CreatorError, err:
+                msger.verbose("mirror %s failed: %s" % (url, err))
+                self.failed(url)
+                error = err
+
+        raise error or CreatorError("No mirror available for %s" % relpath)
+
+def get_mirrorset(mirrorlist, proxies = None, filename = None,
+                  expire = 0, offline = False):
+    """ Get the ranked MirrorSet of mirrorlist, it's resolved and ranked
+        only once per process
+
+        filename: where to cache the mirrorlist file, required by offline
+    """
+
+    with _mirrorsets_lock:
+        if mirrorlist in _mirrorsets:
+            return _mirrorsets[mirrorlist]
+
+    if filename:
+        (path, fetched) = urlfetch.revalidate(mirrorlist, filename, proxies,
+                                              expire, offline)
+        with open(path) as rf:
+            urls = parse_mirrorlist(rf.read())
+    else:
+        fobj = urlfetch.urlopen(mirrorlist, proxies)
+        try:
+            urls = parse_mirrorlist(fobj.read())
+        finally:
+            fobj.close()
+
+    if not urls:
+        raise CreatorError("No mirror found in mirrorlist %s" % mirrorlist)
+
+    if not offline:
+        urls = rank_mirrors(urls, proxies)
+
+    mirrors = MirrorSet(urls)
+    with _mirrorsets_lock:
+        _mirrorsets.setdefault(mirrorlist, mirrors)
+        return _mirrorsets[mirrorlist]
+
+def find_mirrorset(baseurl):
+    """ Get the MirrorSet which baseurl belongs to, None if not found """
+
+    if not baseurl:
+        return None
+
+    baseurl = baseurl.rstrip("/")
+    with _mirrorsets_lock:
+        for mirrors in _mirrorsets.values():
+            if baseurl in mirrors:
+                return mirrors
+
+    return None
+
+def fetch_from_mirrors(baseurl, relpath, func, spread = False):
+    """ Call func with the url of relpath under baseurl, failing over to
+        the other mirrors if baseurl comes from a mirrorlist
+    """
+
+    mirrors = find_mirrorset(baseurl)
+    if mirrors is None:
+        return func(os.path.join(baseurl, relpath))
+    return mirrors.fetch(relpath, func, spread)
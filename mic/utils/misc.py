@@ -48,6 +48,12 @@ from fs_related import *
 from rpmmisc import myurlgrab
 from proxy import get_proxy_for
 import runner
+import threadpool
+import locks
+import repoindex
+import urlfetch
+import mirror
+import pkgcheck
 
 from mic import msger
 
@@ -434,183 +440,300 @@ def get_repostrs_from_ks(ks):
                 repo[attr] = getattr(repodata, attr)
 
         if 'name' not in repo:
-            repo['name'] = _get_temp_reponame(repodata.baseurl)
+            repo['name'] = _get_temp_reponame(repodata.baseurl or
+                                              repodata.mirrorlist)
 
         kickstart_repos.append(repo)
 
     return kickstart_repos
 
-def _get_uncompressed_data_from_url(url, filename, proxies):
-    filename = myurlgrab(url, filename, proxies)
-    suffix = None
-    if filename.endswith(".gz"):
-        suffix = ".gz"
-        runner.quiet(['gunzip', "-f", filename])
-    elif filename.endswith(".bz2"):
-        suffix = ".bz2"
-        runner.quiet(['bunzip2', "-f", filename])
-    if suffix:
-        filename = filename.replace(suffix, "")
-    return filename
+# the local mirror of the verified metadata in cachedir/<reponame>, which
+# the package backends load instead of downloading the metadata again
+METADATA_MIRROR = "mirror"
+
+def _get_uncompressed_data_from_url(url, filename, proxies,
+                                    sumtype=None, checksum=None,
+                                    rawcopy=None):
+    return urlfetch.fetch(url, filename, proxies, sumtype, checksum,
+                          rawcopy = rawcopy)
 
 def _get_metadata_from_repo(baseurl, proxies, cachedir, reponame, filename,
-                            sumtype=None, checksum=None):
-    url = os.path.join(baseurl, filename)
+                            sumtype=None, checksum=None, offline=False):
+    relpath = filename
     filename_tmp = str("%s/%s/%s" % (cachedir, reponame, os.path.basename(filename)))
-    if os.path.splitext(filename_tmp)[1] in (".gz", ".bz2"):
-        filename = os.path.splitext(filename_tmp)[0]
+    filename = urlfetch.get_uncompressed_name(filename_tmp)
+    rawcopy = str(os.path.join(cachedir, reponame, METADATA_MIRROR, relpath))
+    if urlfetch.is_cached(filename, sumtype, checksum) and \
+       (offline or os.path.exists(rawcopy)):
+        return filename
+    if offline:
+        raise CreatorError("No valid cached %s of repo %s in offline mode"
+                           % (os.path.basename(filename), reponame))
+    makedirs(os.path.dirname(rawcopy))
+    return mirror.fetch_from_mirrors(baseurl, relpath,
+                lambda url: _get_uncompressed_data_from_url(url, filename_tmp,
+                                                            proxies, sumtype,
+                                                            checksum, rawcopy))
+
+def _publish_metadata_mirror(cachedir, reponame, repomd, repokey, relpaths):
+    """ Put repomd.xml into the local mirror of repo at last, then the
+        mirror is complete for the files fetched, the outdated files of the
+        former revisions are dropped
+    """
+
+    mirrordir = os.path.join(cachedir, reponame, METADATA_MIRROR)
+    repodata = os.path.join(mirrordir, "repodata")
+    makedirs(repodata)
+    current = set([os.path.normpath(os.path.join(mirrordir, relpath))
+                   for relpath in relpaths])
+    for fname in os.listdir(repodata):
+        path = os.path.join(repodata, fname)
+        if fname.startswith(".") or fname.startswith("repomd.xml") or \
+           path in current or not os.path.isfile(path):
+            continue
+        os.unlink(path)
+
+    for (src, fname) in ((repokey, "repomd.xml.key"), (repomd, "repomd.xml")):
+        if not src:
+            continue
+        tmpfile = os.path.join(repodata, ".%s.%d" % (fname, os.getpid()))
+        shutil.copy2(src, tmpfile)
+        os.rename(tmpfile, os.path.join(repodata, fname))
+
+def get_metadata_mirror(repometadata, reponame):
+    """ Get the url of the local mirror of the metadata retrieved by
+        get_metadata_from_repos for repo 'reponame', None if there isn't
+    """
+
+    for repo in repometadata or []:
+        if repo['name'] != reponame:
+            continue
+        path = os.path.join(repo['cachedir'], reponame, METADATA_MIRROR)
+        if os.path.exists(os.path.join(path, "repodata", "repomd.xml")):
+            return "file://" + os.path.abspath(path)
+
+    return None
+
+def get_repo_mirrorset(reponame, mirrorlist, proxies, cachedir,
+                       expire=0, offline=False):
+    """ Get the ranked mirrors of the mirrorlist of repo 'reponame', the
+        metadata retrieval and the backends share them by the mirrorlist
+    """
+
+    return mirror.get_mirrorset(mirrorlist, proxies,
+                                os.path.join(cachedir, reponame, 'mirrorlist'),
+                                expire, offline)
+
+def _get_repomd_of_repo(repo, cachedir, expire=0, offline=False):
+    reponame = repo['name']
+    baseurl  = repo.get('baseurl') or repo['mirrorlist']
+
+    if 'proxy' in repo:
+        proxy = repo['proxy']
     else:
-        filename = filename_tmp
-    if sumtype and checksum and os.path.exists(filename):
-        sumcmd = "%ssum" % sumtype
-        file_checksum = runner.outs([sumcmd, filename]).split()[0]
-        if file_checksum == checksum:
-            return filename
-    return _get_uncompressed_data_from_url(url,filename_tmp,proxies)
-
-def get_metadata_from_repos(repos, cachedir):
-    my_repo_metadata = []
-    for repo in repos:
-        reponame = repo['name']
-        baseurl  = repo['baseurl']
+        proxy = get_proxy_for(baseurl)
+
+    proxies = None
+    if proxy:
+       proxies = {str(baseurl.split(":")[0]):str(proxy)}
+
+    makedirs(os.path.join(cachedir, reponame))
+    if not repo.get('baseurl'):
+        # rank the mirrors, then use the best one as baseurl
+        mirrors = get_repo_mirrorset(reponame, repo['mirrorlist'], proxies,
+                                     cachedir, expire, offline)
+        baseurl = mirrors.get_mirrors()[0]
+
+    filename = os.path.join(cachedir, reponame, 'repomd.xml')
+    (repomd, fetched) = mirror.fetch_from_mirrors(baseurl,
+                            "repodata/repomd.xml",
+                            lambda url: urlfetch.revalidate(url, filename,
+                                                            proxies, expire,
+                                                            offline))
+    try:
+        root = xmlparse(repomd)
+    except SyntaxError:
+        raise CreatorError("repomd.xml syntax error.")
 
+    ns = root.getroot().tag
+    ns = ns[0:ns.rindex("}")+1]
 
-        if 'proxy' in repo:
-            proxy = repo['proxy']
-        else:
-            proxy = get_proxy_for(baseurl)
+    filepaths = {}
+    checksums = {}
+    sumtypes = {}
 
-        proxies = None
-        if proxy:
-           proxies = {str(baseurl.split(":")[0]):str(proxy)}
+    for elm in root.getiterator("%sdata" % ns):
+        if elm.attrib["type"] == "patterns":
+            filepaths['patterns'] = elm.find("%slocation" % ns).attrib['href']
+            checksums['patterns'] = elm.find("%sopen-checksum" % ns).text
+            sumtypes['patterns'] = elm.find("%sopen-checksum" % ns).attrib['type']
+            break
 
-        makedirs(os.path.join(cachedir, reponame))
-        url = os.path.join(baseurl, "repodata/repomd.xml")
-        filename = os.path.join(cachedir, reponame, 'repomd.xml')
-        repomd = myurlgrab(url, filename, proxies)
-        try:
-            root = xmlparse(repomd)
-        except SyntaxError:
-            raise CreatorError("repomd.xml syntax error.")
-
-        ns = root.getroot().tag
-        ns = ns[0:ns.rindex("}")+1]
-
-        filepaths = {}
-        checksums = {}
-        sumtypes = {}
-
-        for elm in root.getiterator("%sdata" % ns):
-            if elm.attrib["type"] == "patterns":
-                filepaths['patterns'] = elm.find("%slocation" % ns).attrib['href']
-                checksums['patterns'] = elm.find("%sopen-checksum" % ns).text
-                sumtypes['patterns'] = elm.find("%sopen-checksum" % ns).attrib['type']
-                break
+    for elm in root.getiterator("%sdata" % ns):
+        if elm.attrib["type"] in ("group_gz", "group"):
+            filepaths['comps'] = elm.find("%slocation" % ns).attrib['href']
+            checksums['comps'] = elm.find("%sopen-checksum" % ns).text
+            sumtypes['comps'] = elm.find("%sopen-checksum" % ns).attrib['type']
+            break
 
-        for elm in root.getiterator("%sdata" % ns):
-            if elm.attrib["type"] in ("group_gz", "group"):
-                filepaths['comps'] = elm.find("%slocation" % ns).attrib['href']
-                checksums['comps'] = elm.find("%sopen-checksum" % ns).text
-                sumtypes['comps'] = elm.find("%sopen-checksum" % ns).attrib['type']
-                break
+    primary_type = None
+    for elm in root.getiterator("%sdata" % ns):
+        if elm.attrib["type"] in ("primary_db", "primary"):
+            primary_type = elm.attrib["type"]
+            filepaths['primary'] = elm.find("%slocation" % ns).attrib['href']
+            checksums['primary'] = elm.find("%sopen-checksum" % ns).text
+            sumtypes['primary'] = elm.find("%sopen-checksum" % ns).attrib['type']
+            break
 
-        primary_type = None
-        for elm in root.getiterator("%sdata" % ns):
-            if elm.attrib["type"] in ("primary_db", "primary"):
-                primary_type = elm.attrib["type"]
-                filepaths['primary'] = elm.find("%slocation" % ns).attrib['href']
-                checksums['primary'] = elm.find("%sopen-checksum" % ns).text
-                sumtypes['primary'] = elm.find("%sopen-checksum" % ns).attrib['type']
-                break
+    if not primary_type:
+        return None
 
-        if not primary_type:
-            continue
+    return {"name": reponame,
+            "baseurl": baseurl,
+            "proxies": proxies,
+            "repomd": repomd,
+            "filepaths": filepaths,
+            "checksums": checksums,
+            "sumtypes": sumtypes}
+
+def _report_failed_repos(failed):
+    for (reponame, err) in failed:
+        msger.warning("\nfailed to retrieve metadata of repo '%s': %s"
+                      % (reponame, err))
+    raise CreatorError("Failed to retrieve metadata of repo(s): %s"
+                       % ', '.join([name for (name, err) in failed]))
+
+# the metadata retrieved by this process, by the repos
+_metadata_memo = {}
+
+def get_metadata_from_repos(repos, cachedir, threads = None,
+                            expire = 0, offline = False):
+    """ Retrieve metadata of all the repos, the repos (and the files inside
+        each repo) are fetched in parallel by at most 'threads' workers,
+        the returned list keeps the order of 'repos'.
+
+        The metadata of the same repos is retrieved once in a process, so
+        the builds of a batch share it.
+
+        expire: seconds to trust the cached repomd.xml without revalidation
+        offline: build purely from the cached metadata
+    """
 
+    memo_key = repr(([sorted(repo.items()) for repo in repos],
+                     cachedir, expire, offline))
+    if memo_key in _metadata_memo:
+        return [dict(repo) for repo in _metadata_memo[memo_key]]
+
+    if threads is None:
+        threads = threadpool.DEFAULT_WORKERS
+
+    # phase 1: repomd.xml of each repo
+    failed = []
+    repomds = []
+    results = threadpool.map_parallel(
+                    lambda repo: _get_repomd_of_repo(repo, cachedir,
+                                                     expire, offline),
+                    repos, threads)
+    for repo, (repomd, err) in zip(repos, results):
+        if err:
+            failed.append((repo['name'], err))
+        elif repomd:
+            repomds.append(repomd)
+
+    if failed:
+        _report_failed_repos(failed)
+
+    # phase 2: primary, patterns, comps and repo key, flattened to one pool
+    jobs = []
+    for repomd in repomds:
         for item in ("primary", "patterns", "comps"):
-            if item not in filepaths:
-                filepaths[item] = None
-                continue
-            if not filepaths[item]:
+            if not repomd['filepaths'].get(item):
+                repomd['filepaths'][item] = None
                 continue
-            filepaths[item] = _get_metadata_from_repo(baseurl,
-                                                      proxies,
-                                                      cachedir,
-                                                      reponame,
-                                                      filepaths[item],
-                                                      sumtypes[item],
-                                                      checksums[item])
-
-        """ Get repo key """
+            jobs.append((repomd, item))
+        jobs.append((repomd, "repokey"))
+
+    def _fetch(job):
+        (repomd, item) = job
+        if item == "repokey":
+            try:
+                return mirror.fetch_from_mirrors(repomd['baseurl'],
+                            "repodata/repomd.xml.key",
+                            lambda url: urlfetch.revalidate(url,
+                                os.path.join(cachedir, repomd['name'],
+                                             "repomd.xml.key"),
+                                repomd['proxies'], expire, offline))[0]
+            except CreatorError:
+                msger.debug("\ncan't get %s/%s" % (repomd['baseurl'],
+                                                   "repodata/repomd.xml.key"))
+                return None
+
+        return _get_metadata_from_repo(repomd['baseurl'],
+                                       repomd['proxies'],
+                                       cachedir,
+                                       repomd['name'],
+                                       repomd['filepaths'][item],
+                                       repomd['sumtypes'][item],
+                                       repomd['checksums'][item],
+                                       offline)
+
+    fetched = {}
+    for (job, (path, err)) in zip(jobs, threadpool.map_parallel(_fetch,
+                                                                jobs,
+                                                                threads)):
+        (repomd, item) = job
+        if err:
+            failed.append((repomd['name'], err))
+        else:
+            fetched[(repomd['name'], item)] = path
+
+    if failed:
+        _report_failed_repos(failed)
+
+    my_repo_metadata = []
+    for repomd in repomds:
+        reponame = repomd['name']
+        filepaths = repomd['filepaths']
+        relpaths = []
+        for item in ("primary", "patterns", "comps"):
+            if filepaths[item]:
+                relpaths.append(filepaths[item])
+                filepaths[item] = fetched[(reponame, item)]
+
         try:
-            repokey = _get_metadata_from_repo(baseurl,
-                                              proxies,
-                                              cachedir,
-                                              reponame,
-                                              "repodata/repomd.xml.key")
-        except CreatorError:
-            repokey = None
-            msger.debug("\ncan't get %s/%s" % (baseurl, "repodata/repomd.xml.key"))
+            _publish_metadata_mirror(cachedir, reponame, repomd['repomd'],
+                                     fetched[(reponame, "repokey")], relpaths)
+        except (IOError, OSError), err:
+            msger.debug("failed to set up metadata mirror of %s: %s"
+                        % (reponame, err))
 
         my_repo_metadata.append({"name":reponame,
-                                 "baseurl":baseurl,
-                                 "repomd":repomd,
+                                 "baseurl":repomd['baseurl'],
+                                 "repomd":repomd['repomd'],
                                  "primary":filepaths['primary'],
                                  "cachedir":cachedir,
-                                 "proxies":proxies,
+                                 "proxies":repomd['proxies'],
                                  "patterns":filepaths['patterns'],
                                  "comps":filepaths['comps'],
-                                 "repokey":repokey})
+                                 "repokey":fetched[(reponame, "repokey")]})
 
-    return my_repo_metadata
+    _metadata_memo[memo_key] = my_repo_metadata
+    return [dict(repo) for repo in my_repo_metadata]
 
 def get_rpmver_in_repo(repometadata):
     for repo in repometadata:
-        if repo["primary"].endswith(".xml"):
-            root = xmlparse(repo["primary"])
-            ns = root.getroot().tag
-            ns = ns[0:ns.rindex("}")+1]
-
-            versionlist = []
-            for elm in root.getiterator("%spackage" % ns):
-                if elm.find("%sname" % ns).text == 'rpm':
-                    for node in elm.getchildren():
-                        if node.tag == "%sversion" % ns:
-                            versionlist.append(node.attrib['ver'])
-
-            if versionlist:
-                return reversed(
-                         sorted(
-                           versionlist,
-                           key = lambda ver: map(int, ver.split('.')))).next()
-
-        elif repo["primary"].endswith(".sqlite"):
-            con = sqlite.connect(repo["primary"])
-            for row in con.execute("select version from packages where "
-                                   "name=\"rpm\" ORDER by version DESC"):
-                con.close()
-                return row[0]
+        entry = repoindex.get_index(repo).get_best('rpm')
+        if entry:
+            return entry[repoindex.VERSION]
 
     return None
 
 def get_arch(repometadata):
     archlist = []
     for repo in repometadata:
-        if repo["primary"].endswith(".xml"):
-            root = xmlparse(repo["primary"])
-            ns = root.getroot().tag
-            ns = ns[0:ns.rindex("}")+1]
-            for elm in root.getiterator("%spackage" % ns):
-                if elm.find("%sarch" % ns).text not in ("noarch", "src"):
-                    arch = elm.find("%sarch" % ns).text
-                    if arch not in archlist:
-                        archlist.append(arch)
-        elif repo["primary"].endswith(".sqlite"):
-            con = sqlite.connect(repo["primary"])
-            for row in con.execute("select arch from packages where arch not in (\"src\", \"noarch\")"):
-                if row[0] not in archlist:
-                    archlist.append(row[0])
-
-            con.close()
+        for arch in repoindex.get_index(repo).arches:
+            if arch not in ("noarch", "src") and arch not in archlist:
+                archlist.append(arch)
 
     uniq_arch = []
     for i in range(len(archlist)):
@@ -636,51 +759,24 @@ def get_arch(repometadata):
     return uniq_arch, archlist
 
 def get_package(pkg, repometadata, arch = None):
-    ver = ""
-    target_repo = None
-    for repo in repometadata:
-        if repo["primary"].endswith(".xml"):
-            root = xmlparse(repo["primary"])
-            ns = root.getroot().tag
-            ns = ns[0:ns.rindex("}")+1]
-            for elm in root.getiterator("%spackage" % ns):
-                if elm.find("%sname" % ns).text == pkg:
-                    if elm.find("%sarch" % ns).text != "src":
-                        version = elm.find("%sversion" % ns)
-                        tmpver = "%s-%s" % (version.attrib['ver'], version.attrib['rel'])
-                        if tmpver > ver:
-                            ver = tmpver
-                            location = elm.find("%slocation" % ns)
-                            pkgpath = "%s" % location.attrib['href']
-                            target_repo = repo
-                        break
-        if repo["primary"].endswith(".sqlite"):
-            con = sqlite.connect(repo["primary"])
-            if not arch:
-                for row in con.execute("select version, release,location_href from packages where name = \"%s\" and arch != \"src\"" % pkg):
-                    tmpver = "%s-%s" % (row[0], row[1])
-                    if tmpver > ver:
-                        pkgpath = "%s" % row[2]
-                        target_repo = repo
-                    break
-            else:
-                for row in con.execute("select version, release,location_href from packages where name = \"%s\"" % pkg):
-                    tmpver = "%s-%s" % (row[0], row[1])
-                    if tmpver > ver:
-                        pkgpath = "%s" % row[2]
-                        target_repo = repo
-                    break
-            con.close()
+    (target_repo, entry) = repoindex.find_package(pkg, repometadata, arch)
     if target_repo:
+        pkgpath = entry[repoindex.LOCATION]
         makedirs("%s/%s/packages" % (target_repo["cachedir"], target_repo["name"]))
-        url = os.path.join(target_repo["baseurl"], pkgpath)
         filename = str("%s/%s/packages/%s" % (target_repo["cachedir"], target_repo["name"], os.path.basename(pkgpath)))
-        pkg = myurlgrab(str(url), filename, target_repo["proxies"])
+        pkg = mirror.fetch_from_mirrors(target_repo["baseurl"], pkgpath,
+                    lambda url: myurlgrab(str(url), filename,
+                                          target_repo["proxies"]))
         return pkg
     else:
         return None
 
-def get_source_name(pkg, repometadata):
+def get_source_names(pkgs, repometadata):
+    """ Map the binary packages to their source package names in one batch
+
+        pkgs: package strings in RPM_FMT, e.g. "name.arch ver-rel"
+        return: dict of {pkg: source name or None}
+    """
 
     def get_bin_name(pkg):
         m = RPM_RE.match(pkg)
@@ -694,109 +790,37 @@ def get_source_name(pkg, repometadata):
             return m.group(1)
         return None
 
-    ver = ""
-    target_repo = None
-
-    pkg_name = get_bin_name(pkg)
-    if not pkg_name:
-        return None
-
-    for repo in repometadata:
-        if repo["primary"].endswith(".xml"):
-            root = xmlparse(repo["primary"])
-            ns = root.getroot().tag
-            ns = ns[0:ns.rindex("}")+1]
-            for elm in root.getiterator("%spackage" % ns):
-                if elm.find("%sname" % ns).text == pkg_name:
-                    if elm.find("%sarch" % ns).text != "src":
-                        version = elm.find("%sversion" % ns)
-                        tmpver = "%s-%s" % (version.attrib['ver'], version.attrib['rel'])
-                        if tmpver > ver:
-                            ver = tmpver
-                            fmt = elm.find("%sformat" % ns)
-                            if fmt:
-                                fns = fmt.getchildren()[0].tag
-                                fns = fns[0:fns.rindex("}")+1]
-                                pkgpath = fmt.find("%ssourcerpm" % fns).text
-                                target_repo = repo
-                        break
-
-        if repo["primary"].endswith(".sqlite"):
-            con = sqlite.connect(repo["primary"])
-            for row in con.execute("select version, release, rpm_sourcerpm from packages where name = \"%s\" and arch != \"src\"" % pkg_name):
-                tmpver = "%s-%s" % (row[0], row[1])
-                if tmpver > ver:
-                    pkgpath = "%s" % row[2]
-                    target_repo = repo
-                break
-            con.close()
-    if target_repo:
-        return get_src_name(pkgpath)
-    else:
-        return None
-
-def get_pkglist_in_patterns(group, patterns):
-    found = False
-    pkglist = []
-    try:
-        root = xmlparse(patterns)
-    except SyntaxError:
-        raise SyntaxError("%s syntax error." % patterns)
-
-    for elm in list(root.getroot()):
-        ns = elm.tag
-        ns = ns[0:ns.rindex("}")+1]
-        name = elm.find("%sname" % ns)
-        summary = elm.find("%ssummary" % ns)
-        if name.text == group or summary.text == group:
-            found = True
-            break
+    # resolve each binary name only once, though several pkgs (e.g. of
+    # different arches) may share the same name
+    srcnames = {}
+    result = {}
+    for pkg in pkgs:
+        pkg_name = get_bin_name(pkg)
+        if not pkg_name:
+            result[pkg] = None
+            continue
 
-    if not found:
-        return pkglist
+        if pkg_name not in srcnames:
+            (target_repo, entry) = repoindex.find_package(pkg_name,
+                                                          repometadata)
+            if target_repo and entry[repoindex.SOURCERPM]:
+                srcnames[pkg_name] = get_src_name(entry[repoindex.SOURCERPM])
+            else:
+                srcnames[pkg_name] = None
 
-    found = False
-    for requires in list(elm):
-        if requires.tag.endswith("requires"):
-            found = True
-            break
+        result[pkg] = srcnames[pkg_name]
 
-    if not found:
-        return pkglist
+    return result
 
-    for pkg in list(requires):
-        pkgname = pkg.attrib["name"]
-        if pkgname not in pkglist:
-            pkglist.append(pkgname)
+def get_source_name(pkg, repometadata):
+    return get_source_names([pkg], repometadata)[pkg]
 
-    return pkglist
+def get_pkglist_in_patterns(group, patterns):
+    return list(repoindex.get_group_index(patterns, "patterns")
+                                        .get_packages(group))
 
 def get_pkglist_in_comps(group, comps):
-    found = False
-    pkglist = []
-    try:
-        root = xmlparse(comps)
-    except SyntaxError:
-        raise SyntaxError("%s syntax error." % comps)
-
-    for elm in root.getiterator("group"):
-        id = elm.find("id")
-        name = elm.find("name")
-        if id.text == group or name.text == group:
-            packagelist = elm.find("packagelist")
-            found = True
-            break
-
-    if not found:
-        return pkglist
-
-    for require in elm.getiterator("packagereq"):
-        if require.tag.endswith("packagereq"):
-            pkgname = require.text
-        if pkgname not in pkglist:
-            pkglist.append(pkgname)
-
-    return pkglist
+    return list(repoindex.get_group_index(comps, "comps").get_packages(group))
 
 def is_statically_linked(binary):
     return ", statically linked, " in runner.outs(['file', binary])
@@ -859,7 +883,35 @@ def setup_qemu_emulator(rootdir, arch):
 
     return qemu_emulator
 
-def SrcpkgsDownload(pkgs, repometadata, instroot, cachedir):
+def _fetch_resumable(url, filename, proxies, progress_obj = None,
+                     checksum = None):
+    """ Download to a '.part' file which is continued by later tries if
+        interrupted, the complete file only appears after the download done
+
+        checksum: (sumtype, checksum) in repo metadata to verify the file
+    """
+
+    def _verify(path):
+        return checksum is None or pkgcheck.verify(path, *checksum)
+
+    with locks.artifact_lock(filename):
+        # it may be done by another process while waiting for the lock,
+        # or left damaged by an earlier run
+        if os.path.exists(filename):
+            if _verify(filename):
+                return filename
+            msger.debug("%s is damaged, downloading again" % filename)
+            os.unlink(filename)
+
+        partfile = filename + ".part"
+        myurlgrab(url, partfile, proxies, progress_obj, reget = 'simple')
+        if not _verify(partfile):
+            os.unlink(partfile)
+            raise CreatorError("Checksum of %s doesn't match" % url)
+        os.rename(partfile, filename)
+        return filename
+
+def SrcpkgsDownload(pkgs, repometadata, instroot, cachedir, threads = None):
     def get_source_repometadata(repometadata):
         src_repometadata=[]
         for repo in repometadata:
@@ -881,6 +933,9 @@ def SrcpkgsDownload(pkgs, repometadata, instroot, cachedir):
         msger.warning("No source repo found")
         return None
 
+    if threads is None:
+        threads = threadpool.DEFAULT_WORKERS
+
     src_pkgs = []
     lpkgs_dict = {}
     lpkgs_path = []
@@ -898,25 +953,61 @@ def SrcpkgsDownload(pkgs, repometadata, instroot, cachedir):
     if not os.path.exists(destdir):
         os.makedirs(destdir)
 
-    srcpkgset = set()
-    for _pkg in pkgs:
-        srcpkg_name = get_source_name(_pkg, repometadata)
-        if not srcpkg_name:
+    srcpkgset = set(get_source_names(pkgs, repometadata).values())
+    srcpkgset.discard(None)
+
+    jobs = []
+    for pkg in sorted(srcpkgset):
+        (target_repo, entry) = repoindex.find_package(pkg,
+                                                      src_repometadata,
+                                                      'src')
+        if not target_repo:
+            # nothing to check it against, the cached one is taken as is
+            if pkg in localpkgs:
+                cached_count += 1
+                shutil.copy(lpkgs_dict[pkg], destdir)
+                src_pkgs.append(os.path.basename(lpkgs_dict[pkg]))
             continue
-        srcpkgset.add(srcpkg_name)
 
-    for pkg in list(srcpkgset):
-        if pkg in localpkgs:
+        pkgpath = entry[repoindex.LOCATION]
+        checksum = entry[repoindex.CHECKSUM]
+        if pkg in localpkgs and \
+           os.path.basename(lpkgs_dict[pkg]) == os.path.basename(pkgpath) and \
+           (not checksum or pkgcheck.verify(lpkgs_dict[pkg], *checksum)):
             cached_count += 1
             shutil.copy(lpkgs_dict[pkg], destdir)
             src_pkgs.append(os.path.basename(lpkgs_dict[pkg]))
-        else:
-            src_pkg = get_package(pkg, src_repometadata, 'src')
-            if src_pkg:
-                shutil.copy(src_pkg, destdir)
-                src_pkgs.append(src_pkg)
+            continue
+
+        pkgdir = "%s/%s/packages" % (target_repo["cachedir"],
+                                     target_repo["name"])
+        makedirs(pkgdir)
+        jobs.append((target_repo["baseurl"], pkgpath,
+                     str(os.path.join(pkgdir, os.path.basename(pkgpath))),
+                     target_repo["proxies"], checksum))
+
     msger.info("%d source packages gotten from cache" % cached_count)
 
+    if jobs:
+        msger.info("Downloading %d source packages ..." % len(jobs))
+        progress_obj = rpmmisc.TextProgress(len(jobs))
+        def _download(job):
+            (baseurl, pkgpath, filename, proxies, checksum) = job
+            return mirror.fetch_from_mirrors(baseurl, pkgpath,
+                        lambda url: _fetch_resumable(str(url), filename,
+                                                     proxies, progress_obj,
+                                                     checksum),
+                        spread = True)
+
+        results = threadpool.map_parallel(_download, jobs, threads)
+
+        for (job, (src_pkg, err)) in zip(jobs, results):
+            if err:
+                msger.warning("failed to download %s: %s" % (job[1], err))
+                continue
+            shutil.copy(src_pkg, destdir)
+            src_pkgs.append(src_pkg)
+
     return src_pkgs
 
 def strip_end(text, suffix):
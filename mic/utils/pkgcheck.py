@@ -0,0 +1,169 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from __future__ import with_statement
+import os
+import tempfile
+import threading
+import cPickle as pickle
+
+try:
+    from multiprocessing import cpu_count
+except ImportError:
+    def cpu_count():
+        return os.sysconf("SC_NPROCESSORS_ONLN")
+
+from mic import msger
+from errors import CreatorError
+import urlfetch
+import threadpool
+import locks
+
+# bump it when the layout of the memo file changes
+MEMO_VERSION = 1
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_size, int(st.st_mtime), st.st_ino)
+
+class VerifiedFiles(object):
+    """ The memo of files verified against their checksums, an entry stays
+        valid while the (size, mtime, inode) of the file is unchanged
+    """
+
+    def __init__(self, path = None):
+        self.path = path
+        self.files = {}
+        # the entries dropped here, not to be taken back from the file
+        self._discarded = set()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as rf:
+                data = pickle.load(rf)
+        except Exception:
+            return {}
+
+        if data.get('version') != MEMO_VERSION:
+            return {}
+        return data['files']
+
+    def load(self):
+        self.files = self._read()
+
+    def save(self):
+        """ Write the memo, merged with the one saved by other processes
+            meanwhile
+        """
+
+        if not self.path:
+            return
+
+        with locks.artifact_lock(self.path):
+            files = self._read()
+            with self._lock:
+                for path in self._discarded:
+                    files.pop(path, None)
+                files.update(self.files)
+            data = {'version': MEMO_VERSION, 'files': files}
+
+            # drop the entries of the files removed since then
+            for path in files.keys():
+                if not os.path.exists(path):
+                    del files[path]
+
+            self._write(data)
+
+    def _write(self, data):
+        (fd, tmpfile) = tempfile.mkstemp(dir = os.path.dirname(self.path),
+                                         prefix = ".%s-" % \
+                                                  os.path.basename(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as wf:
+                pickle.dump(data, wf, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpfile, 0644)
+            os.rename(tmpfile, self.path)
+        except (IOError, OSError), err:
+            msger.debug("failed to save %s: %s" % (self.path, err))
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+
+    def is_verified(self, path, sumtype, checksum):
+        try:
+            key = _stat_key(path)
+        except OSError:
+            return False
+
+        with self._lock:
+            return self.files.get(path) == key + (sumtype, checksum)
+
+    def add(self, path, sumtype, checksum):
+        key = _stat_key(path)
+        with self._lock:
+            self.files[path] = key + (sumtype, checksum)
+            self._discarded.discard(path)
+
+    def discard(self, path):
+        with self._lock:
+            self.files.pop(path, None)
+            self._discarded.add(path)
+
+def verify(path, sumtype, checksum, memo = None):
+    """ Check the file against the checksum in repo metadata, the verified
+        result is remembered in memo to skip hashing next time
+    """
+
+    if not os.path.exists(path):
+        return False
+
+    if memo and memo.is_verified(path, sumtype, checksum):
+        return True
+
+    try:
+        ok = urlfetch.file_checksum(path, sumtype) == checksum
+    except (IOError, OSError, CreatorError), err:
+        msger.debug("failed to check %s: %s" % (path, err))
+        ok = False
+
+    if memo:
+        if ok:
+            memo.add(path, sumtype, checksum)
+        else:
+            memo.discard(path)
+
+    return ok
+
+def verify_files(items, memo = None, workers = None):
+    """ Check the files of items [(path, sumtype, checksum)] in parallel
+
+        return: a list of True/False in the order of items
+    """
+
+    if workers is None:
+        try:
+            workers = cpu_count()
+        except (NotImplementedError, ValueError, OSError):
+            workers = threadpool.DEFAULT_WORKERS
+
+    # hashlib releases the GIL on large blocks, threads are enough
+    results = threadpool.map_parallel(
+                    lambda item: verify(item[0], item[1], item[2], memo),
+                    items, workers)
+    return [bool(ok) for (ok, err) in results]
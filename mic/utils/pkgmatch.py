@@ -0,0 +1,79 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import re
+
+class PackageMatcher(object):
+    """ Match package names against a list of kickstart package patterns:
+        'name', 'name.arch', 'prefix*', '*suffix' or '*infix*'
+
+        The patterns are compiled once into a set of the exact names, a set
+        of (name, arch) and one regex for all the wildcards, so a match
+        costs the same however long the list is.
+    """
+
+    def __init__(self, patterns = ()):
+        self.exact = set()
+        self.name_arch = set()
+        self._globs = []
+        self._regex = None
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        startx = pattern.startswith("*")
+        endx = pattern.endswith("*")
+        if not startx and not endx:
+            self.exact.add(pattern)
+            if "." in pattern:
+                self.name_arch.add(tuple(pattern.rsplit(".", 1)))
+            return
+
+        core = pattern.strip("*")
+        expr = re.escape(core)
+        if startx:
+            expr = ".*" + expr
+        if endx:
+            expr = expr + ".*"
+        self._globs.append(expr)
+        self._regex = None
+
+    def discard(self, pattern):
+        """ Drop an exact pattern """
+
+        self.exact.discard(pattern)
+        if "." in pattern:
+            self.name_arch.discard(tuple(pattern.rsplit(".", 1)))
+
+    def __len__(self):
+        return len(self.exact) + len(self._globs)
+
+    def match(self, name, arch = None):
+        """ Check whether the package 'name' of 'arch' matches any pattern,
+            without arch only the patterns without arch match it
+        """
+
+        if name in self.exact:
+            return True
+        if arch and (name, arch) in self.name_arch:
+            return True
+        if not self._globs:
+            return False
+
+        if self._regex is None:
+            self._regex = re.compile("^(?:%s)$" % "|".join(self._globs))
+        return self._regex.match(name) is not None
@@ -0,0 +1,320 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Content-addressed package store
+
+    Every package is kept once in <cachedir>/pkgstore/<sumtype>/<xx>/
+    <checksum>.rpm, the 'packages' dirs of the repos are views made of hard
+    links to it, so the same rpm from several repos takes the space once.
+    The atime of a store file is set to its last use, which drives the LRU
+    eviction under the quota; mtime is kept for the checksum memo.
+
+    The ingest and the eviction run one at a time under the store lock, and
+    leave alone the packages of the repos some build is using.
+"""
+
+from __future__ import with_statement
+import os
+import time
+
+from mic import msger
+import urlfetch
+import repoindex
+import locks
+
+STORE_DIR = "pkgstore"
+
+def _makedirs(dirname):
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+def _touch(path):
+    st = os.stat(path)
+    os.utime(path, (time.time(), st.st_mtime))
+
+def _link(src, dst):
+    """ Hard link src to dst, replacing dst atomically if it exists """
+
+    tmpfile = "%s.%d.tmp" % (dst, os.getpid())
+    os.link(src, tmpfile)
+    os.rename(tmpfile, dst)
+
+def _subdirs(dirname):
+    return [path for path in [os.path.join(dirname, name)
+                              for name in os.listdir(dirname)]
+            if os.path.isdir(path)]
+
+class PackageStore(object):
+    def __init__(self, cachedir, quota = 0):
+        """ quota: the max total size of the store in bytes, 0 for no limit
+        """
+
+        self.cachedir = cachedir
+        self.root = os.path.join(cachedir, STORE_DIR)
+        self.quota = quota
+
+    def path_of(self, sumtype, checksum):
+        return os.path.join(self.root, sumtype, checksum[:2],
+                            checksum + ".rpm")
+
+    def link(self, sumtype, checksum, target):
+        """ Make target a view of the stored package, if there is
+
+            return: True if target is linked
+        """
+
+        if not sumtype or not checksum:
+            return False
+
+        path = self.path_of(sumtype, checksum)
+        if not os.path.exists(path):
+            return False
+
+        _makedirs(os.path.dirname(target))
+        try:
+            _link(path, target)
+            _touch(path)
+        except OSError, err:
+            msger.debug("failed to link %s: %s" % (path, err))
+            return False
+
+        return True
+
+    def add(self, filename, sumtype, checksum):
+        """ Put a verified package into the store, filename turns into a
+            view of it; if it's there already, the duplicate is dropped
+        """
+
+        if not sumtype or not checksum:
+            return
+
+        path = self.path_of(sumtype, checksum)
+        try:
+            if os.path.exists(path):
+                if not os.path.samefile(path, filename):
+                    _link(path, filename)
+                _touch(path)
+            else:
+                _makedirs(os.path.dirname(path))
+                _link(filename, path)
+        except OSError, err:
+            # e.g. cross filesystem, just keep the plain file
+            msger.debug("failed to store %s: %s" % (filename, err))
+
+    def _iter_store(self):
+        if not os.path.isdir(self.root):
+            return
+
+        for (root, dirs, files) in os.walk(self.root):
+            for fname in files:
+                if fname.endswith(".rpm"):
+                    yield os.path.join(root, fname)
+
+    def _iter_views(self):
+        """ The rpms in the packages dirs of the repos, <cachedir>/packages/
+            <repo> or <cachedir>/<repo>/packages; the other trees in cachedir
+            such as the snapshots and the mirrors aren't walked
+        """
+
+        if not os.path.isdir(self.cachedir):
+            return
+
+        for name in os.listdir(self.cachedir):
+            if name == STORE_DIR:
+                continue
+            if name == "packages":
+                pkgdirs = _subdirs(os.path.join(self.cachedir, name))
+            else:
+                pkgdir = os.path.join(self.cachedir, name, "packages")
+                if not os.path.isdir(pkgdir):
+                    continue
+                pkgdirs = [pkgdir] + _subdirs(pkgdir)
+
+            for pkgdir in pkgdirs:
+                for fname in os.listdir(pkgdir):
+                    path = os.path.join(pkgdir, fname)
+                    if fname.endswith(".rpm") and os.path.isfile(path):
+                        yield path
+
+    def stats(self):
+        """ return: dict of 'packages' and 'size' of the store, 'unused' the
+                    number of stored packages without any view, 'views' and
+                    'views_outside' the number of view files and the ones
+                    not in the store yet
+        """
+
+        result = {'packages': 0, 'size': 0, 'unused': 0,
+                  'views': 0, 'views_outside': 0}
+        for path in self._iter_store():
+            st = os.stat(path)
+            result['packages'] += 1
+            result['size'] += st.st_size
+            if st.st_nlink == 1:
+                result['unused'] += 1
+
+        for path in self._iter_views():
+            result['views'] += 1
+            if os.stat(path).st_nlink == 1:
+                result['views_outside'] += 1
+
+        return result
+
+    def _repo_of(self, view):
+        """ The name of the repo the view belongs to, its packages are in
+            <cachedir>/packages/<repo> or <cachedir>/<repo>/packages
+        """
+
+        parts = os.path.relpath(view, self.cachedir).split(os.sep)
+        i = parts.index("packages")
+        if i == 0:
+            return parts[1]
+        return parts[i - 1]
+
+    def _repo_sumtype(self, reponame):
+        sumtype = repoindex.get_primary_sumtype(
+                      os.path.join(self.cachedir, reponame, "repomd.xml"))
+        if sumtype == "sha":
+            sumtype = "sha1"
+        return sumtype
+
+    def _lock_repos(self, reponames):
+        """ Take the packages locks of the repos no build is using
+
+            return: (the locks taken, the names of the repos in use)
+        """
+
+        taken = []
+        busy = set()
+        for reponame in sorted(reponames):
+            lock = locks.packages_lock(self.cachedir, reponame)
+            if lock.acquire(blocking = False):
+                taken.append(lock)
+            else:
+                msger.verbose("packages of repo %s are in use, skipped"
+                              % reponame)
+                busy.add(reponame)
+        return (taken, busy)
+
+    def ingest(self):
+        """ Move the packages outside into the store by the checksum type of
+            their repos, the duplicates among them are dropped; the ones of
+            the repos with unknown checksum type are left outside
+
+            return: number of ingested packages
+        """
+
+        with locks.store_lock(self.cachedir):
+            outside = {}
+            for path in self._iter_views():
+                if os.stat(path).st_nlink == 1:
+                    outside.setdefault(self._repo_of(path), []).append(path)
+
+            (taken, busy) = self._lock_repos(outside.keys())
+            try:
+                count = 0
+                for (reponame, paths) in outside.iteritems():
+                    if reponame in busy:
+                        continue
+
+                    sumtype = self._repo_sumtype(reponame)
+                    if not sumtype:
+                        msger.verbose("unknown checksum type of repo %s, "
+                                      "its packages are left outside"
+                                      % reponame)
+                        continue
+
+                    for path in paths:
+                        checksum = urlfetch.file_checksum(path, sumtype)
+                        self.add(path, sumtype, checksum)
+                        count += 1
+            finally:
+                for lock in taken:
+                    lock.release()
+
+        return count
+
+    def evict(self, quota = None):
+        """ Evict the least recently used packages, with their views, until
+            the store fits the quota; the ones with views of the repos in use
+            are kept
+
+            return: (number of evicted packages, bytes freed)
+        """
+
+        if quota is None:
+            quota = self.quota
+        if not quota:
+            return (0, 0)
+
+        with locks.store_lock(self.cachedir):
+            entries = []
+            total = 0
+            for path in self._iter_store():
+                st = os.stat(path)
+                entries.append((st.st_atime, path, st))
+                total += st.st_size
+
+            if total <= quota:
+                return (0, 0)
+
+            reponames = set([self._repo_of(path)
+                             for path in self._iter_views()])
+            (taken, busy) = self._lock_repos(reponames)
+            try:
+                # scanned again under the locks, the views of a repo which
+                # turned up meanwhile aren't locked, taken as in use
+                views = {}
+                for path in self._iter_views():
+                    if self._repo_of(path) not in reponames:
+                        busy.add(self._repo_of(path))
+                    views.setdefault(os.stat(path).st_ino, []).append(path)
+
+                entries.sort()
+                evicted = 0
+                freed = 0
+                for (atime, path, st) in entries:
+                    if total <= quota:
+                        break
+
+                    inuse = [view for view in views.get(st.st_ino, [])
+                             if self._repo_of(view) in busy]
+                    if inuse:
+                        continue
+
+                    msger.verbose("evict %s, last used %s"
+                                  % (path, time.ctime(atime)))
+                    for view in views.get(st.st_ino, []):
+                        os.unlink(view)
+                    os.unlink(path)
+                    total -= st.st_size
+                    freed += st.st_size
+                    evicted += 1
+            finally:
+                for lock in taken:
+                    lock.release()
+
+        return (evicted, freed)
+
+    def gc(self, quota = None):
+        """ Ingest the packages outside then evict to the quota """
+
+        self.ingest()
+        return self.evict(quota)
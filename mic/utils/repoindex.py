@@ -0,0 +1,381 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from __future__ import with_statement
+import os
+import tempfile
+import threading
+import cPickle as pickle
+
+import rpm
+
+try:
+    import sqlite3 as sqlite
+except ImportError:
+    import sqlite
+
+try:
+    from xml.etree import cElementTree
+except ImportError:
+    import cElementTree
+
+from mic import msger
+import urlfetch
+
+# bump it when the layout of the persisted index changes
+INDEX_VERSION = 2
+
+# fields of one package entry in the index, CHECKSUM is (sumtype, checksum)
+(EPOCH, VERSION, RELEASE, ARCH, LOCATION, SOURCERPM, CHECKSUM) = range(7)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _localname(tag):
+    return tag[tag.rfind('}')+1:]
+
+def _get_primary_info(repomd):
+    """ Get the (open-checksum, checksum type) of primary data recorded in
+        repomd.xml, by one parse
+    """
+
+    if not repomd or not os.path.exists(repomd):
+        return (None, None)
+
+    try:
+        root = cElementTree.parse(repomd).getroot()
+    except SyntaxError:
+        return (None, None)
+
+    for elm in root:
+        if _localname(elm.tag) != "data" or \
+           elm.attrib.get("type") not in ("primary_db", "primary"):
+            continue
+
+        (checksum, sumtype) = (None, None)
+        for sub in elm:
+            tag = _localname(sub.tag)
+            if tag == "open-checksum":
+                checksum = sub.text
+            elif tag == "checksum":
+                sumtype = sub.attrib.get("type")
+        return (checksum, sumtype)
+
+    return (None, None)
+
+def get_primary_checksum(repomd):
+    """ Get the open-checksum of primary data recorded in repomd.xml """
+
+    return _get_primary_info(repomd)[0]
+
+def get_primary_sumtype(repomd):
+    """ Get the checksum type of primary data recorded in repomd.xml, the
+        one of the packages of the repo as well
+    """
+
+    return _get_primary_info(repomd)[1]
+
+def _iter_primary_xml(primary):
+    """ Streaming parse of primary.xml, yield (name, entry) """
+
+    context = cElementTree.iterparse(primary, events = ("start", "end"))
+    root = None
+    for (event, elm) in context:
+        if root is None:
+            root = elm
+        if event != "end" or _localname(elm.tag) != "package":
+            continue
+
+        name = None
+        entry = [None, None, None, None, None, None, None]
+        for sub in elm:
+            tag = _localname(sub.tag)
+            if tag == "name":
+                name = sub.text
+            elif tag == "arch":
+                entry[ARCH] = sub.text
+            elif tag == "version":
+                entry[EPOCH] = sub.attrib.get("epoch")
+                entry[VERSION] = sub.attrib.get("ver")
+                entry[RELEASE] = sub.attrib.get("rel")
+            elif tag == "location":
+                entry[LOCATION] = sub.attrib.get("href")
+            elif tag == "checksum":
+                entry[CHECKSUM] = (sub.attrib.get("type"), sub.text)
+            elif tag == "format":
+                for fmt in sub:
+                    if _localname(fmt.tag) == "sourcerpm":
+                        entry[SOURCERPM] = fmt.text
+                        break
+
+        # drop the parsed elements to keep the memory flat
+        root.clear()
+
+        if name:
+            yield (name, tuple(entry))
+
+def _iter_primary_sqlite(primary):
+    con = sqlite.connect(primary)
+    try:
+        for row in con.execute("select name, epoch, version, release, arch, "
+                               "location_href, rpm_sourcerpm, checksum_type, "
+                               "pkgId from packages"):
+            yield (row[0], tuple(row[1:7]) + ((row[7], row[8]),))
+    finally:
+        con.close()
+
+def _load_pickle(path, checksum):
+    try:
+        with open(path, 'rb') as rf:
+            data = pickle.load(rf)
+    except Exception:
+        return None
+
+    if data.get('version') != INDEX_VERSION or \
+       data.get('checksum') != checksum:
+        return None
+
+    return data
+
+def _save_pickle(path, checksum, data):
+    data = dict(data, version = INDEX_VERSION, checksum = checksum)
+
+    # write to temp file then rename, readers never see a partial file
+    (fd, tmpfile) = tempfile.mkstemp(dir = os.path.dirname(path),
+                                     prefix = ".%s-" % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as wf:
+            pickle.dump(data, wf, pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmpfile, 0644)
+        os.rename(tmpfile, path)
+    except (IOError, OSError), err:
+        msger.debug("failed to save index %s: %s" % (path, err))
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+
+def _get_file_checksum(path):
+    checksum = urlfetch.get_cached_checksum(path)
+    if not checksum:
+        # no checksum recorded, fall back to the stat info
+        st = os.stat(path)
+        checksum = "%d-%d" % (st.st_size, st.st_mtime)
+    return checksum
+
+def _cmp_entry(e1, e2):
+    return rpm.labelCompare((e1[EPOCH] or '0', e1[VERSION], e1[RELEASE]),
+                            (e2[EPOCH] or '0', e2[VERSION], e2[RELEASE]))
+
+class RepoIndex(object):
+    """ A compact name -> [(epoch, ver, rel, arch, location, sourcerpm,
+        checksum)] index of the primary data of one repo
+    """
+
+    def __init__(self, packages = None, arches = None):
+        self.packages = packages or {}
+        self.arches = arches or []
+
+    def add(self, name, entry):
+        if name in self.packages:
+            self.packages[name].append(entry)
+        else:
+            self.packages[name] = [entry]
+
+        if entry[ARCH] not in self.arches:
+            self.arches.append(entry[ARCH])
+
+    def get_best(self, name, arch = None):
+        """ Get the entry with the highest EVR of package 'name', only the
+            entries of 'arch' are considered if specified, else the binary
+            (non-src) ones
+        """
+
+        best = None
+        for entry in self.packages.get(name, []):
+            if arch:
+                if entry[ARCH] != arch:
+                    continue
+            elif entry[ARCH] == "src":
+                continue
+
+            if best is None or _cmp_entry(entry, best) > 0:
+                best = entry
+
+        return best
+
+    @classmethod
+    def build(cls, primary):
+        idx = cls()
+        if primary.endswith(".sqlite"):
+            entries = _iter_primary_sqlite(primary)
+        else:
+            entries = _iter_primary_xml(primary)
+
+        for (name, entry) in entries:
+            idx.add(name, entry)
+
+        return idx
+
+    @classmethod
+    def load(cls, path, checksum):
+        data = _load_pickle(path, checksum)
+        if data is None:
+            return None
+        return cls(data['packages'], data['arches'])
+
+    def save(self, path, checksum):
+        _save_pickle(path, checksum, {'packages': self.packages,
+                                      'arches': self.arches})
+
+def get_index(repo):
+    """ Get the package index of one repo in repo metadata, which is built
+        once per primary checksum and persisted next to the repo cache, and
+        kept in memory by the stat of primary
+    """
+
+    primary = repo["primary"]
+
+    # the memo is looked up by the stat of primary, repomd.xml is parsed
+    # only when it's missed
+    st = os.stat(primary)
+    key = (primary, st.st_size, st.st_mtime, st.st_ino)
+    with _indexes_lock:
+        if key in _indexes:
+            return _indexes[key]
+
+    checksum = get_primary_checksum(repo.get("repomd")) or \
+               _get_file_checksum(primary)
+
+    idxfile = os.path.join(os.path.dirname(primary), "primary.idx")
+    idx = RepoIndex.load(idxfile, checksum)
+    if idx is None:
+        msger.debug("building package index of repo %s" % repo["name"])
+        idx = RepoIndex.build(primary)
+        idx.save(idxfile, checksum)
+
+    with _indexes_lock:
+        _indexes[key] = idx
+
+    return idx
+
+def find_package(name, repometadata, arch = None):
+    """ Find the best package 'name' in all the repos
+
+        return: (repo, entry) or (None, None) if not found
+    """
+
+    target_repo = None
+    best = None
+    for repo in repometadata:
+        entry = get_index(repo).get_best(name, arch)
+        if entry is None:
+            continue
+        if best is None or _cmp_entry(entry, best) > 0:
+            best = entry
+            target_repo = repo
+
+    return (target_repo, best)
+
+def _iter_patterns(patterns):
+    """ yield (keys, pkglist) of each pattern in patterns.xml """
+
+    root = cElementTree.parse(patterns).getroot()
+    for elm in root:
+        keys = []
+        requires = None
+        for sub in elm:
+            tag = _localname(sub.tag)
+            if tag in ("name", "summary") and sub.text:
+                keys.append(sub.text)
+            elif tag == "requires" and requires is None:
+                requires = sub
+
+        pkglist = []
+        if requires is not None:
+            pkglist = [pkg.attrib["name"] for pkg in requires]
+        yield (keys, pkglist)
+
+def _iter_comps(comps):
+    """ yield (keys, pkglist) of each group in comps.xml """
+
+    root = cElementTree.parse(comps).getroot()
+    for elm in root.getiterator("group"):
+        keys = []
+        for tag in ("id", "name"):
+            sub = elm.find(tag)
+            if sub is not None and sub.text:
+                keys.append(sub.text)
+
+        pkglist = [req.text for req in elm.getiterator("packagereq")]
+        yield (keys, pkglist)
+
+class GroupIndex(object):
+    """ A group id/name/summary -> package list index of comps or patterns
+    """
+
+    def __init__(self, groups = None):
+        self.groups = groups or {}
+
+    def get_packages(self, group):
+        return self.groups.get(group, ())
+
+    @classmethod
+    def build(cls, groupfile, kind):
+        if kind == "patterns":
+            items = _iter_patterns(groupfile)
+        else:
+            items = _iter_comps(groupfile)
+
+        groups = {}
+        for (keys, pkglist) in items:
+            # de-dup but keep the order in group file
+            seen = set()
+            pkgs = tuple([p for p in pkglist
+                          if p and not (p in seen or seen.add(p))])
+            for key in keys:
+                # the first group wins, as the linear search did
+                if key not in groups:
+                    groups[key] = pkgs
+
+        return cls(groups)
+
+def get_group_index(groupfile, kind):
+    """ Get the group index of comps (kind 'comps') or patterns (kind
+        'patterns') file, built once per file checksum and persisted next
+        to the file
+    """
+
+    checksum = _get_file_checksum(groupfile)
+    key = (groupfile, checksum)
+    with _indexes_lock:
+        if key in _indexes:
+            return _indexes[key]
+
+    idxfile = groupfile + ".idx"
+    data = _load_pickle(idxfile, checksum)
+    if data is not None:
+        idx = GroupIndex(data['groups'])
+    else:
+        try:
+            idx = GroupIndex.build(groupfile, kind)
+        except SyntaxError:
+            raise SyntaxError("%s syntax error." % groupfile)
+        _save_pickle(idxfile, checksum, {'groups': idx.groups})
+
+    with _indexes_lock:
+        _indexes[key] = idx
+
+    return idx
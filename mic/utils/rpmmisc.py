@@ -19,18 +19,21 @@ import os, sys, re
 import fcntl
 import struct
 import termios
+import threading
 import rpm
 from mic import msger
 from .errors import CreatorError
 from .proxy import get_proxy_for
 import runner
-from urlgrabber import grabber, __version__ as grabber_version
-if rpm.labelCompare(grabber_version.split('.'), '3.9.0'.split('.')) == -1:
-    msger.warning("Version of python-urlgrabber is %s, lower than '3.9.0', "
-                  "you may encounter some network issues" % grabber_version)
+import urlfetch
+import connpool
+
+def myurlgrab(url, filename, proxies, progress_obj = None, reget = None):
+    """ Download url to filename, on the shared keep-alive connections
+
+        reget: None, or 'simple' to continue the partial local file
+    """
 
-def myurlgrab(url, filename, proxies, progress_obj = None):
-    g = grabber.URLGrabber()
     if progress_obj is None:
         progress_obj = TextProgress()
 
@@ -40,13 +43,7 @@ def myurlgrab(url, filename, proxies, progress_obj = None):
             raise CreatorError("URLGrabber error: can't find file %s" % file)
         runner.show(['cp', "-f", file, filename])
     else:
-        try:
-            filename = g.urlgrab(url = url, filename = filename,
-                ssl_verify_host = False, ssl_verify_peer = False,
-                proxies = proxies, http_headers = (('Pragma', 'no-cache'),),
-                quote = 0, progress_obj = progress_obj)
-        except grabber.URLGrabError, e:
-            raise CreatorError("URLGrabber error: %s" % url)
+        filename = urlfetch.grab(url, filename, proxies, progress_obj, reget)
 
     return filename
 
@@ -65,6 +62,8 @@ def truncate_url(url, width):
 class TextProgress(object):
     # make the class as singleton
     _instance = None
+    # the downloads in threads share the instance
+    _lock = threading.Lock()
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(TextProgress, cls).__new__(cls, *args, **kwargs)
@@ -76,23 +75,31 @@ class TextProgress(object):
         self.counter = 1
 
     def start(self, filename, url, *args, **kwargs):
-        self.url = url
-        self.termwidth = terminal_width()
-        msger.info("\r%-*s" % (self.termwidth, " "))
-        if self.total is None:
-            msger.info("\rRetrieving %s ..." % truncate_url(self.url, self.termwidth - 15))
-        else:
-            msger.info("\rRetrieving %s [%d/%d] ..." % (truncate_url(self.url, self.termwidth - 25), self.counter, self.total))
+        self._lock.acquire()
+        try:
+            self.url = url
+            self.termwidth = terminal_width()
+            msger.info("\r%-*s" % (self.termwidth, " "))
+            if self.total is None:
+                msger.info("\rRetrieving %s ..." % truncate_url(self.url, self.termwidth - 15))
+            else:
+                msger.info("\rRetrieving %s [%d/%d] ..." % (truncate_url(self.url, self.termwidth - 25), self.counter, self.total))
+        finally:
+            self._lock.release()
 
     def update(self, *args):
         pass
 
     def end(self, *args):
-        if self.counter == self.total:
-            msger.raw("\n")
+        self._lock.acquire()
+        try:
+            if self.counter == self.total:
+                msger.raw("\n")
 
-        if self.total is not None:
-            self.counter += 1
+            if self.total is not None:
+                self.counter += 1
+        finally:
+            self._lock.release()
 
 class RPMInstallCallback:
     """ Command line callback class for callbacks from the RPM library.
@@ -579,6 +586,7 @@ def checkRepositoryEULA(name, repo):
     handlers = []
     auth_handler = u2.HTTPBasicAuthHandler(u2.HTTPPasswordMgrWithDefaultRealm())
     u2opener = None
+    proxies = None
     if proxy:
         if proxy_username:
             proxy_netloc = urlparse.urlsplit(proxy).netloc
@@ -589,10 +597,9 @@ def checkRepositoryEULA(name, repo):
         else:
             proxy_url = proxy
 
-        proxy_support = u2.ProxyHandler({'http': proxy_url,
-                                         'https': proxy_url,
-                                         'ftp': proxy_url})
-        handlers.append(proxy_support)
+        proxies = {'http': proxy_url,
+                   'https': proxy_url,
+                   'ftp': proxy_url}
 
     # download all remote files to one temp dir
     baseurl = None
@@ -618,8 +625,8 @@ def checkRepositoryEULA(name, repo):
             tmphandlers.append(auth_handler)
             url = scheme + "://" + host + path + parm + query + frag
 
-        if tmphandlers:
-            u2opener = u2.build_opener(*tmphandlers)
+        # share the keep-alive connections with the other downloads
+        u2opener = connpool.build_opener(proxies, *tmphandlers)
 
         # try to download
         repo_eula_url = urlparse.urljoin(url, "LICENSE.txt")
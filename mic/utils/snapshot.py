@@ -0,0 +1,248 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Snapshots of install roots with a base package set installed
+
+    The image variants sharing most of their packages start from the tree of
+    the common base set, installed once and kept in <cachedir>/snapshots by
+    the key of its resolution, then transact only their own packages. The
+    trees are copied by 'cp --reflink=auto', so they share the blocks on the
+    filesystems which support it.
+"""
+
+from __future__ import with_statement
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+
+from mic import msger
+from errors import CreatorError
+import runner
+import locks
+
+SNAP_DIR = "snapshots"
+
+# bump it when the layout of the snapshots changes
+SNAP_VERSION = 1
+
+# the snapshots kept, the least recently used ones are dropped
+SNAP_KEEP = 4
+
+# left out of the snapshots, the mounts and the files of each build
+SKIP_PATHS = ('proc', 'sys', 'dev', 'etc/fstab', 'etc/mtab')
+
+def common_packages(pkglists):
+    """ The largest package set shared by all the lists, without the
+        wildcards as their matches may differ
+    """
+
+    common = None
+    for pkgs in pkglists:
+        pkgs = set([pkg for pkg in pkgs if '*' not in pkg])
+        if common is None:
+            common = pkgs
+        else:
+            common &= pkgs
+
+    return sorted(common or [])
+
+def _copy_dir(src, dst, rel, skip):
+    entries = []
+    for name in sorted(os.listdir(os.path.join(src, rel))):
+        path = os.path.join(rel, name)
+        if path in skip:
+            continue
+
+        srcpath = os.path.join(src, path)
+        if os.path.isdir(srcpath) and not os.path.islink(srcpath) and \
+           [s for s in skip if s.startswith(path + '/')]:
+            dstpath = os.path.join(dst, path)
+            if not os.path.isdir(dstpath):
+                os.mkdir(dstpath)
+                st = os.lstat(srcpath)
+                shutil.copystat(srcpath, dstpath)
+                os.lchown(dstpath, st.st_uid, st.st_gid)
+            _copy_dir(src, dst, path, skip)
+        else:
+            entries.append(srcpath)
+
+    if not entries:
+        return
+
+    rc = runner.show(['cp', '-a', '--remove-destination', '--reflink=auto']
+                     + entries + [os.path.join(dst, rel)])
+    if rc != 0:
+        raise CreatorError("Failed to copy %s to %s"
+                           % (os.path.join(src, rel), os.path.join(dst, rel)))
+
+def copy_tree(src, dst, skip = ()):
+    """ Copy the content of the dir src into the dir dst, merged with what
+        is there
+
+        skip: the paths relative to src to leave out
+    """
+
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    _copy_dir(src, dst, '', set([path.strip('/') for path in skip]))
+
+class SnapshotStore(object):
+    def __init__(self, cachedir, keep = SNAP_KEEP, subdir = SNAP_DIR):
+        self.root = os.path.join(cachedir, subdir)
+        self.keep = keep
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _manifest(self, key):
+        return os.path.join(self._path(key), "manifest")
+
+    def lock(self, key):
+        """ The lock of the snapshot of key, the builds of the same base
+            wait for the first one to save it
+        """
+
+        return locks.artifact_lock(self._path(key))
+
+    def has(self, key):
+        return self.load_manifest(key) is not None
+
+    def _load(self, key):
+        try:
+            with open(self._manifest(key), 'rb') as rf:
+                data = pickle.load(rf)
+        except Exception:
+            return None
+
+        if data.get('version') != SNAP_VERSION:
+            return None
+        return data
+
+    def load_manifest(self, key):
+        """ return: the manifest saved with the snapshot, None if there isn't
+            a valid one
+        """
+
+        data = self._load(key)
+        if data is None:
+            return None
+        return data['manifest']
+
+    def save(self, key, instroot, manifest, skip = (), files = ()):
+        """ Save the tree of instroot as the snapshot of key
+
+            manifest: what to know about the tree without reading it, e.g.
+                      the installed packages
+            files: the files out of instroot to keep along with it
+        """
+
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+        tmpdir = tempfile.mkdtemp(dir = self.root, prefix = ".%s-" % key)
+        try:
+            copy_tree(instroot, os.path.join(tmpdir, "root"),
+                      SKIP_PATHS + tuple(skip))
+
+            names = []
+            if files:
+                os.mkdir(os.path.join(tmpdir, "files"))
+            for (i, fpath) in enumerate(files):
+                names.append("%d-%s" % (i, os.path.basename(fpath)))
+                shutil.copy2(fpath, os.path.join(tmpdir, "files", names[-1]))
+
+            with open(os.path.join(tmpdir, "manifest"), 'wb') as wf:
+                pickle.dump({'version': SNAP_VERSION, 'manifest': manifest,
+                             'files': names},
+                            wf, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpdir, 0755)
+
+            if os.path.exists(self._path(key)):
+                shutil.rmtree(self._path(key), ignore_errors = True)
+            os.rename(tmpdir, self._path(key))
+        except (IOError, OSError, CreatorError), err:
+            msger.warning("failed to save the snapshot %s: %s" % (key, err))
+            shutil.rmtree(tmpdir, ignore_errors = True)
+            return False
+
+        self.prune()
+        return True
+
+    def restore(self, key, instroot):
+        """ Copy the snapshot of key into instroot
+
+            return: its manifest, None if there isn't the snapshot
+        """
+
+        manifest = self.load_manifest(key)
+        if manifest is None:
+            return None
+
+        copy_tree(os.path.join(self._path(key), "root"), instroot)
+        # mark it as recently used
+        os.utime(self._manifest(key), None)
+        return manifest
+
+    def get_files(self, key, destdir):
+        """ Copy the files kept along with the snapshot of key into destdir
+
+            return: their paths, in the order they were saved
+        """
+
+        data = self._load(key)
+        if data is None:
+            return []
+
+        paths = []
+        for name in data.get('files', []):
+            paths.append(os.path.join(destdir, name.split('-', 1)[1]))
+            shutil.copy2(os.path.join(self._path(key), "files", name),
+                         paths[-1])
+        return paths
+
+    def discard(self, key):
+        if os.path.exists(self._path(key)):
+            shutil.rmtree(self._path(key), ignore_errors = True)
+
+    def prune(self):
+        """ Drop the least recently used snapshots over the limit, but the
+            ones in use
+        """
+
+        if not os.path.isdir(self.root):
+            return
+
+        snaps = []
+        for key in os.listdir(self.root):
+            if key.startswith('.'):
+                continue
+            try:
+                snaps.append((os.stat(self._manifest(key)).st_mtime, key))
+            except OSError:
+                snaps.append((0, key))
+
+        snaps.sort(reverse = True)
+        for (mtime, key) in snaps[self.keep:]:
+            lock = self.lock(key)
+            if not lock.acquire(blocking = False):
+                continue
+            try:
+                msger.verbose("dropping the outdated snapshot %s" % key)
+                self.discard(key)
+            finally:
+                lock.release()
@@ -0,0 +1,134 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Persistent solv caches of the zypp repos
+
+    The solv cache of a repo in <cachedir>/solv/<name> is stamped with the
+    revision of the repo: the checksum of its repomd.xml and its baseurl.
+    It's reused as long as the revision is unchanged, and a copy of it is
+    pooled in <cachedir>/solvpool/<revision> for the builds using the same
+    repo under another name.
+"""
+
+from __future__ import with_statement
+import os
+import shutil
+import hashlib
+
+from mic import msger
+import urlfetch
+
+SOLV_DIR = "solv"
+POOL_DIR = "solvpool"
+
+def get_revision(repomd, baseurl):
+    """ The revision of a repo by its repomd.xml file and baseurl """
+
+    hashobj = hashlib.sha256()
+    hashobj.update(urlfetch.file_checksum(repomd, "sha256"))
+    hashobj.update(baseurl.rstrip('/'))
+    return hashobj.hexdigest()
+
+def _link_tree(src, dst):
+    """ Copy the dir src to dst by hard links, the files of the solv caches
+        are always replaced but never modified in place
+    """
+
+    tmpdir = "%s.%d.tmp" % (dst, os.getpid())
+    shutil.rmtree(tmpdir, ignore_errors = True)
+    os.makedirs(tmpdir)
+    for fname in os.listdir(src):
+        srcfile = os.path.join(src, fname)
+        if not os.path.isfile(srcfile):
+            continue
+        try:
+            os.link(srcfile, os.path.join(tmpdir, fname))
+        except OSError:
+            shutil.copy2(srcfile, os.path.join(tmpdir, fname))
+
+    shutil.rmtree(dst, ignore_errors = True)
+    os.rename(tmpdir, dst)
+
+class SolvCache(object):
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.solvdir = os.path.join(cachedir, SOLV_DIR)
+        self.pooldir = os.path.join(cachedir, POOL_DIR)
+
+    def _stamp_file(self, name):
+        return os.path.join(self.solvdir, "%s.revision" % name)
+
+    def get_stamp(self, name):
+        try:
+            with open(self._stamp_file(name)) as rf:
+                return rf.read().strip()
+        except IOError:
+            return None
+
+    def is_valid(self, name, revision):
+        """ Check whether the solv cache of repo 'name' is of revision """
+
+        return bool(revision) and self.get_stamp(name) == revision and \
+               os.path.exists(os.path.join(self.solvdir, name, "solv"))
+
+    def save(self, name, revision):
+        """ Stamp the solv cache of 'name' just built and pool it """
+
+        cachepath = os.path.join(self.solvdir, name)
+        if not revision or not os.path.exists(os.path.join(cachepath, "solv")):
+            return
+
+        oldrev = self.get_stamp(name)
+        with open(self._stamp_file(name), 'w') as wf:
+            wf.write(revision + "\n")
+
+        try:
+            if not os.path.isdir(self.pooldir):
+                os.makedirs(self.pooldir)
+            _link_tree(cachepath, os.path.join(self.pooldir, revision))
+            if oldrev and oldrev != revision:
+                # it's outdated, the other names of it still have own copies
+                shutil.rmtree(os.path.join(self.pooldir, oldrev),
+                              ignore_errors = True)
+        except (IOError, OSError), err:
+            msger.debug("failed to pool solv cache of %s: %s" % (name, err))
+
+    def restore(self, name, revision):
+        """ Get the solv cache of 'name' from the pool
+
+            return: True if it's restored
+        """
+
+        pooled = os.path.join(self.pooldir, revision or "")
+        if not revision or not os.path.exists(os.path.join(pooled, "solv")):
+            return False
+
+        try:
+            if not os.path.isdir(self.solvdir):
+                os.makedirs(self.solvdir)
+            _link_tree(pooled, os.path.join(self.solvdir, name))
+            with open(self._stamp_file(name), 'w') as wf:
+                wf.write(revision + "\n")
+        except (IOError, OSError), err:
+            msger.debug("failed to restore solv cache of %s: %s" % (name, err))
+            return False
+
+        return True
+
+    def invalidate(self, name):
+        if os.path.exists(self._stamp_file(name)):
+            os.unlink(self._stamp_file(name))
@@ -0,0 +1,84 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import threading
+import Queue
+
+DEFAULT_WORKERS = 4
+
+def _call(func, item, main = False):
+    try:
+        return (func(item), None)
+    except KeyboardInterrupt:
+        if main:
+            raise
+        return (None, KeyboardInterrupt())
+    except BaseException, err:
+        # SystemExit of msger.error() as well, else the slot is left empty
+        return (None, err)
+
+def map_parallel(func, items, workers = DEFAULT_WORKERS):
+    """ Call 'func' for every element of 'items' with a bounded number of
+        worker threads.
+
+        return:
+            a list of (result, error) tuples in the same order as 'items',
+            error is None if the call succeeded, else the exception raised
+            by 'func', so that the caller can report failures per item
+    """
+
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    try:
+        workers = int(workers)
+    except (TypeError, ValueError):
+        workers = DEFAULT_WORKERS
+    workers = max(1, min(workers, len(items)))
+
+    if workers == 1:
+        for i, item in enumerate(items):
+            results[i] = _call(func, item, True)
+        return results
+
+    jobs = Queue.Queue()
+    for i, item in enumerate(items):
+        jobs.put((i, item))
+
+    def _worker():
+        while True:
+            try:
+                i, item = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            results[i] = _call(func, item)
+
+    threads = []
+    for i in range(workers):
+        t = threading.Thread(target = _worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+
+    # join with timeout, else ^C can't interrupt the main thread
+    for t in threads:
+        while t.isAlive():
+            t.join(0.5)
+
+    return results
@@ -0,0 +1,98 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+""" Memo of the resolved transactions
+
+    The dependency resolution of an unchanged package selection against
+    unchanged repos gives the same result, so the install list is kept by a
+    key of all the inputs of the solver, and replayed next time instead of
+    solving again. Any change of the repos changes the key.
+"""
+
+from __future__ import with_statement
+import os
+import tempfile
+import hashlib
+import cPickle as pickle
+
+from mic import msger
+import urlfetch
+
+TRANS_DIR = "transactions"
+
+# bump it when the layout of the memo files changes
+TRANS_VERSION = 1
+
+def get_key(repometadata, arch, packages, groups, excluded, backend,
+            extra = ()):
+    """ The key of a transaction by all the inputs of the solver
+
+        repometadata: the list got by misc.get_metadata_from_repos
+        groups: [(name, include)]
+        extra: other inputs of the backend, e.g. local packages
+    """
+
+    repos = []
+    for repo in repometadata or []:
+        repos.append((repo['name'], repo['baseurl'],
+                      urlfetch.file_checksum(repo['repomd'], "sha256")))
+
+    data = (TRANS_VERSION, sorted(repos), arch, sorted(packages or []),
+            sorted(groups or []), sorted(excluded or []), backend,
+            sorted(extra))
+    return hashlib.sha256(repr(data)).hexdigest()
+
+class TransactionCache(object):
+    def __init__(self, cachedir):
+        self.root = os.path.join(cachedir, TRANS_DIR)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key):
+        """ return: the list of resolved packages, None if not memoized """
+
+        try:
+            with open(self._path(key), 'rb') as rf:
+                data = pickle.load(rf)
+        except Exception:
+            return None
+
+        if data.get('version') != TRANS_VERSION:
+            return None
+        return data['packages']
+
+    def save(self, key, packages):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+        (fd, tmpfile) = tempfile.mkstemp(dir = self.root, prefix = ".%s-" % key)
+        try:
+            with os.fdopen(fd, 'wb') as wf:
+                pickle.dump({'version': TRANS_VERSION,
+                             'packages': list(packages)},
+                            wf, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpfile, 0644)
+            os.rename(tmpfile, self._path(key))
+        except (IOError, OSError), err:
+            msger.debug("failed to save transaction %s: %s" % (key, err))
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+
+    def discard(self, key):
+        if os.path.exists(self._path(key)):
+            os.unlink(self._path(key))
@@ -0,0 +1,512 @@
+#!/usr/bin/python -tt
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from __future__ import with_statement
+import os
+import time
+import zlib
+import bz2
+import hashlib
+import shutil
+import tempfile
+import urllib2
+import httplib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the errors of the in-process decompressors on corrupt data
+DECOMPRESS_ERRORS = (EOFError, zlib.error)
+if lzma:
+    DECOMPRESS_ERRORS += (lzma.LZMAError,)
+if zstandard:
+    DECOMPRESS_ERRORS += (zstandard.ZstdError,)
+
+from mic import msger
+from errors import CreatorError
+from fs_related import find_binary_path
+import runner
+import connpool
+import locks
+
+BLOCK_SIZE = 65536
+
+class NotModified(Exception):
+    """ The server answered 304 to a conditional request """
+
+class RangeNotSatisfiable(Exception):
+    """ The server answered 416 to a range request """
+
+COMPRESS_SUFFIXES = (".gz", ".bz2", ".xz", ".zst", ".zstd")
+
+def get_uncompressed_name(filename):
+    (base, ext) = os.path.splitext(filename)
+    if ext in COMPRESS_SUFFIXES:
+        return base
+    return filename
+
+def new_hash(sumtype):
+    """ Get hashlib object of the checksum type used by repomd.xml """
+
+    if sumtype == "sha":
+        sumtype = "sha1"
+    try:
+        return hashlib.new(sumtype)
+    except ValueError:
+        raise CreatorError("Unsupported checksum type: %s" % sumtype)
+
+def file_checksum(filename, sumtype):
+    """ Compute the checksum of a local file in blocks """
+
+    hashobj = new_hash(sumtype)
+    with open(filename, 'rb') as rf:
+        while True:
+            data = rf.read(BLOCK_SIZE)
+            if not data:
+                break
+            hashobj.update(data)
+    return hashobj.hexdigest()
+
+class _ZlibDecompressor(object):
+    def __init__(self):
+        # 16 + MAX_WBITS to accept gzip header and trailer
+        self._dobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        return self._dobj.decompress(data)
+
+    def flush(self):
+        return self._dobj.flush()
+
+class _SimpleDecompressor(object):
+    def __init__(self, dobj):
+        self._dobj = dobj
+
+    def decompress(self, data):
+        return self._dobj.decompress(data)
+
+    def flush(self):
+        return ''
+
+def get_decompressor(filename):
+    """ Get the streaming decompressor for filename by its suffix
+
+        return: None for uncompressed file, or if no in-process decompressor
+                is available for the format
+    """
+
+    ext = os.path.splitext(filename)[1]
+    if ext == ".gz":
+        return _ZlibDecompressor()
+    if ext == ".bz2":
+        return _SimpleDecompressor(bz2.BZ2Decompressor())
+    if ext == ".xz" and lzma:
+        return _SimpleDecompressor(lzma.LZMADecompressor())
+    if ext in (".zst", ".zstd") and zstandard:
+        return _SimpleDecompressor(
+                   zstandard.ZstdDecompressor().decompressobj())
+    return None
+
+def urlopen(url, proxies = None, headers = None, timeout = None):
+    """ Open url for streaming read, 'file:' urls are opened directly
+
+        return: a file-like object with read() and close()
+    """
+
+    if url.startswith("file:"):
+        fpath = url.replace("file:", "", 1)
+        if fpath.startswith("//"):
+            fpath = "/" + fpath.lstrip("/")
+        try:
+            return open(fpath, 'rb')
+        except IOError:
+            raise CreatorError("URLGrabber error: can't find file %s" % fpath)
+
+    request = urllib2.Request(url)
+    request.add_header('Pragma', 'no-cache')
+    if headers:
+        for (key, val) in headers:
+            request.add_header(key, val)
+
+    try:
+        opener = connpool.build_opener(proxies)
+        if timeout:
+            return opener.open(request, timeout = timeout)
+        return opener.open(request)
+    except urllib2.HTTPError, err:
+        if err.code == 304:
+            raise NotModified(url)
+        if err.code == 416:
+            raise RangeNotSatisfiable(url)
+        raise CreatorError("URLGrabber error: %s: %s" % (url, err))
+    except (urllib2.URLError, httplib.HTTPException, IOError, OSError), err:
+        raise CreatorError("URLGrabber error: %s: %s" % (url, err))
+
+def _write_checksum_info(filename, sumtype, checksum):
+    st = os.stat(filename)
+    with open(filename + ".sum", 'w') as wf:
+        wf.write("%s %s %d %d\n" % (sumtype, checksum,
+                                    st.st_size, int(st.st_mtime)))
+
+def _read_checksum_info(filename):
+    """ return: (sumtype, checksum) recorded when filename was stored, None
+        if it's unknown or the file changed since then
+    """
+
+    try:
+        with open(filename + ".sum") as rf:
+            (rtype, rsum, rsize, rmtime) = rf.read().split()
+        st = os.stat(filename)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if int(rsize) != st.st_size or int(rmtime) != int(st.st_mtime):
+        return None
+
+    return (rtype, rsum)
+
+def get_cached_checksum(filename):
+    """ Get the checksum recorded when filename was stored, None if it's
+        unknown or the file changed since then
+    """
+
+    info = _read_checksum_info(filename)
+    if info is None:
+        return None
+    return info[1]
+
+def is_cached(filename, sumtype, checksum):
+    """ Check whether filename is the verified copy of checksum, by the info
+        recorded when it was stored, without reading the file itself
+    """
+
+    if not sumtype or not checksum:
+        return False
+
+    return _read_checksum_info(filename) == (sumtype, checksum)
+
+def _copy_stream(fobj, wf, decompressor, hashobj, rawf = None):
+    while True:
+        data = fobj.read(BLOCK_SIZE)
+        if not data:
+            break
+        if rawf:
+            rawf.write(data)
+        if decompressor:
+            data = decompressor.decompress(data)
+        if hashobj:
+            hashobj.update(data)
+        wf.write(data)
+
+    if decompressor:
+        data = decompressor.flush()
+        if data:
+            if hashobj:
+                hashobj.update(data)
+            wf.write(data)
+
+class _NullWriter(object):
+    def write(self, data):
+        pass
+
+def _decompress_by_tool(filename):
+    """ Fallback for the formats without in-process decompressor """
+
+    ext = os.path.splitext(filename)[1]
+    target = get_uncompressed_name(filename)
+    if ext == ".xz":
+        argv = [find_binary_path("xz"), "-d", "-f", filename]
+    elif ext in (".zst", ".zstd"):
+        argv = [find_binary_path("zstd"), "-d", "-f", "-q", "--rm",
+                filename, "-o", target]
+    else:
+        return filename
+
+    if runner.quiet(argv) != 0:
+        raise CreatorError("Failed to decompress %s" % filename)
+
+    return target
+
+def fetch(url, filename, proxies = None, sumtype = None, checksum = None,
+          decompress = True, rawcopy = None):
+    """ Download url to filename in one streaming pass: decompress the data
+        on the fly (by the suffix of filename) and compute the checksum of
+        the uncompressed content.
+
+        rawcopy: the path to keep the data as downloaded as well, it's only
+                 stored if the checksum matches
+
+        return: the path of the stored (uncompressed) file
+    """
+
+    # another process sharing the cachedir may be getting the same file,
+    # wait for it and reuse its result
+    with locks.artifact_lock(filename):
+        target = filename
+        if decompress:
+            target = get_uncompressed_name(filename)
+        if is_cached(target, sumtype, checksum) and \
+           (not rawcopy or os.path.exists(rawcopy)):
+            return target
+
+        msger.verbose("retrieving %s" % url)
+        return _store(urlopen(url, proxies), url, filename, sumtype, checksum,
+                      decompress, rawcopy)
+
+def _store(fobj, url, filename, sumtype = None, checksum = None,
+           decompress = True, rawcopy = None):
+    decompressor = None
+    target = filename
+    if decompress:
+        decompressor = get_decompressor(filename)
+        if decompressor:
+            target = get_uncompressed_name(filename)
+
+    hashobj = None
+    if sumtype:
+        hashobj = new_hash(sumtype)
+
+    # write to temp file then rename, readers never see a partial file
+    (fd, tmpfile) = tempfile.mkstemp(dir = os.path.dirname(target),
+                                     prefix = ".%s-" % os.path.basename(target))
+    rawtmp = None
+    rawf = None
+    done = False
+    try:
+        if rawcopy and decompressor:
+            (rawfd, rawtmp) = tempfile.mkstemp(dir = os.path.dirname(rawcopy),
+                                prefix = ".%s-" % os.path.basename(rawcopy))
+            rawf = os.fdopen(rawfd, 'wb')
+
+        try:
+            try:
+                with os.fdopen(fd, 'wb') as wf:
+                    _copy_stream(fobj, wf, decompressor, hashobj, rawf)
+            finally:
+                fobj.close()
+                if rawf:
+                    rawf.close()
+        except (IOError, OSError) + DECOMPRESS_ERRORS, err:
+            raise CreatorError("URLGrabber error: %s: %s" % (url, err))
+
+        if decompress and not decompressor and \
+           get_uncompressed_name(filename) != filename:
+            # no in-process decompressor, let the tool do it and hash the
+            # result
+            os.rename(tmpfile, filename)
+            tmpfile = filename
+            if rawcopy:
+                rawtmp = _link_or_copy(filename, rawcopy)
+            target = _decompress_by_tool(filename)
+            tmpfile = target
+            if sumtype:
+                hashobj = new_hash(sumtype)
+                with open(target, 'rb') as rf:
+                    _copy_stream(rf, _NullWriter(), None, hashobj)
+
+        if hashobj:
+            digest = hashobj.hexdigest()
+            if checksum and digest != checksum:
+                raise CreatorError("Checksum mismatch of %s: expected %s, "
+                                   "got %s" % (url, checksum, digest))
+
+        os.chmod(tmpfile, 0644)
+        if tmpfile != target:
+            os.rename(tmpfile, target)
+
+        if rawcopy and not rawtmp:
+            # it's not compressed, the copy is the same file
+            rawtmp = _link_or_copy(target, rawcopy)
+        if rawtmp:
+            os.chmod(rawtmp, 0644)
+            os.rename(rawtmp, rawcopy)
+        done = True
+    finally:
+        if not done:
+            for path in (tmpfile, rawtmp):
+                if path and os.path.exists(path):
+                    os.unlink(path)
+
+    if hashobj:
+        _write_checksum_info(target, sumtype, digest)
+
+    return target
+
+def _link_or_copy(src, dst):
+    """ Link or copy src to a temp file beside dst, return the temp file """
+
+    tmpfile = "%s.%d.tmp" % (dst, os.getpid())
+    if os.path.exists(tmpfile):
+        os.unlink(tmpfile)
+    try:
+        os.link(src, tmpfile)
+    except OSError:
+        shutil.copy2(src, tmpfile)
+    return tmpfile
+
+def grab(url, filename, proxies = None, progress_obj = None, reget = None):
+    """ Download url to filename as it is, on the pooled connections
+
+        progress_obj: an object with start(filename, url), update(size) and
+                      end(size) methods, e.g. TextProgress
+        reget: None, or 'simple' to continue the partial local file by
+               range request, else the file is written to a temp file and
+               renamed, never seen partially
+    """
+
+    with locks.artifact_lock(filename):
+        return _grab(url, filename, proxies, progress_obj, reget)
+
+def _grab(url, filename, proxies, progress_obj, reget):
+    offset = 0
+    headers = []
+    if reget and os.path.exists(filename):
+        offset = os.path.getsize(filename)
+        if offset:
+            headers.append(('Range', 'bytes=%d-' % offset))
+
+    if progress_obj:
+        progress_obj.start(os.path.basename(filename), url)
+
+    try:
+        fobj = urlopen(url, proxies, headers)
+    except RangeNotSatisfiable:
+        # the local file is already complete
+        if progress_obj:
+            progress_obj.end(offset)
+        return filename
+
+    target = filename
+    mode = 'wb'
+    if offset and getattr(fobj, 'code', None) == 206:
+        mode = 'ab'
+    elif not reget:
+        (fd, target) = tempfile.mkstemp(dir = os.path.dirname(filename),
+                                        prefix = ".%s-" % \
+                                                 os.path.basename(filename))
+        os.close(fd)
+
+    size = 0
+    try:
+        try:
+            with open(target, mode) as wf:
+                while True:
+                    data = fobj.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    wf.write(data)
+                    size += len(data)
+                    if progress_obj:
+                        progress_obj.update(size)
+        finally:
+            fobj.close()
+    except (IOError, OSError, httplib.HTTPException), err:
+        if target != filename:
+            os.unlink(target)
+        raise CreatorError("URLGrabber error: %s: %s" % (url, err))
+
+    if target != filename:
+        os.chmod(target, 0644)
+        os.rename(target, filename)
+
+    if progress_obj:
+        progress_obj.end(size)
+
+    return filename
+
+def _load_cacheinfo(filename):
+    try:
+        with open(filename + ".cacheinfo") as rf:
+            return json.load(rf)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _save_cacheinfo(filename, info):
+    try:
+        with open(filename + ".cacheinfo", 'w') as wf:
+            json.dump(info, wf)
+    except (IOError, OSError), err:
+        msger.debug("failed to save cache info of %s: %s" % (filename, err))
+
+def revalidate(url, filename, proxies = None, expire = 0, offline = False):
+    """ Fetch url to filename unless the cached copy is still valid
+
+        expire: seconds the cached copy is trusted without asking the
+                server, after that it's revalidated by ETag/Last-Modified
+        offline: use the cached copy only, never touch the network
+
+        return: (path, fetched), fetched is False if cached copy is used
+    """
+
+    with locks.artifact_lock(filename):
+        return _revalidate(url, filename, proxies, expire, offline)
+
+def _revalidate(url, filename, proxies, expire, offline):
+    cached = os.path.exists(filename)
+    if offline:
+        if not cached:
+            raise CreatorError("No cached copy of %s in offline mode" % url)
+        return (filename, False)
+
+    info = {}
+    if cached:
+        info = _load_cacheinfo(filename)
+        if time.time() - info.get('checked', 0) < expire:
+            return (filename, False)
+
+    headers = []
+    if cached and not url.startswith("file:"):
+        if info.get('etag'):
+            headers.append(('If-None-Match', info['etag']))
+        if info.get('last_modified'):
+            headers.append(('If-Modified-Since', info['last_modified']))
+
+    try:
+        fobj = urlopen(url, proxies, headers)
+    except NotModified:
+        msger.verbose("not modified: %s" % url)
+        info['checked'] = time.time()
+        _save_cacheinfo(filename, info)
+        return (filename, False)
+
+    info = {'checked': time.time()}
+    if hasattr(fobj, 'info'):
+        resp_headers = fobj.info()
+        if resp_headers.get('ETag'):
+            info['etag'] = resp_headers.get('ETag')
+        if resp_headers.get('Last-Modified'):
+            info['last_modified'] = resp_headers.get('Last-Modified')
+
+    msger.verbose("retrieving %s" % url)
+    _store(fobj, url, filename, decompress = False)
+    _save_cacheinfo(filename, info)
+    return (filename, True)
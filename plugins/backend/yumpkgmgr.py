@@ -26,8 +26,9 @@ import rpmUtils
 import yum
 
 from mic import msger
+from mic.conf import configmgr
 from mic.kickstart import ksparser
-from mic.utils import misc, rpmmisc
+from mic.utils import misc, rpmmisc, transcache
 from mic.utils.proxy import get_proxy_for
 from mic.utils.errors import CreatorError
 from mic.imager.baseimager import BaseImageCreator
@@ -44,6 +45,9 @@ sslverify=1
 """
 
 class MyYumRepository(yum.yumRepo.YumRepository):
+    # the local mirror of the metadata mic already retrieved and verified
+    mdmirror = None
+
     def __del__(self):
         pass
 
@@ -72,6 +76,13 @@ class MyYumRepository(yum.yumRepo.YumRepository):
             m2c_connection = M2Crypto.SSL.Connection.clientPostConnectionCheck
             M2Crypto.SSL.Connection.clientPostConnectionCheck = None
 
+        if not url and relative and self.mdmirror and \
+           os.path.exists(os.path.join(self.mdmirror.replace("file://", "", 1),
+                                       relative)):
+            msger.verbose("use %s of repo %s from the local mirror"
+                          % (relative, self.id))
+            url = self.mdmirror
+
         size = int(size) if size else None
         rvalue = super(MyYumRepository, self)._getFile(url,
                                                        relative,
@@ -262,6 +273,19 @@ class Yum(BackendPlugin, yum.YumBase):
 
         if url:
             repo.baseurl.append(_varSubstitute(url))
+        elif mirrorlist:
+            # use the ranked mirrors as baseurls, yum fails over to them in
+            # order as failovermethod is "priority"
+            proxies = None
+            if proxy:
+                proxies = {str(mirrorlist.split(':')[0]): str(proxy)}
+            # the same mirrors the repo metadata was retrieved from
+            mirrors = misc.get_repo_mirrorset(name, mirrorlist, proxies,
+                                    configmgr.create['cachedir'],
+                                    configmgr.create['metadata_expire'],
+                                    configmgr.create['offline'])
+            repo.baseurl.extend(mirrors.get_mirrors())
+            mirrorlist = None
 
         # check LICENSE files
         if not rpmmisc.checkRepositoryEULA(name, repo):
@@ -277,6 +301,8 @@ class Yum(BackendPlugin, yum.YumBase):
                 repo.setAttribute(k, v)
 
         repo.sslverify = ssl_verify
+        repo.mdmirror = misc.get_metadata_mirror(configmgr.create['repomd'],
+                                                 name)
 
         repo.basecachedir = self.cachedir
         repo.base_persistdir = self.conf.persistdir
@@ -319,6 +345,66 @@ class Yum(BackendPlugin, yum.YumBase):
 
         return False
 
+    def buildTransaction(self):
+        cache = transcache.TransactionCache(self.cachedir)
+        if self.trans_key and not self.fresh_solve:
+            resolved = cache.load(self.trans_key)
+            if resolved is not None and self.__replay_transaction(resolved):
+                msger.info("Reuse the resolved transaction of %d packages"
+                           % len(resolved))
+                return (2, ['Success - reused resolved transaction'])
+
+        (res, resmsg) = yum.YumBase.buildTransaction(self)
+        if res == 2 and self.trans_key:
+            cache.save(self.trans_key,
+                       [self.__get_po_key(txmbr.po)
+                        for txmbr in self.tsInfo.getMembers()
+                        if txmbr.ts_state in ("i", "u")])
+
+        return (res, resmsg)
+
+    def __get_po_key(self, po):
+        return (po.name, po.epoch, po.version, po.release, po.arch,
+                po.repoid)
+
+    def __replay_transaction(self, resolved):
+        """ Put exactly the resolved packages into the transaction, without
+            solving
+
+            return: False if any of them isn't in the repos any more
+        """
+
+        selected = {}
+        for txmbr in self.tsInfo.getMembers():
+            selected[self.__get_po_key(txmbr.po)] = txmbr.po
+
+        pos = []
+        for key in resolved:
+            if key in selected:
+                # e.g. local packages, not in the repos
+                pos.append(selected[key])
+                continue
+
+            (name, epoch, ver, rel, arch, repoid) = key
+            found = [po for po in self.pkgSack.searchNevra(name = name,
+                                                           epoch = epoch,
+                                                           ver = ver,
+                                                           rel = rel,
+                                                           arch = arch)
+                     if po.repoid == repoid]
+            if not found:
+                msger.verbose("resolved transaction is outdated, %s is "
+                              "missing" % name)
+                return False
+            pos.append(found[0])
+
+        for txmbr in self.tsInfo.getMembers():
+            self.tsInfo.remove(txmbr.po.pkgtup)
+        for po in pos:
+            self.tsInfo.addInstall(po)
+
+        return True
+
     def runInstall(self, checksize = 0):
         os.environ["HOME"] = "/"
         os.environ["LD_PRELOAD"] = ""
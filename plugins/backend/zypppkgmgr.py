@@ -15,8 +15,11 @@
 # with this program; if not, write to the Free Software Foundation, Inc., 59
 # Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+from __future__ import with_statement
 import os
 import shutil
+import hashlib
+import glob
 import urlparse
 import rpm
 
@@ -28,8 +31,11 @@ if not hasattr(zypp, 'PoolQuery') or \
                       "version which can be found in repo.meego.com/tools")
 
 from mic import msger
+from mic.conf import configmgr
 from mic.kickstart import ksparser
-from mic.utils import misc, rpmmisc, runner, fs_related
+from mic.utils import misc, rpmmisc, runner, fs_related, mirror, download, \
+                      connpool, pkgcheck, pkgstore, locks, \
+                      solvcache, urlfetch, transcache, pkgmatch, hdrcache
 from mic.utils.proxy import get_proxy_for
 from mic.utils.errors import CreatorError, RepoError, RpmError
 from mic.imager.baseimager import BaseImageCreator
@@ -48,6 +54,20 @@ class RepositoryStub:
         self.keeppackages = True
         self.priority = None
 
+# the number of the solv files of local packages kept in cache
+LOCAL_SOLV_KEEP = 8
+
+def _best_item(items):
+    """ The item of the highest EVR among items """
+
+    best = None
+    for item in items:
+        ed = item.edition()
+        evr = (str(ed.epoch()), str(ed.version()), str(ed.release()))
+        if best is None or rpm.labelCompare(evr, best[0]) > 0:
+            best = (evr, item)
+    return best[1]
+
 from mic.pluginbase import BackendPlugin
 class Zypp(BackendPlugin):
     name = 'zypp'
@@ -61,9 +81,13 @@ class Zypp(BackendPlugin):
         self.__pkgs_content = {}
         self.repos = []
         self.to_deselect = []
+        self.deselect_matcher = None
         self.localpkgs = {}
         self.repo_manager = None
         self.repo_manager_options = None
+        # repo files of this build, private as the cachedir may be shared
+        self.reposdir = os.path.join(self.cachedir, "etc", str(os.getpid()),
+                                     "zypp/repos.d")
         self.Z = None
         self.ts = None
         self.ts_pre = None
@@ -75,6 +99,19 @@ class Zypp(BackendPlugin):
 
         self.has_prov_query = True
 
+        # memo of the cached packages verified by checksum
+        self.verified = pkgcheck.VerifiedFiles(os.path.join(self.cachedir,
+                                                            "verified.memo"))
+        # packages are stored once by checksum, shared by all the repos
+        self.store = pkgstore.PackageStore(self.cachedir,
+                        configmgr.create['cache_quota'] * 1024 * 1024)
+        # solv caches kept across the builds by repo revision
+        self.solvcache = solvcache.SolvCache(self.cachedir)
+        # the revisions of the repos when added, by name
+        self.repo_revisions = {}
+        self.headers = hdrcache.HeaderCache(os.path.join(self.cachedir,
+                                                         "headers"))
+
     def doFileLogSetup(self, uid, logfile):
         # don't do the file log for the livecd as it can lead to open fds
         # being left and an inability to clean up after ourself
@@ -187,11 +224,7 @@ class Zypp(BackendPlugin):
                         cmp=lambda x,y: cmpEVR(x.edition(), y.edition()),
                         reverse=True):
 
-            if item.name() in self.excpkgs.keys() and \
-               self.excpkgs[item.name()] == item.repoInfo().name():
-                continue
-            if item.name() in self.incpkgs.keys() and \
-               self.incpkgs[item.name()] != item.repoInfo().name():
+            if self.__skipped_by_repo(item):
                 continue
 
             found = True
@@ -214,11 +247,7 @@ class Zypp(BackendPlugin):
                             q.queryResults(self.Z.pool()),
                             cmp=lambda x,y: cmpEVR(x.edition(), y.edition()),
                             reverse=True):
-                if item.name() in self.excpkgs.keys() and \
-                   self.excpkgs[item.name()] == item.repoInfo().name():
-                    continue
-                if item.name() in self.incpkgs.keys() and \
-                   self.incpkgs[item.name()] != item.repoInfo().name():
+                if self.__skipped_by_repo(item):
                     continue
 
                 found = True
@@ -231,34 +260,98 @@ class Zypp(BackendPlugin):
         else:
             raise CreatorError("Unable to find package: %s" % (pkg,))
 
+    def selectPackages(self, pkgs):
+        """Select a list of packages in one sweep of the pool, only the
+        wildcards and the ones found by provides are selected one by one
+
+        return: a list of None or the error for each of pkgs
+        """
+
+        if not self.Z:
+            self.__initialize_zypp()
+
+        parsed = {}
+        for pkg in pkgs:
+            if not pkg.startswith("*") and not pkg.endswith("*"):
+                parsed[pkg] = self._splitPkgString(pkg)
+        names = set([name for (name, arch) in parsed.values()])
+
+        # the candidates of all the names by one query
+        candidates = {}
+        q = zypp.PoolQuery()
+        q.addKind(zypp.ResKind.package)
+        for item in q.queryResults(self.Z.pool()):
+            name = item.name()
+            if name not in names or self.__skipped_by_repo(item):
+                continue
+            candidates.setdefault(name, []).append(item)
+
+        # nothing obsoletes them in most cases, then skip whatObsolete
+        obsoleted = False
+        if candidates:
+            q = zypp.PoolQuery()
+            q.addKind(zypp.ResKind.package)
+            q.setMatchExact()
+            for name in candidates:
+                q.addAttribute(zypp.SolvAttr.obsoletes, name)
+            for pi in q.queryResults(self.Z.pool()):
+                obsoleted = True
+                break
+
+        results = []
+        for pkg in pkgs:
+            if pkg not in parsed or parsed[pkg][0] not in candidates:
+                # wildcard, or to be found by provides
+                try:
+                    results.append(self.selectPackage(pkg))
+                except CreatorError, err:
+                    results.append(str(err))
+                continue
+
+            (name, arch) = parsed[pkg]
+            items = candidates[name]
+            if arch:
+                items = [item for item in items if str(item.arch()) == arch]
+                if items:
+                    _best_item(items).status().setToBeInstalled(
+                                                    zypp.ResStatus.USER)
+            else:
+                item = _best_item(items)
+                if obsoleted:
+                    item = self.whatObsolete(name) or item
+                item.status().setToBeInstalled(zypp.ResStatus.USER)
+            results.append(None)
+
+        return results
+
+    def __skipped_by_repo(self, item):
+        """ The item is excluded from its repo, or included from another
+            repo only, by the 'excludepkgs' and 'includepkgs' of repos
+        """
+
+        name = item.name()
+        if name in self.excpkgs and \
+           self.excpkgs[name] == item.repoInfo().name():
+            return True
+        if name in self.incpkgs and \
+           self.incpkgs[name] != item.repoInfo().name():
+            return True
+        return False
+
     def inDeselectPackages(self, item):
         """check if specified pacakges are in the list of inDeselectPackages
         """
 
-        name = item.name()
-        for pkg in self.to_deselect:
-            startx = pkg.startswith("*")
-            endx = pkg.endswith("*")
-            ispattern = startx or endx
-            pkgname, pkgarch = self._splitPkgString(pkg)
-            if not ispattern:
-                if pkgarch:
-                    if name == pkgname and str(item.arch()) == pkgarch:
-                        return True;
-                else:
-                    if name == pkgname:
-                        return True;
-            else:
-                if startx and name.endswith(pkg[1:]):
-                        return True;
-                if endx and name.startswith(pkg[:-1]):
-                        return True;
+        if self.deselect_matcher is None:
+            self.deselect_matcher = pkgmatch.PackageMatcher(self.to_deselect)
 
-        return False;
+        return self.deselect_matcher.match(item.name(), str(item.arch()))
 
     def deselectPackage(self, pkg):
         """collect packages should not be installed"""
         self.to_deselect.append(pkg)
+        # compiled again on the next match
+        self.deselect_matcher = None
 
     def selectGroup(self, grp, include = ksparser.GROUP_DEFAULT):
         if not self.Z:
@@ -300,8 +393,20 @@ class Zypp(BackendPlugin):
         if not self.repo_manager:
             self.__initialize_repo_manager()
 
-        if not proxy and url:
-            proxy = get_proxy_for(url)
+        if not proxy and (url or mirrorlist):
+            proxy = get_proxy_for(url or mirrorlist)
+
+        proxies = None
+        if proxy:
+            proxies = {str((url or mirrorlist).split(':')[0]): str(proxy)}
+
+        mirrorurls = []
+        if mirrorlist and not url:
+            mirrorurls = misc.get_repo_mirrorset(name, mirrorlist, proxies,
+                                    configmgr.create['cachedir'],
+                                    configmgr.create['metadata_expire'],
+                                    configmgr.create['offline']).get_mirrors()
+            url = mirrorurls.pop(0)
 
         repo = RepositoryStub()
         repo.name = name
@@ -311,6 +416,8 @@ class Zypp(BackendPlugin):
         repo.proxy_password = proxy_password
         repo.ssl_verify = ssl_verify
         repo.baseurl.append(url)
+        # the ranked mirrors, libzypp fails over to them in order
+        repo.baseurl.extend(mirrorurls)
         if inc:
             for pkg in inc:
                 self.incpkgs[pkg] = name
@@ -338,37 +445,44 @@ class Zypp(BackendPlugin):
             repo_info.setEnabled(repo.enabled)
             repo_info.setAutorefresh(repo.autorefresh)
             repo_info.setKeepPackages(repo.keeppackages)
-            baseurl = zypp.Url(repo.baseurl[0])
-            if not ssl_verify:
-                baseurl.setQueryParam("ssl_verify", "no")
-            if proxy:
-                scheme, host, path, parm, query, frag = urlparse.urlparse(proxy)
+            for i in range(len(repo.baseurl)):
+                baseurl = zypp.Url(repo.baseurl[i])
+                if not ssl_verify:
+                    baseurl.setQueryParam("ssl_verify", "no")
+                if proxy:
+                    scheme, host, path, parm, query, frag = urlparse.urlparse(proxy)
 
-                proxyinfo = host.split(":")
-                host = proxyinfo[0]
+                    proxyinfo = host.split(":")
+                    host = proxyinfo[0]
 
-                port = "80"
-                if len(proxyinfo) > 1:
-                    port = proxyinfo[1]
+                    port = "80"
+                    if len(proxyinfo) > 1:
+                        port = proxyinfo[1]
 
-                if proxy.startswith("socks") and len(proxy.rsplit(':', 1)) == 2:
-                    host = proxy.rsplit(':', 1)[0]
-                    port = proxy.rsplit(':', 1)[1]
+                    if proxy.startswith("socks") and len(proxy.rsplit(':', 1)) == 2:
+                        host = proxy.rsplit(':', 1)[0]
+                        port = proxy.rsplit(':', 1)[1]
 
-                baseurl.setQueryParam ("proxy", host)
-                baseurl.setQueryParam ("proxyport", port)
+                    baseurl.setQueryParam ("proxy", host)
+                    baseurl.setQueryParam ("proxyport", port)
 
-            repo.baseurl[0] = baseurl.asCompleteString()
-            self.repos.append(repo)
+                repo.baseurl[i] = baseurl.asCompleteString()
+                repo_info.addBaseUrl(baseurl)
 
-            repo_info.addBaseUrl(baseurl)
+            self.repos.append(repo)
 
             if repo.priority:
                 repo_info.setPriority(repo.priority)
 
             self.repo_manager.addRepository(repo_info)
 
-            self.__build_repo_cache(name)
+            revision = self.__get_repo_revision(name, [url] + mirrorurls,
+                                                proxies)
+            # checked again when the cache is loaded
+            self.repo_revisions[name] = revision
+            # other builds sharing the cachedir wait while it's rebuilt
+            with locks.repo_lock(self.cachedir, name):
+                self.__prepare_repo_cache(repo_info, revision)
 
         except RuntimeError, e:
             raise CreatorError(str(e))
@@ -397,10 +511,12 @@ class Zypp(BackendPlugin):
 
         # record all pkg and the content
         localpkgs = self.localpkgs.keys()
+        self.headers.load([self.localpkgs[pkg.name()] for pkg in dlpkgs
+                           if pkg.name() in localpkgs])
         for pkg in dlpkgs:
             license = ''
             if pkg.name() in localpkgs:
-                hdr = rpmmisc.readRpmHeader(self.ts, self.localpkgs[pkg.name()])
+                hdr = self.headers.get_info(self.localpkgs[pkg.name()])
                 pkg_long_name = misc.RPM_FMT % {
                                     'name': hdr['name'],
                                     'arch': hdr['arch'],
@@ -431,50 +547,81 @@ class Zypp(BackendPlugin):
         download_total_size = sum(map(lambda x: int(x.downloadSize()), dlpkgs))
         localpkgs = self.localpkgs.keys()
 
-        msger.info("Checking packages cache and packages integrity ...")
-        for po in dlpkgs:
-            # Check if it is cached locally
-            if po.name() in localpkgs:
-                cached_count += 1
-            else:
-                local = self.getLocalPkgPath(po)
-                if os.path.exists(local):
-                    if self.checkPkg(local) != 0:
-                        os.unlink(local)
-                    else:
-                        download_total_size -= int(po.downloadSize())
-                        cached_count += 1
-        cache_avail_size = misc.get_filesystem_avail(self.cachedir)
-        if cache_avail_size < download_total_size:
-            raise CreatorError("No enough space used for downloading.")
-
-        # record the total size of installed pkgs
-        install_total_size = sum(map(lambda x: int(x.installSize()), dlpkgs))
-        # check needed size before actually download and install
-
-        # FIXME: for multiple partitions for loop type, check fails
-        #        skip the check temporarily
-        #if checksize and install_total_size > checksize:
-        #    raise CreatorError("No enough space used for installing, "
-        #                       "please resize partition size in ks file")
-
-        download_count =  total_count - cached_count
-        msger.info("%d packages to be installed, "
-                   "%d packages gotten from cache, "
-                   "%d packages to be downloaded" \
-                   % (total_count, cached_count, download_count))
+        # the packages of the repos in use are kept from the eviction of
+        # the other builds sharing the cachedir
+        pkgs_locks = []
+        for reponame in sorted(set([po.repoInfo().alias() for po in dlpkgs
+                                    if po.name() not in localpkgs])):
+            lock = locks.packages_lock(self.cachedir, reponame, shared = True)
+            lock.acquire()
+            pkgs_locks.append(lock)
 
         try:
-            if download_count > 0:
-                msger.info("Downloading packages ...")
-            self.downloadPkgs(dlpkgs, download_count)
+            msger.info("Checking packages cache and packages integrity ...")
+            cached = []
+            for po in dlpkgs:
+                # Check if it is cached locally
+                if po.name() in localpkgs:
+                    cached_count += 1
+                else:
+                    local = self.getLocalPkgPath(po)
+                    if not os.path.exists(local):
+                        self.__link_from_store(po, local)
+                    if os.path.exists(local):
+                        cached.append((po, local))
+
+            for ((po, local), ret) in zip(cached, self.checkPkgs(cached)):
+                if ret != 0:
+                    # damaged, download it again from scratch, only the '.part'
+                    # files of interrupted downloads are continued
+                    os.unlink(local)
+                else:
+                    download_total_size -= int(po.downloadSize())
+                    cached_count += 1
+            cache_avail_size = misc.get_filesystem_avail(self.cachedir)
+            if cache_avail_size < download_total_size:
+                raise CreatorError("No enough space used for downloading.")
+
+            # record the total size of installed pkgs
+            install_total_size = sum(map(lambda x: int(x.installSize()), dlpkgs))
+            # check needed size before actually download and install
+
+            # FIXME: for multiple partitions for loop type, check fails
+            #        skip the check temporarily
+            #if checksize and install_total_size > checksize:
+            #    raise CreatorError("No enough space used for installing, "
+            #                       "please resize partition size in ks file")
+
+            download_count =  total_count - cached_count
+            msger.info("%d packages to be installed, "
+                       "%d packages gotten from cache, "
+                       "%d packages to be downloaded" \
+                       % (total_count, cached_count, download_count))
+
+            try:
+                if download_count > 0:
+                    msger.info("Downloading packages ...")
+
+                if configmgr.create['install_pipeline']:
+                    # add each package to the transaction once it's present
+                    self.installPkgs(self.__iter_present_pkgs(dlpkgs),
+                                     pipeline = True)
+                else:
+                    self.downloadPkgs(dlpkgs, download_count)
+                    self.installPkgs(dlpkgs)
 
-            self.installPkgs(dlpkgs)
+            except (RepoError, RpmError):
+                raise
+            except Exception, e:
+                raise CreatorError("Package installation failed: %s" % (e,))
+        finally:
+            for lock in pkgs_locks:
+                lock.release()
 
-        except (RepoError, RpmError):
-            raise
-        except Exception, e:
-            raise CreatorError("Package installation failed: %s" % (e,))
+        (evicted, freed) = self.store.evict()
+        if evicted:
+            msger.info("%d packages (%.1f MB) evicted from cache for quota"
+                       % (evicted, freed / 1024.0 / 1024))
 
     def getAllContent(self):
         return self.__pkgs_content
@@ -497,10 +644,15 @@ class Zypp(BackendPlugin):
         if self.repo_manager:
             return
 
-        # Clean up repo metadata
-        shutil.rmtree(self.cachedir + "/etc", ignore_errors = True)
-        shutil.rmtree(self.cachedir + "/solv", ignore_errors = True)
-        shutil.rmtree(self.cachedir + "/raw", ignore_errors = True)
+        # Clean up the repo files left by this pid or the dead builds, the
+        # metadata of the repos is cleaned one by one when they're added
+        etcdir = os.path.join(self.cachedir, "etc")
+        if os.path.isdir(etcdir):
+            for pid in os.listdir(etcdir):
+                if pid.isdigit() and \
+                   (int(pid) == os.getpid() or not locks.pid_alive(int(pid))):
+                    shutil.rmtree(os.path.join(etcdir, pid),
+                                  ignore_errors = True)
 
         zypp.KeyRing.setDefaultAccept( zypp.KeyRing.ACCEPT_UNSIGNED_FILE
                                      | zypp.KeyRing.ACCEPT_VERIFICATION_FAILED
@@ -512,7 +664,7 @@ class Zypp(BackendPlugin):
                 zypp.RepoManagerOptions(zypp.Pathname(self.instroot))
 
         self.repo_manager_options.knownReposPath = \
-                zypp.Pathname(self.cachedir + "/etc/zypp/repos.d")
+                zypp.Pathname(self.reposdir)
 
         self.repo_manager_options.repoCachePath = \
                 zypp.Pathname(self.cachedir)
@@ -528,6 +680,88 @@ class Zypp(BackendPlugin):
 
         self.repo_manager = zypp.RepoManager(self.repo_manager_options)
 
+    def __get_repo_revision(self, name, baseurls, proxies):
+        """ The revision of the repo to validate its solv cache, None if
+            it's unknown
+        """
+
+        repomd = None
+        for repo in configmgr.create['repomd'] or []:
+            if repo['name'] == name and repo['baseurl'] in baseurls:
+                # already got by get_metadata_from_repos
+                repomd = repo['repomd']
+                break
+
+        try:
+            if not repomd:
+                fs_related.makedirs(os.path.join(self.cachedir, name))
+                filename = os.path.join(self.cachedir, name, 'repomd.xml')
+                repomd = mirror.fetch_from_mirrors(baseurls[0],
+                            "repodata/repomd.xml",
+                            lambda url: urlfetch.revalidate(url, filename,
+                                proxies, configmgr.create['metadata_expire'],
+                                configmgr.create['offline']))[0]
+
+            return solvcache.get_revision(repomd, baseurls[0])
+        except (CreatorError, IOError, OSError), err:
+            msger.debug("can't get the revision of repo %s: %s" % (name, err))
+            return None
+
+    def __clean_repo_cache(self, name):
+        """ Drop the metadata of repo 'name', its lock must be held """
+
+        for subdir in ("raw", "solv"):
+            shutil.rmtree(os.path.join(self.cachedir, subdir, name),
+                          ignore_errors = True)
+
+    def __build_from_mirror(self, repo_info):
+        """ Build the cache of the repo from the local mirror of the
+            metadata mic already retrieved, instead of downloading it again
+
+            return: True if it's built
+        """
+
+        name = repo_info.alias()
+        mdmirror = misc.get_metadata_mirror(configmgr.create['repomd'], name)
+        if not mdmirror:
+            return False
+
+        mdinfo = zypp.RepoInfo()
+        mdinfo.setAlias(name)
+        mdinfo.setName(name)
+        mdinfo.setEnabled(True)
+        mdinfo.addBaseUrl(zypp.Url(mdmirror))
+        try:
+            msger.info('Refreshing repository: %s ...' % name)
+            self.repo_manager.refreshMetadata(mdinfo,
+                                              zypp.RepoManager.RefreshForced)
+            self.repo_manager.buildCache(mdinfo, zypp.RepoManager.BuildForced)
+        except RuntimeError, err:
+            # e.g. the repo has more metadata than mic gets, go to the repo
+            msger.verbose("can't use the local mirror of repo %s: %s"
+                          % (name, err))
+            self.__clean_repo_cache(name)
+            return False
+
+        return True
+
+    def __prepare_repo_cache(self, repo_info, revision):
+        """ Get the cache of the repo of revision: reuse it, restore it from
+            the pool or build it, its exclusive lock must be held
+        """
+
+        name = repo_info.alias()
+        if self.solvcache.is_valid(name, revision):
+            msger.verbose("repo %s is unchanged, reuse its cache" % name)
+        elif self.solvcache.restore(name, revision):
+            msger.verbose("repo %s cache is got from pool" % name)
+        else:
+            self.solvcache.invalidate(name)
+            self.__clean_repo_cache(name)
+            if not self.__build_from_mirror(repo_info):
+                self.__build_repo_cache(name)
+            self.solvcache.save(name, revision)
+
     def __build_repo_cache(self, name):
         repo = self.repo_manager.getRepositoryInfo(name)
         if self.repo_manager.isCached(repo) or not repo.enabled():
@@ -554,13 +788,41 @@ class Zypp(BackendPlugin):
         for repo in repos:
             if not repo.enabled():
                 continue
-            self.repo_manager.loadFromCache(repo)
+
+            name = repo.alias()
+            revision = self.repo_revisions.get(name)
+            with locks.repo_lock(self.cachedir, name, shared = True):
+                # another build may have replaced it with another revision
+                # since the repo was added
+                unchanged = not revision or \
+                            self.solvcache.is_valid(name, revision)
+                if unchanged and self.repo_manager.isCached(repo):
+                    self.repo_manager.loadFromCache(repo)
+                    continue
+
+            # it's changed or cleaned by another build meanwhile, get the
+            # one of the revision again
+            with locks.repo_lock(self.cachedir, name):
+                if not revision:
+                    self.solvcache.invalidate(name)
+                    self.__build_repo_cache(name)
+                else:
+                    self.__prepare_repo_cache(repo, revision)
+                self.repo_manager.loadFromCache(repo)
 
         self.Z = zypp.ZYppFactory_instance().getZYpp()
         self.Z.initializeTarget(zypp.Pathname(self.instroot))
         self.Z.target().load()
 
     def buildTransaction(self):
+        cache = transcache.TransactionCache(self.cachedir)
+        if self.trans_key and not self.fresh_solve:
+            resolved = cache.load(self.trans_key)
+            if resolved is not None and self.__replay_transaction(resolved):
+                msger.info("Reuse the resolved transaction of %d packages"
+                           % len(resolved))
+                return
+
         if not self.Z.resolver().resolvePool():
             probs = self.Z.resolver().problems()
 
@@ -572,6 +834,47 @@ class Zypp(BackendPlugin):
             raise RepoError("found %d resolver problem, abort!" \
                             % len(probs))
 
+        if self.trans_key:
+            todo = zypp.GetResolvablesToInsDel(self.Z.pool())
+            cache.save(self.trans_key,
+                       [self.__get_item_key(item) for item in todo._toInstall])
+
+    def __get_item_key(self, item):
+        return (str(item.kind()), item.name(), str(item.edition()),
+                str(item.arch()), item.repoInfo().alias())
+
+    def __replay_transaction(self, resolved):
+        """ Mark exactly the resolved items to be installed, without solving
+
+            return: False if any of them isn't in the pool any more
+        """
+
+        wanted = set(resolved)
+        marks = []
+        q = zypp.PoolQuery()
+        for item in q.queryResults(self.Z.pool()):
+            if item.status().isInstalled():
+                continue
+            key = self.__get_item_key(item)
+            if key in wanted:
+                wanted.discard(key)
+                marks.append((item, True))
+            elif item.status().isToBeInstalled():
+                marks.append((item, False))
+
+        if wanted:
+            msger.verbose("resolved transaction is outdated, %d packages "
+                          "missing" % len(wanted))
+            return False
+
+        for (item, install) in marks:
+            if install:
+                item.status().setToBeInstalled(zypp.ResStatus.USER)
+            else:
+                item.status().resetTransact(zypp.ResStatus.USER)
+
+        return True
+
     def getLocalPkgPath(self, po):
         repoinfo = po.repoInfo()
         cacheroot = repoinfo.packagesPath()
@@ -602,7 +905,7 @@ class Zypp(BackendPlugin):
         else:
             msger.warning('Can not get %s solv data.' % pkg)
 
-        hdr = rpmmisc.readRpmHeader(self.ts, pkg)
+        hdr = self.headers.get_info(pkg)
         arch = zypp.Arch(hdr['arch'])
         sysarch = zypp.Arch(self.target_arch)
 
@@ -617,34 +920,158 @@ class Zypp(BackendPlugin):
                           "Not a compatible architecture: %s" \
                           % (pkg, hdr['arch']))
 
-    def downloadPkgs(self, package_objects, count):
+    def installLocalPkgs(self, pkgs):
+        """ Add the local rpms in batch: one solv for all of them by one
+            rpms2solv run, cached by their (path, size, mtime), and their
+            headers read in parallel
+        """
+
+        if not pkgs:
+            return
+
+        if not self.ts:
+            self.__initialize_transaction()
+
+        solvfile = self.__get_local_solv(pkgs)
+        if not solvfile:
+            for pkg in pkgs:
+                self.installLocal(pkg)
+            return
+
+        warnmsg = self.repo_manager.loadSolvFile(solvfile, "local-pkgs")
+        if warnmsg:
+            msger.warning(warnmsg)
+
+        self.headers.load(pkgs)
+        sysarch = zypp.Arch(self.target_arch)
+        names = []
+        for pkg in pkgs:
+            hdr = self.headers.get_info(pkg)
+            if not zypp.Arch(hdr['arch']).compatible_with(sysarch):
+                msger.warning("Cannot add package %s to transaction. "
+                              "Not a compatible architecture: %s" \
+                              % (pkg, hdr['arch']))
+                continue
+
+            self.localpkgs[hdr['name']] = pkg
+            names.append(hdr['name'])
+            msger.info("Marking %s to be installed" % (pkg))
+
+        for (name, err) in zip(names, self.selectPackages(names)):
+            if err:
+                raise CreatorError(err)
+
+    def __get_local_solv(self, pkgs):
+        """ The solv file of the local rpms, None if it can't be made """
+
+        hashobj = hashlib.sha256()
+        for pkg in sorted(pkgs):
+            st = os.stat(pkg)
+            hashobj.update("%s %d %d\n" % (os.path.abspath(pkg), st.st_size,
+                                           int(st.st_mtime)))
+
+        solvdir = os.path.join(self.cachedir, "localsolv")
+        solvfile = os.path.join(solvdir, hashobj.hexdigest() + ".solv")
+        if os.path.exists(solvfile):
+            msger.verbose("reuse the solv of %d local packages" % len(pkgs))
+            return solvfile
+
+        rc, out = runner.runtool([fs_related.find_binary_path("rpms2solv")]
+                                 + list(pkgs))
+        if rc != 0:
+            msger.warning('Can not get solv data of the local packages')
+            return None
+
+        fs_related.makedirs(solvdir)
+        tmpfile = "%s.%d" % (solvfile, os.getpid())
+        f = open(tmpfile, "w")
+        f.write(out)
+        f.close()
+        os.rename(tmpfile, solvfile)
+
+        # keep the latest ones only, for the builds switching among them
+        olds = sorted(glob.glob(os.path.join(solvdir, "*.solv")),
+                      key = os.path.getmtime, reverse = True)
+        for old in olds[LOCAL_SOLV_KEEP:]:
+            os.unlink(old)
+
+        return solvfile
+
+    def __iter_present_pkgs(self, package_objects):
+        """ Yield the package objects once their rpms are present: the local
+            and cached ones at first, then the others right after each of
+            them is downloaded
+        """
+
         localpkgs = self.localpkgs.keys()
-        progress_obj = rpmmisc.TextProgress(count)
 
+        present = []
+        jobs = []
+        pending = []
+        totalsize = 0
         for po in package_objects:
             if po.name() in localpkgs:
+                present.append(po)
                 continue
 
             filename = self.getLocalPkgPath(po)
+            if not os.path.exists(filename):
+                self.__link_from_store(po, filename)
             if os.path.exists(filename):
-                if self.checkPkg(filename) == 0:
+                if self.checkPkg(filename, po) == 0:
+                    present.append(po)
                     continue
+                # damaged, download it again from scratch, only the '.part'
+                # files of interrupted downloads are continued
+                os.unlink(filename)
+
+            (baseurl, location) = self.__get_url_parts(po)
+            (sumtype, checksum) = self.__get_checksum(po)
+            jobs.append((baseurl, location, filename, self.get_proxies(po),
+                         sumtype, checksum))
+            pending.append(po)
+            totalsize += int(po.downloadSize())
+
+        # the headers of the present ones are read in parallel at once
+        self.headers.load([self.__get_rpm_path(po) for po in present])
+        for po in present:
+            yield po
+
+        if not jobs:
+            return
 
-            dirn = os.path.dirname(filename)
-            if not os.path.exists(dirn):
-                os.makedirs(dirn)
+        downloader = download.Downloader(
+                        threads = configmgr.create['download_threads'],
+                        rate = configmgr.create['download_rate'] * 1024)
 
-            url = self.get_url(po)
-            proxies = self.get_proxies(po)
+        failed = []
+        for (i, filename, err) in downloader.iter_download(jobs, totalsize):
+            if err:
+                msger.warning("failed to download %s: %s" % (jobs[i][1], err))
+                failed.append(os.path.basename(jobs[i][1]))
+                continue
 
-            try:
-                filename = rpmmisc.myurlgrab(url,
-                                             filename,
-                                             proxies,
-                                             progress_obj)
-            except CreatorError:
-                self.close()
-                raise
+            (sumtype, checksum) = jobs[i][4:]
+            if checksum:
+                # verified by the downloader already
+                self.store.add(filename, sumtype, checksum)
+                self.verified.add(filename, sumtype, checksum)
+            if not failed:
+                yield pending[i]
+
+        self.verified.save()
+
+        msger.verbose("connections: %(created)d created, %(reused)d reused"
+                      % connpool.get_stats())
+
+        if failed:
+            self.close()
+            raise CreatorError("Failed to download package(s): %s"
+                               % ', '.join(failed))
+
+    def downloadPkgs(self, package_objects, count):
+        for po in self.__iter_present_pkgs(package_objects):
+            pass
 
     def preinstallPkgs(self):
         if not self.ts_pre:
@@ -674,7 +1101,15 @@ class Zypp(BackendPlugin):
                     msger.warning(e[0])
                 raise RepoError('Could not run transaction.')
 
-    def installPkgs(self, package_objects):
+    def installPkgs(self, package_objects, pipeline = False):
+        """ Add the packages to the transaction and run it
+
+            pipeline: package_objects is an iterator yielding the packages
+                      as they land, each one is added to the transaction
+                      at once, which still runs after all are added and
+                      checked
+        """
+
         if not self.ts:
             self.__initialize_transaction()
 
@@ -685,36 +1120,12 @@ class Zypp(BackendPlugin):
         self.ts.setProbFilter(probfilter)
         self.ts_pre.setProbFilter(probfilter)
 
-        localpkgs = self.localpkgs.keys()
+        if not pipeline:
+            self.headers.load([self.__get_rpm_path(po)
+                               for po in package_objects])
 
         for po in package_objects:
-            pkgname = po.name()
-            if pkgname in localpkgs:
-                rpmpath = self.localpkgs[pkgname]
-            else:
-                rpmpath = self.getLocalPkgPath(po)
-
-            if not os.path.exists(rpmpath):
-                # Maybe it is a local repo
-                baseurl = str(po.repoInfo().baseUrls()[0])
-                baseurl = baseurl.strip()
-
-                location = zypp.asKindPackage(po).location()
-                location = str(location.filename())
-
-                if baseurl.startswith("file:/"):
-                    rpmpath = baseurl[5:] + "/%s" % (location)
-
-            if not os.path.exists(rpmpath):
-                raise RpmError("Error: %s doesn't exist" % rpmpath)
-
-            h = rpmmisc.readRpmHeader(self.ts, rpmpath)
-
-            if pkgname in self.pre_pkgs:
-                msger.verbose("pre-install package added: %s" % pkgname)
-                self.ts_pre.addInstall(h, rpmpath, 'u')
-
-            self.ts.addInstall(h, rpmpath, 'u')
+            self.__add_install(po)
 
         unresolved_dependencies = self.ts.check()
         if not unresolved_dependencies:
@@ -766,6 +1177,42 @@ class Zypp(BackendPlugin):
 
             raise RepoError("Unresolved dependencies, transaction failed.")
 
+    def __add_install(self, po):
+        pkgname = po.name()
+        rpmpath = self.__get_rpm_path(po)
+        if not os.path.exists(rpmpath):
+            raise RpmError("Error: %s doesn't exist" % rpmpath)
+
+        h = self.headers.get_header(rpmpath)
+
+        # with the header in the key, the install callback needn't read it
+        # from the rpm again
+        if pkgname in self.pre_pkgs:
+            msger.verbose("pre-install package added: %s" % pkgname)
+            self.ts_pre.addInstall(h, (h, rpmpath), 'u')
+
+        self.ts.addInstall(h, (h, rpmpath), 'u')
+
+    def __get_rpm_path(self, po):
+        pkgname = po.name()
+        if pkgname in self.localpkgs:
+            rpmpath = self.localpkgs[pkgname]
+        else:
+            rpmpath = self.getLocalPkgPath(po)
+
+        if not os.path.exists(rpmpath):
+            # Maybe it is a local repo
+            baseurl = str(po.repoInfo().baseUrls()[0])
+            baseurl = baseurl.strip()
+
+            location = zypp.asKindPackage(po).location()
+            location = str(location.filename())
+
+            if baseurl.startswith("file:/"):
+                rpmpath = baseurl[5:] + "/%s" % (location)
+
+        return rpmpath
+
     def __initialize_transaction(self):
         if not self.ts:
             self.ts = rpm.TransactionSet(self.instroot)
@@ -779,17 +1226,58 @@ class Zypp(BackendPlugin):
             # Set to not verify DSA signatures.
             self.ts_pre.setVSFlags(rpm._RPMVSF_NOSIGNATURES|rpm._RPMVSF_NODIGESTS)
 
-    def checkPkg(self, pkg):
+    def checkPkg(self, pkg, po = None):
         ret = 1
         if not os.path.exists(pkg):
             return ret
-        ret = rpmmisc.checkRpmIntegrity('rpm', pkg)
+
+        (sumtype, checksum) = (None, None)
+        if po:
+            (sumtype, checksum) = self.__get_checksum(po)
+
+        if checksum:
+            if pkgcheck.verify(pkg, sumtype, checksum, self.verified):
+                ret = 0
+        else:
+            ret = rpmmisc.checkRpmIntegrity('rpm', pkg)
+
         if ret != 0:
             msger.warning("package %s is damaged: %s" \
                           % (os.path.basename(pkg), pkg))
 
         return ret
 
+    def checkPkgs(self, items):
+        """ Check the cached packages of items [(po, path)] in one batch,
+            the ones with checksum in repo metadata are hashed in parallel
+
+            return: a list of return codes as checkPkg
+        """
+
+        rets = [None] * len(items)
+        checks = []
+        for (i, (po, path)) in enumerate(items):
+            (sumtype, checksum) = self.__get_checksum(po)
+            if checksum:
+                checks.append((i, (path, sumtype, checksum)))
+            else:
+                rets[i] = self.checkPkg(path)
+
+        oks = pkgcheck.verify_files([item for (i, item) in checks],
+                                    self.verified)
+        for ((i, (path, sumtype, checksum)), ok) in zip(checks, oks):
+            rets[i] = int(not ok)
+            if not ok:
+                msger.warning("package %s is damaged: %s" \
+                              % (os.path.basename(path), path))
+            else:
+                # the file may turn into a link to the stored one
+                self.store.add(path, sumtype, checksum)
+                self.verified.add(path, sumtype, checksum)
+
+        self.verified.save()
+        return rets
+
     def _add_prob_flags(self, *flags):
         for flag in flags:
            if flag not in self.probFilterFlags:
@@ -815,15 +1303,15 @@ class Zypp(BackendPlugin):
 
         return proxies
 
-    def get_url(self, pobj):
+    def __get_url_parts(self, pobj):
         if not pobj:
-            return None
+            return (None, None)
 
         name = str(pobj.repoInfo().name())
         try:
             repo = filter(lambda r: r.name == name, self.repos)[0]
         except IndexError:
-            return None
+            return (None, None)
 
         baseurl = repo.baseurl[0]
 
@@ -836,6 +1324,26 @@ class Zypp(BackendPlugin):
         if location.startswith("./"):
             location = location[2:]
 
+        return (baseurl, location)
+
+    def __link_from_store(self, pobj, filename):
+        (sumtype, checksum) = self.__get_checksum(pobj)
+        if self.store.link(sumtype, checksum, filename):
+            # the stored packages are verified ones
+            self.verified.add(filename, sumtype, checksum)
+
+    def __get_checksum(self, pobj):
+        checksum = zypp.asKindPackage(pobj).checksum()
+        if checksum.empty():
+            return (None, None)
+
+        return (str(checksum.type()), str(checksum.checksum()))
+
+    def get_url(self, pobj):
+        (baseurl, location) = self.__get_url_parts(pobj)
+        if not baseurl:
+            return None
+
         return os.path.join(baseurl, location)
 
     def package_url(self, pkgname):
@@ -20,7 +20,7 @@ import sys
 
 from mic import chroot, msger, rt_util
 from mic.utils import cmdln, misc, errors, fs_related
-from mic.imager import fs
+from mic.imager import fs, multi
 from mic.conf import configmgr
 from mic.plugin import pluginmgr
 
@@ -98,6 +98,14 @@ class FsPlugin(ImagerPlugin):
                                 [creator.name],
                                 creatoropts['release'])
 
+        if creatoropts['formats']:
+            creator = multi.MultiImageCreator(creator,
+                                              creatoropts['formats'],
+                                              creatoropts, pkgmgr,
+                                              creatoropts['package_threads'])
+            self.check_image_exists(creator.destdir, None,
+                                    creator.get_output_dirs())
+
         try:
             creator.check_depend_tools()
             creator.mount(None, creatoropts["cachedir"])
@@ -117,6 +125,7 @@ class FsPlugin(ImagerPlugin):
             if creatoropts['release'] is not None:
                 creator.release_output(ksconf, creatoropts['outdir'], creatoropts['release'])
             creator.print_outimage_info()
+            creator.drop_checkpoint()
         except errors.CreatorError:
             raise
         finally:
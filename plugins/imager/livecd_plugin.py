@@ -108,6 +108,7 @@ class LiveCDPlugin(ImagerPlugin):
             if creatoropts['release'] is not None:
                 creator.release_output(ksconf, creatoropts['outdir'], creatoropts['release'])
             creator.print_outimage_info()
+            creator.drop_checkpoint()
 
         except errors.CreatorError:
             raise
@@ -109,6 +109,7 @@ class LiveUSBPlugin(ImagerPlugin):
             if creatoropts['release'] is not None:
                 creator.release_output(ksconf, creatoropts['outdir'], creatoropts['release'])
             creator.print_outimage_info()
+            creator.drop_checkpoint()
 
         except errors.CreatorError:
             raise
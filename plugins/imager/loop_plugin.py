@@ -24,6 +24,7 @@ from mic.utils import misc, fs_related, errors, cmdln
 from mic.conf import configmgr
 from mic.plugin import pluginmgr
 from mic.imager.loop import LoopImageCreator, load_mountpoints
+from mic.imager import multi
 
 from mic.pluginbase import ImagerPlugin
 class LoopPlugin(ImagerPlugin):
@@ -110,6 +111,14 @@ class LoopPlugin(ImagerPlugin):
                                 [creator.name + ".img"],
                                 creatoropts['release'])
 
+        if creatoropts['formats']:
+            creator = multi.MultiImageCreator(creator,
+                                              creatoropts['formats'],
+                                              creatoropts, pkgmgr,
+                                              creatoropts['package_threads'])
+            self.check_image_exists(creator.destdir, None,
+                                    creator.get_output_dirs())
+
         try:
             creator.check_depend_tools()
             creator.mount(None, creatoropts["cachedir"])
@@ -124,6 +133,7 @@ class LoopPlugin(ImagerPlugin):
                                        creatoropts['outdir'],
                                        creatoropts['release'])
             creator.print_outimage_info()
+            creator.drop_checkpoint()
 
         except errors.CreatorError:
             raise
@@ -27,6 +27,7 @@ from mic.plugin import pluginmgr
 from mic.utils.partitionedfs import PartitionedMount
 
 import mic.imager.raw as raw
+from mic.imager import multi
 
 from mic.pluginbase import ImagerPlugin
 class RawPlugin(ImagerPlugin):
@@ -104,6 +105,14 @@ class RawPlugin(ImagerPlugin):
                                 images,
                                 creatoropts['release'])
 
+        if creatoropts['formats']:
+            creator = multi.MultiImageCreator(creator,
+                                              creatoropts['formats'],
+                                              creatoropts, pkgmgr,
+                                              creatoropts['package_threads'])
+            self.check_image_exists(creator.destdir, None,
+                                    creator.get_output_dirs())
+
         try:
             creator.check_depend_tools()
             creator.mount(None, creatoropts["cachedir"])
@@ -115,6 +124,7 @@ class RawPlugin(ImagerPlugin):
             if creatoropts['release'] is not None:
                 creator.release_output(ksconf, creatoropts['outdir'], creatoropts['release'])
             creator.print_outimage_info()
+            creator.drop_checkpoint()
 
         except errors.CreatorError:
             raise
@@ -7,6 +7,22 @@ import test_baseimager
 import test_msger
 import test_runner
 import test_chroot
+import test_threadpool
+import test_repoindex
+import test_urlfetch
+import test_mirror
+import test_download
+import test_connpool
+import test_pkgcheck
+import test_pkgstore
+import test_locks
+import test_solvcache
+import test_transcache
+import test_pkgmatch
+import test_hdrcache
+import test_snapshot
+import test_multi
+import test_batch
 
 if os.getuid() != 0:
     raise SystemExit("Root permission is needed")
@@ -18,5 +34,21 @@ suite.addTests(test_baseimager.suite())
 suite.addTests(test_msger.suite())
 suite.addTests(test_runner.suite())
 suite.addTests(test_chroot.suite())
+suite.addTests(test_threadpool.suite())
+suite.addTests(test_repoindex.suite())
+suite.addTests(test_urlfetch.suite())
+suite.addTests(test_mirror.suite())
+suite.addTests(test_download.suite())
+suite.addTests(test_connpool.suite())
+suite.addTests(test_pkgcheck.suite())
+suite.addTests(test_pkgstore.suite())
+suite.addTests(test_locks.suite())
+suite.addTests(test_solvcache.suite())
+suite.addTests(test_transcache.suite())
+suite.addTests(test_pkgmatch.suite())
+suite.addTests(test_hdrcache.suite())
+suite.addTests(test_snapshot.suite())
+suite.addTests(test_multi.suite())
+suite.addTests(test_batch.suite())
 result = unittest.TextTestRunner(verbosity=2).run(suite)
 sys.exit(not result.wasSuccessful())
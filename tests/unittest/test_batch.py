@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic import batch
+
+def suite():
+    return unittest.makeSuite(BatchTest)
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.interval = batch.POLL_INTERVAL
+        batch.POLL_INTERVAL = 0.1
+
+    def tearDown(self):
+        batch.POLL_INTERVAL = self.interval
+        shutil.rmtree(self.workdir, ignore_errors = True)
+
+    def _run(self, build):
+        print "building", build.name
+        if build.name == 'bad':
+            raise SystemExit(3)
+
+    def testRun(self):
+        builds = [batch.BatchBuild('/ks/%s.ks' % name, [], 'fs', 0, 1)
+                  for name in ('good', 'bad', 'other', 'broken')]
+        # failed before scheduled
+        builds[3].status = 2
+        scheduler = batch.BatchScheduler(self._run, jobs = 2, max_loops = 1,
+                                         max_load = 1000,
+                                         tmpdir = self.workdir,
+                                         logdir = self.workdir)
+        scheduler.run(builds)
+
+        self.assertEqual([0, 3, 0, 2], [build.status for build in builds])
+        self.assertEqual(['ok', 'failed (3)', 'ok', 'failed (2)'],
+                         [build.result for build in builds])
+        self.assertFalse(os.path.exists(os.path.join(self.workdir,
+                                                     'broken.log')))
+        with open(os.path.join(self.workdir, 'other.log')) as rf:
+            self.assertEqual('building other\n', rf.read())
+
+        summary = os.path.join(self.workdir, 'summary.txt')
+        batch.write_summary(builds, summary)
+        with open(summary) as rf:
+            lines = rf.read().splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertEqual(['bad', 'fs', 'failed'], lines[2].split()[:3])
+
+if __name__ == "__main__":
+    unittest.main()
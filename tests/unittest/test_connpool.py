@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import connpool, urlfetch
+from test_mirror import _Handler, _start_server
+
+def suite():
+    return unittest.makeSuite(ConnPoolTest)
+
+class ConnPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix = 'connpool-')
+        for i in range(3):
+            with open(os.path.join(self.root, 'f%d' % i), 'w') as wf:
+                wf.write('data %d\n' % i * 100)
+        # keep the connection open between requests
+        self.protocol = _Handler.protocol_version
+        _Handler.protocol_version = 'HTTP/1.1'
+        self.server = _start_server(self.root, 0)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        connpool.close_all()
+        _Handler.protocol_version = self.protocol
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def testReuse(self):
+        before = connpool.get_stats()
+        for i in range(3):
+            fobj = urlfetch.urlopen('%s/f%d' % (self.url, i))
+            self.assertEqual('data %d\n' % i * 100, fobj.read())
+            fobj.close()
+        after = connpool.get_stats()
+        self.assertEqual(1, after['created'] - before['created'])
+        self.assertEqual(2, after['reused'] - before['reused'])
+
+    def testGrabResume(self):
+        target = os.path.join(self.root, 'copy')
+        with open(target, 'w') as wf:
+            wf.write('data 0\n' * 10)
+        # the test server ignores Range, the whole file is fetched again
+        urlfetch.grab('%s/f0' % self.url, target, reget = 'simple')
+        self.assertEqual('data 0\n' * 100, open(target).read())
+
+if __name__ == "__main__":
+    unittest.main()
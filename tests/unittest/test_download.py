@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import tempfile
+import hashlib
+import unittest
+from mic.utils import download
+from mic.utils.errors import CreatorError
+from test_mirror import _Handler, _start_server, _dead_url
+
+def suite():
+    return unittest.makeSuite(DownloadTest)
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix = 'download-src-')
+        self.dstdir = tempfile.mkdtemp(prefix = 'download-dst-')
+        self.names = []
+        for i in range(6):
+            name = 'pkg%d.rpm' % i
+            with open(os.path.join(self.root, name), 'w') as wf:
+                wf.write(name * 1000)
+            self.names.append(name)
+        self.server = _start_server(self.root, 0)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root, ignore_errors = True)
+        shutil.rmtree(self.dstdir, ignore_errors = True)
+
+    def _jobs(self, baseurl):
+        return [(baseurl, name, os.path.join(self.dstdir, 'sub', name), None)
+                for name in self.names]
+
+    def testDownload(self):
+        downloader = download.Downloader(threads = 4, per_host = 2)
+        results = downloader.download(self._jobs(self.url))
+        for (name, (path, err)) in zip(self.names, results):
+            self.assertEqual(None, err)
+            self.assertEqual(name * 1000, open(path).read())
+            self.assertFalse(os.path.exists(path + '.part'))
+
+    def testIterDownload(self):
+        downloader = download.Downloader(threads = 3)
+        seen = []
+        for (index, path, err) in downloader.iter_download(self._jobs(self.url)):
+            self.assertEqual(None, err)
+            # the file is complete once it's yielded
+            self.assertEqual(self.names[index] * 1000, open(path).read())
+            seen.append(index)
+        self.assertEqual(range(len(self.names)), sorted(seen))
+
+    def testResume(self):
+        data = open(os.path.join(self.root, self.names[0])).read()
+        target = os.path.join(self.dstdir, self.names[0])
+        with open(target + '.part', 'w') as wf:
+            wf.write(data[:1000])
+
+        ranges = []
+        orig_do_GET = _Handler.do_GET
+        def do_GET(handler):
+            # serve the rest of the file from the requested offset
+            ranges.append(handler.headers.get('Range'))
+            offset = int(ranges[-1][len('bytes='):-1])
+            handler.send_response(206)
+            handler.send_header('Content-Length', str(len(data) - offset))
+            handler.end_headers()
+            handler.wfile.write(data[offset:])
+        _Handler.do_GET = do_GET
+        try:
+            downloader = download.Downloader()
+            path = downloader.fetch(self.url, self.names[0], target, None,
+                                    'sha256', hashlib.sha256(data).hexdigest())
+        finally:
+            _Handler.do_GET = orig_do_GET
+
+        self.assertEqual(['bytes=1000-'], ranges)
+        self.assertEqual(data, open(path).read())
+
+    def testChecksumMismatch(self):
+        target = os.path.join(self.dstdir, self.names[0])
+        downloader = download.Downloader(retries = 0)
+        self.assertRaises(CreatorError, downloader.fetch, self.url,
+                          self.names[0], target, None, 'sha256', 'bad')
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(target + '.part'))
+
+    def testRetry(self):
+        downloader = download.Downloader(retries = 1, backoff = 0.1)
+        results = downloader.download(self._jobs(_dead_url())[:1])
+        self.assertTrue(isinstance(results[0][1], CreatorError))
+
+    def testBandwidth(self):
+        # 6 files of 8K at 24KB/s, one second burst allowed
+        downloader = download.Downloader(rate = 24 * 1024)
+        start = time.time()
+        downloader.download(self._jobs(self.url))
+        self.assertTrue(time.time() - start >= 0.8)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import hdrcache
+
+def suite():
+    return unittest.makeSuite(HdrCacheTest)
+
+def _fake_read_header(path):
+    with open(path) as rf:
+        name = rf.read()
+    fields = {'name': name, 'arch': 'noarch', 'version': '1',
+              'release': '1', 'epoch': None, 'license': 'GPL'}
+    return (path, hdrcache._stat_key(path), fields, 'HDR:' + name)
+
+class HdrCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix = 'hdrcache-')
+        self.cachedir = os.path.join(self.tmpdir, 'headers')
+        self._orig = (hdrcache._read_header, hdrcache._load_blob)
+        hdrcache._read_header = _fake_read_header
+        hdrcache._load_blob = lambda blob: blob
+
+    def tearDown(self):
+        (hdrcache._read_header, hdrcache._load_blob) = self._orig
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def _rpm(self, name):
+        path = os.path.join(self.tmpdir, name + '.rpm')
+        with open(path, 'w') as wf:
+            wf.write(name)
+        return path
+
+    def testParallel(self):
+        paths = [self._rpm('pkg%d' % i) for i in range(20)]
+        cache = hdrcache.HeaderCache(self.cachedir, workers = 4)
+        cache.load(paths)
+        for (i, path) in enumerate(paths):
+            self.assertEqual('pkg%d' % i, cache.get_info(path)['name'])
+            self.assertEqual('HDR:pkg%d' % i, cache.get_header(path))
+
+    def testPersistent(self):
+        path = self._rpm('bash')
+        hdrcache.HeaderCache(self.cachedir, workers = 1).load([path])
+
+        # the next build gets it from the cache, not the rpm
+        hdrcache._read_header = None
+        cache = hdrcache.HeaderCache(self.cachedir, workers = 1)
+        self.assertEqual('bash', cache.get_info(path)['name'])
+        self.assertEqual('HDR:bash', cache.get_header(path))
+
+    def testChanged(self):
+        path = self._rpm('bash')
+        cache = hdrcache.HeaderCache(self.cachedir, workers = 1)
+        self.assertEqual('bash', cache.get_info(path)['name'])
+
+        with open(path, 'w') as wf:
+            wf.write('bash-new')
+        self.assertEqual('bash-new', cache.get_info(path)['name'])
+        self.assertEqual('bash-new', hdrcache.HeaderCache(self.cachedir,
+                                            workers = 1).get_info(path)['name'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import locks
+
+def suite():
+    return unittest.makeSuite(LocksTest)
+
+def _try_in_child(lock):
+    """ Try the lock non-blocking in a forked process, return its result """
+
+    pid = os.fork()
+    if pid == 0:
+        ok = lock.acquire(blocking = False)
+        if ok:
+            os._exit(0)
+        os._exit(1)
+    (pid, status) = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status) == 0
+
+class LocksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix = 'locks-')
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors = True)
+
+    def testExclusive(self):
+        lock = locks.artifact_lock(os.path.join(self.cachedir, 'a.rpm'))
+        with lock:
+            self.assertFalse(_try_in_child(
+                    locks.artifact_lock(os.path.join(self.cachedir, 'a.rpm'))))
+            self.assertTrue(_try_in_child(
+                    locks.artifact_lock(os.path.join(self.cachedir, 'b.rpm'))))
+        self.assertTrue(_try_in_child(
+                locks.artifact_lock(os.path.join(self.cachedir, 'a.rpm'))))
+
+    def testArtifactLockRemoved(self):
+        with locks.artifact_lock(os.path.join(self.cachedir, 'a.rpm')):
+            self.assertEqual(os.listdir(self.cachedir), ['.a.rpm.lock'])
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+    def testReaderWriter(self):
+        reader = locks.repo_lock(self.cachedir, 'repo', shared = True)
+        with reader:
+            self.assertTrue(_try_in_child(
+                    locks.repo_lock(self.cachedir, 'repo', shared = True)))
+            self.assertFalse(_try_in_child(
+                    locks.repo_lock(self.cachedir, 'repo')))
+
+        writer = locks.repo_lock(self.cachedir, 'repo')
+        with writer:
+            self.assertFalse(_try_in_child(
+                    locks.repo_lock(self.cachedir, 'repo', shared = True)))
+
+    def testPidAlive(self):
+        self.assertTrue(locks.pid_alive(os.getpid()))
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertFalse(locks.pid_alive(pid))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SimpleHTTPServer
+from mic.utils import mirror
+from mic.utils.errors import CreatorError
+
+def suite():
+    return unittest.makeSuite(MirrorTest)
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        return os.path.join(self.server.root, path.lstrip('/'))
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, *args):
+        pass
+
+def _start_server(root, delay):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+    server.root = root
+    server.delay = delay
+    t = threading.Thread(target = server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server
+
+def _dead_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:%d' % port
+
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix = 'mirror-')
+        os.makedirs(os.path.join(self.root, 'repodata'))
+        with open(os.path.join(self.root, 'repodata', 'repomd.xml'), 'w') as wf:
+            wf.write('<repomd/>\n')
+        self.servers = [_start_server(self.root, 0.5),
+                        _start_server(self.root, 0)]
+        self.urls = ['http://127.0.0.1:%d' % s.server_address[1]
+                     for s in self.servers]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def testParseMirrorlist(self):
+        self.assertEqual(['http://a/repo', 'http://b/repo'],
+                         mirror.parse_mirrorlist('# comment\nhttp://a/repo/\n'
+                                                 '\nhttp://b/repo\n'))
+
+    def testRank(self):
+        dead = _dead_url()
+        ranked = mirror.rank_mirrors([dead] + self.urls)
+        self.assertEqual([self.urls[1], self.urls[0]], ranked)
+
+    def testFailover(self):
+        dead = _dead_url()
+        mirrors = mirror.MirrorSet([dead] + self.urls)
+        (latency, throughput) = mirrors.fetch('', mirror.probe)
+        self.assertTrue(throughput > 0)
+        self.assertEqual(1, mirrors.failures[dead])
+        self.assertEqual(dead, mirrors.get_mirrors()[-1])
+
+        mirrors = mirror.MirrorSet([dead])
+        self.assertRaises(CreatorError, mirrors.fetch, '', mirror.probe)
+
+    def testSpread(self):
+        mirrors = mirror.MirrorSet(self.urls)
+        firsts = set([mirrors.pick()[0] for i in range(4)])
+        self.assertEqual(set(self.urls), firsts)
+
+if __name__ == "__main__":
+    unittest.main()
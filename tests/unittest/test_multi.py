@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.imager import multi
+from mic.imager.baseimager import BaseImageCreator
+from mic.utils.errors import CreatorError
+
+def suite():
+    return unittest.makeSuite(MultiImageTest)
+
+class _StubCreator(object):
+    """ Records the calls of MultiImageCreator, installs by the real
+        install_from
+    """
+
+    fmt = None
+    workdir = None
+    calls = []
+
+    def __init__(self, creatoropts = None, pkgmgr = None):
+        self.destdir = self.workdir
+        self.cachedir = os.path.join(self.workdir, 'cache')
+        self._instroot = os.path.join(self.workdir, 'root-%s' % self.fmt)
+        self._recording_pkgs = []
+        self._extra_pkgs = []
+        self._pkgs_content = {}
+        self._pkgs_license = {}
+        self._attachment = []
+        self.qemu_emulator = None
+        self.outimage = []
+
+    def _get_required_packages(self):
+        return ['%s-tools' % self.fmt]
+
+    def check_depend_tools(self):
+        self.calls.append(('check_depend_tools', self.fmt))
+
+    def mount(self, base_on = None, cachedir = None):
+        os.makedirs(self._instroot)
+        self.calls.append(('mount', self.fmt))
+
+    def configure(self, repodata = None):
+        # the install of the primary one
+        os.makedirs(os.path.join(self._instroot, 'etc'))
+        with open(os.path.join(self._instroot, 'etc', 'issue'), 'w') as wf:
+            wf.write('stub\n')
+        self._pkgs_content = {'stub.noarch 1-1': {}}
+        self._attachment = [os.path.join(self._instroot, 'etc', 'issue')]
+        self.calls.append(('configure', self.fmt))
+
+    install_from = BaseImageCreator.install_from.im_func
+
+    def _configure_format(self):
+        self.calls.append(('format', self.fmt))
+
+    def postinstall(self):
+        self.calls.append(('postinstall', self.fmt))
+
+    def _create_bootconfig(self):
+        self.calls.append(('bootconfig', self.fmt))
+
+    def package(self, destdir = "."):
+        self.outimage.append(os.path.join(destdir, '%s.img' % self.fmt))
+        self.calls.append(('package', self.fmt, destdir))
+
+    def unmount(self):
+        self.calls.append(('unmount', self.fmt))
+
+    def cleanup(self):
+        self.calls.append(('cleanup', self.fmt))
+
+class _StubLoop(_StubCreator):
+    fmt = 'loop'
+
+class _StubRaw(_StubCreator):
+    fmt = 'raw'
+
+class _StubFs(_StubCreator):
+    fmt = 'fs'
+
+class MultiImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix = 'multi-')
+        _StubCreator.workdir = self.workdir
+        _StubCreator.calls = []
+        self.formats = multi.FORMATS
+        multi.FORMATS = {'loop': _StubLoop, 'raw': _StubRaw, 'fs': _StubFs}
+
+    def tearDown(self):
+        multi.FORMATS = self.formats
+        shutil.rmtree(self.workdir, ignore_errors = True)
+
+    def testParseFormats(self):
+        self.assertEqual(['loop', 'raw', 'fs'],
+                         multi.parse_formats('loop, raw,fs,loop,'))
+        self.assertEqual([], multi.parse_formats(''))
+        self.assertRaises(CreatorError, multi.parse_formats, 'loop,iso')
+
+    def testBuild(self):
+        primary = _StubLoop()
+        creator = multi.MultiImageCreator(primary, ['loop', 'fs'], {}, None)
+        self.assertEqual(['fs'], creator.get_output_dirs())
+        self.assertEqual(['fs-tools'], primary._extra_pkgs)
+
+        creator.configure()
+        (fs, ) = [c for c in creator.get_creators() if c.fmt == 'fs']
+        # the install root of the primary one is copied
+        with open(os.path.join(fs._instroot, 'etc', 'issue')) as rf:
+            self.assertEqual('stub\n', rf.read())
+        self.assertEqual(primary._pkgs_content, fs._pkgs_content)
+        self.assertEqual([os.path.join(fs._instroot, 'etc', 'issue')],
+                         fs._attachment)
+
+        creator.package(self.workdir)
+        self.assertEqual(
+            [('configure', 'loop'), ('mount', 'fs'), ('format', 'fs'),
+             ('postinstall', 'fs'), ('bootconfig', 'fs'), ('package', 'loop', self.workdir),
+             ('package', 'fs', os.path.join(self.workdir, 'fs'))],
+            _StubCreator.calls)
+
+        _StubCreator.calls = []
+        creator.cleanup()
+        self.assertEqual([('cleanup', 'fs'), ('cleanup', 'loop')],
+                         _StubCreator.calls)
+
+    def testPackageError(self):
+        primary = _StubLoop()
+        creator = multi.MultiImageCreator(primary, ['raw'], {}, None)
+        (raw, ) = [c for c in creator.get_creators() if c.fmt == 'raw']
+        def _fail(destdir):
+            raise CreatorError("no space")
+        raw.package = _fail
+        self.assertRaises(CreatorError, creator.package, self.workdir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from mic.utils import pkgcheck
+
+def suite():
+    return unittest.makeSuite(PkgCheckTest)
+
+class PkgCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix = 'pkgcheck-')
+        self.items = []
+        for i in range(4):
+            path = os.path.join(self.tmpdir, 'p%d.rpm' % i)
+            with open(path, 'w') as wf:
+                wf.write('rpm %d' % i * 1000)
+            self.items.append((path, 'sha256',
+                               hashlib.sha256('rpm %d' % i * 1000).hexdigest()))
+        self.memofile = os.path.join(self.tmpdir, 'verified.memo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def testVerifyFiles(self):
+        items = self.items + [(self.items[0][0], 'sha256', 'bad'),
+                              ('/nonexist', 'sha256', 'bad')]
+        self.assertEqual([True] * 4 + [False, False],
+                         pkgcheck.verify_files(items, workers = 2))
+
+    def testMemo(self):
+        memo = pkgcheck.VerifiedFiles(self.memofile)
+        pkgcheck.verify_files(self.items, memo)
+        memo.save()
+
+        memo = pkgcheck.VerifiedFiles(self.memofile)
+        for (path, sumtype, checksum) in self.items:
+            self.assertTrue(memo.is_verified(path, sumtype, checksum))
+
+        # a changed file is hashed again
+        (path, sumtype, checksum) = self.items[0]
+        with open(path, 'a') as wf:
+            wf.write('changed')
+        self.assertFalse(memo.is_verified(path, sumtype, checksum))
+        self.assertFalse(pkgcheck.verify(path, sumtype, checksum, memo))
+
+    def testMemoMerged(self):
+        # two processes verifying their own files save into one memo
+        memo1 = pkgcheck.VerifiedFiles(self.memofile)
+        memo2 = pkgcheck.VerifiedFiles(self.memofile)
+        pkgcheck.verify_files(self.items[:2], memo1)
+        pkgcheck.verify_files(self.items[2:], memo2)
+        memo1.save()
+        memo2.save()
+
+        memo = pkgcheck.VerifiedFiles(self.memofile)
+        for (path, sumtype, checksum) in self.items:
+            self.assertTrue(memo.is_verified(path, sumtype, checksum))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+
+import unittest
+from mic.utils import pkgmatch
+
+def suite():
+    return unittest.makeSuite(PkgMatchTest)
+
+class PkgMatchTest(unittest.TestCase):
+
+    def testMatch(self):
+        matcher = pkgmatch.PackageMatcher(['bash', 'glibc.i686', 'kernel-*',
+                                           '*-devel', '*doc*'])
+        self.assertTrue(matcher.match('bash'))
+        self.assertTrue(matcher.match('bash', 'i686'))
+        self.assertFalse(matcher.match('bash-completion'))
+
+        self.assertTrue(matcher.match('glibc', 'i686'))
+        self.assertFalse(matcher.match('glibc', 'x86_64'))
+        self.assertFalse(matcher.match('glibc'))
+
+        self.assertTrue(matcher.match('kernel-adaptation'))
+        self.assertTrue(matcher.match('zlib-devel'))
+        self.assertTrue(matcher.match('python-docutils'))
+        self.assertFalse(matcher.match('kernel'))
+        self.assertFalse(matcher.match('devel-tools'))
+
+    def testSpecialChars(self):
+        matcher = pkgmatch.PackageMatcher(['libstdc++*', '*.so'])
+        self.assertTrue(matcher.match('libstdc++-devel'))
+        self.assertFalse(matcher.match('libstdcxx'))
+        self.assertTrue(matcher.match('lib.so'))
+        self.assertFalse(matcher.match('libxso'))
+
+    def testDiscard(self):
+        matcher = pkgmatch.PackageMatcher(['bash', 'glibc.i686'])
+        matcher.discard('glibc.i686')
+        self.assertFalse(matcher.match('glibc', 'i686'))
+        self.assertTrue(matcher.match('bash'))
+        self.assertEqual(1, len(matcher))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import unittest
+from mic.utils import pkgstore, locks
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="%s">0000</checksum>
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+def suite():
+    return unittest.makeSuite(PkgStoreTest)
+
+class PkgStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix = 'pkgstore-')
+        self.store = pkgstore.PackageStore(self.cachedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors = True)
+
+    def _repomd(self, repo, sumtype):
+        os.makedirs(os.path.join(self.cachedir, repo))
+        with open(os.path.join(self.cachedir, repo, 'repomd.xml'), 'w') as wf:
+            wf.write(REPOMD % sumtype)
+
+    def _pkg(self, repo, name, data):
+        pkgdir = os.path.join(self.cachedir, 'packages', repo)
+        if not os.path.exists(pkgdir):
+            os.makedirs(pkgdir)
+        path = os.path.join(pkgdir, name)
+        with open(path, 'w') as wf:
+            wf.write(data)
+        return (path, hashlib.sha256(data).hexdigest())
+
+    def testDedup(self):
+        (path1, checksum) = self._pkg('repo1', 'a.rpm', 'A' * 1000)
+        (path2, checksum) = self._pkg('repo2', 'a.rpm', 'A' * 1000)
+        self.store.add(path1, 'sha256', checksum)
+        self.store.add(path2, 'sha256', checksum)
+        self.assertTrue(os.path.samefile(path1, path2))
+
+        stats = self.store.stats()
+        self.assertEqual(1, stats['packages'])
+        self.assertEqual(1000, stats['size'])
+        self.assertEqual(2, stats['views'])
+
+        target = os.path.join(self.cachedir, 'packages', 'repo3', 'a.rpm')
+        self.assertTrue(self.store.link('sha256', checksum, target))
+        self.assertTrue(os.path.samefile(path1, target))
+        self.assertFalse(self.store.link('sha256', 'nonexist', target))
+
+    def testViews(self):
+        self._pkg('repo1', 'a.rpm', 'A' * 1000)
+        self._repomd('repo2', 'sha256')
+        os.makedirs(os.path.join(self.cachedir, 'repo2', 'packages'))
+        with open(os.path.join(self.cachedir, 'repo2', 'packages', 'b.rpm'),
+                  'w') as wf:
+            wf.write('B' * 1000)
+        # the rpms in the other trees of cachedir aren't views
+        for subdir in ('snapshots/s1/packages/repo1', 'mirror/repo1/packages'):
+            os.makedirs(os.path.join(self.cachedir, subdir))
+            with open(os.path.join(self.cachedir, subdir, 'c.rpm'), 'w') as wf:
+                wf.write('C' * 1000)
+
+        self.assertEqual(2, self.store.stats()['views'])
+
+    def testGc(self):
+        self._repomd('repo', 'sha256')
+        paths = []
+        for i in range(3):
+            (path, checksum) = self._pkg('repo', '%d.rpm' % i, str(i) * 1000)
+            paths.append(path)
+        self.assertEqual(3, self.store.ingest())
+
+        # 0.rpm is the least recently used one
+        now = time.time()
+        for (i, path) in enumerate(paths):
+            os.utime(path, (now - 100 + i, os.stat(path).st_mtime))
+
+        (evicted, freed) = self.store.evict(2000)
+        self.assertEqual((1, 1000), (evicted, freed))
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[1]))
+        self.assertEqual(2, self.store.stats()['packages'])
+
+    def testIngestSumtype(self):
+        self._repomd('repo1', 'sha')
+        (path, checksum) = self._pkg('repo1', 'a.rpm', 'A' * 1000)
+        # no repomd.xml, the checksum type is unknown
+        self._pkg('repo2', 'b.rpm', 'B' * 1000)
+        self.assertEqual(1, self.store.ingest())
+
+        checksum = hashlib.sha1('A' * 1000).hexdigest()
+        self.assertTrue(os.path.samefile(path,
+                            self.store.path_of('sha1', checksum)))
+        self.assertEqual(1, self.store.stats()['views_outside'])
+
+    def testEvictInUse(self):
+        for repo in ('repo1', 'repo2'):
+            self._repomd(repo, 'sha256')
+            self._pkg(repo, '%s.rpm' % repo, repo * 500)
+        self.assertEqual(2, self.store.ingest())
+
+        lock = locks.packages_lock(self.cachedir, 'repo1', shared = True)
+        lock.acquire()
+        try:
+            (evicted, freed) = self.store.evict(1)
+        finally:
+            lock.release()
+        self.assertEqual(1, evicted)
+        self.assertTrue(os.path.exists(os.path.join(self.cachedir, 'packages',
+                                                    'repo1', 'repo1.rpm')))
+        self.assertFalse(os.path.exists(os.path.join(self.cachedir,
+                                            'packages', 'repo2', 'repo2.rpm')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from mic.utils import repoindex
+
+REPODATA = os.path.join(os.getcwd(), 'baseimgr_fixtures', 'repodata')
+
+def suite():
+    return unittest.makeSuite(RepoIndexTest)
+
+class RepoIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix = 'repoindex-')
+        self.primary = os.path.join(self.tmpdir, 'primary.xml')
+        rf = gzip.open(os.path.join(REPODATA, 'primary.xml.gz'))
+        with open(self.primary, 'w') as wf:
+            wf.write(rf.read())
+        rf.close()
+        self.repomd = os.path.join(self.tmpdir, 'repomd.xml')
+        shutil.copy(os.path.join(REPODATA, 'repomd.xml'), self.repomd)
+        self.repo = {'name': 'test',
+                     'primary': self.primary,
+                     'repomd': self.repomd}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def testBuild(self):
+        idx = repoindex.RepoIndex.build(self.primary)
+        self.assertEqual(['i586', 'i686', 'noarch'], sorted(idx.arches))
+        entry = idx.get_best('C')
+        self.assertEqual('0.2', entry[repoindex.VERSION])
+        self.assertEqual('i686/C-0.2-1.i686.rpm', entry[repoindex.LOCATION])
+        self.assertEqual('C-0.2-1.src.rpm', entry[repoindex.SOURCERPM])
+        (sumtype, checksum) = entry[repoindex.CHECKSUM]
+        self.assertEqual('sha256', sumtype)
+        self.assertEqual(64, len(checksum))
+        self.assertEqual(None, idx.get_best('C', 'src'))
+        self.assertEqual(None, idx.get_best('nonexist'))
+
+    def testPersist(self):
+        idx = repoindex.get_index(self.repo)
+        checksum = repoindex.get_primary_checksum(self.repomd)
+        self.assertTrue(checksum)
+        idxfile = os.path.join(self.tmpdir, 'primary.idx')
+        self.assertTrue(os.path.exists(idxfile))
+        loaded = repoindex.RepoIndex.load(idxfile, checksum)
+        self.assertEqual(idx.packages, loaded.packages)
+        self.assertEqual(None, repoindex.RepoIndex.load(idxfile, 'other'))
+
+    def testMemo(self):
+        idx = repoindex.get_index(self.repo)
+        # repomd.xml isn't read again while primary is unchanged
+        os.unlink(self.repomd)
+        self.assertTrue(idx is repoindex.get_index(self.repo))
+        self.assertEqual('sha256',
+                         repoindex.get_primary_sumtype(
+                             os.path.join(REPODATA, 'repomd.xml')))
+
+    def testFindPackage(self):
+        (repo, entry) = repoindex.find_package('H', [self.repo])
+        self.assertEqual('test', repo['name'])
+        self.assertEqual('noarch', entry[repoindex.ARCH])
+        self.assertEqual((None, None),
+                         repoindex.find_package('nonexist', [self.repo]))
+
+    def _gunzip(self, suffix, target):
+        for fname in os.listdir(REPODATA):
+            if fname.endswith(suffix):
+                rf = gzip.open(os.path.join(REPODATA, fname))
+                with open(target, 'w') as wf:
+                    wf.write(rf.read())
+                rf.close()
+        return target
+
+    def testGroupIndex(self):
+        comps = self._gunzip('group.xml.gz',
+                             os.path.join(self.tmpdir, 'comps.xml'))
+        patterns = self._gunzip('patterns.xml.gz',
+                                os.path.join(self.tmpdir, 'patterns.xml'))
+
+        idx = repoindex.get_group_index(comps, 'comps')
+        self.assertEqual(('F', 'G', 'H'), idx.get_packages('base'))
+        self.assertEqual((), idx.get_packages('nonexist'))
+        self.assertTrue(os.path.exists(comps + '.idx'))
+
+        idx = repoindex.get_group_index(patterns, 'patterns')
+        self.assertEqual(('F', 'G', 'H'), idx.get_packages('base'))
+        self.assertEqual(('F', 'G', 'H'),
+                         idx.get_packages('Base packages for testing'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import snapshot
+
+def suite():
+    return unittest.makeSuite(SnapshotTest)
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix = 'snapshot-')
+        self.cachedir = os.path.join(self.workdir, 'cache')
+        self.instroot = os.path.join(self.workdir, 'root')
+        for path in ('usr/bin/bash', 'etc/fstab', 'etc/passwd',
+                     'proc/cpuinfo', 'dev/null'):
+            self._write(os.path.join(self.instroot, path), path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors = True)
+
+    def _write(self, path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as wf:
+            wf.write(data)
+
+    def _read(self, path):
+        with open(path) as rf:
+            return rf.read()
+
+    def testCommonPackages(self):
+        self.assertEqual(['bash', 'rpm'],
+                         snapshot.common_packages([['rpm', 'bash', 'vim'],
+                                                   ['bash', 'rpm', 'kernel*'],
+                                                   ['zsh', 'rpm', 'bash']]))
+        self.assertEqual([], snapshot.common_packages([]))
+
+    def testCopyTree(self):
+        dst = os.path.join(self.workdir, 'copy')
+        self._write(os.path.join(dst, 'etc/hostname'), 'host')
+        snapshot.copy_tree(self.instroot, dst, ('proc', 'etc/fstab'))
+
+        self.assertEqual('usr/bin/bash',
+                         self._read(os.path.join(dst, 'usr/bin/bash')))
+        self.assertEqual('host', self._read(os.path.join(dst, 'etc/hostname')))
+        self.assertTrue(os.path.exists(os.path.join(dst, 'etc/passwd')))
+        self.assertFalse(os.path.exists(os.path.join(dst, 'etc/fstab')))
+        self.assertFalse(os.path.exists(os.path.join(dst, 'proc')))
+
+    def testSaveRestore(self):
+        store = snapshot.SnapshotStore(self.cachedir)
+        manifest = {'packages': ['bash-4.2-1.i686']}
+        self.assertEqual(None, store.restore('base', self.instroot))
+        self.assertTrue(store.save('base', self.instroot, manifest))
+        self.assertTrue(store.has('base'))
+
+        # a build of its own, which has fstab of its own
+        target = os.path.join(self.workdir, 'target')
+        self._write(os.path.join(target, 'etc/fstab'), 'mine')
+        self.assertEqual(manifest, store.restore('base', target))
+        self.assertEqual('mine', self._read(os.path.join(target, 'etc/fstab')))
+        self.assertEqual('etc/passwd',
+                         self._read(os.path.join(target, 'etc/passwd')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'proc')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'dev')))
+
+    def testFiles(self):
+        store = snapshot.SnapshotStore(self.cachedir, subdir = 'checkpoints')
+        kernel = os.path.join(self.workdir, 'vmlinuz')
+        self._write(kernel, 'kernel')
+        store.save('build', self.instroot, {'phase': 'install'},
+                   files = [kernel])
+        self.assertTrue(os.path.isdir(os.path.join(self.cachedir,
+                                                   'checkpoints', 'build')))
+
+        destdir = os.path.join(self.workdir, 'files')
+        os.mkdir(destdir)
+        paths = store.get_files('build', destdir)
+        self.assertEqual([os.path.join(destdir, 'vmlinuz')], paths)
+        self.assertEqual('kernel', self._read(paths[0]))
+
+    def testPrune(self):
+        store = snapshot.SnapshotStore(self.cachedir, keep = 2)
+        for (i, key) in enumerate(('a', 'b', 'c')):
+            store.save(key, self.instroot, {})
+            os.utime(os.path.join(self.cachedir, 'snapshots', key, 'manifest'),
+                     (1000 + i, 1000 + i))
+        store.prune()
+        self.assertFalse(store.has('a'))
+        self.assertTrue(store.has('b'))
+        self.assertTrue(store.has('c'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import solvcache
+
+def suite():
+    return unittest.makeSuite(SolvCacheTest)
+
+class SolvCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix = 'solvcache-')
+        self.cache = solvcache.SolvCache(self.cachedir)
+        self.repomd = os.path.join(self.cachedir, 'repomd.xml')
+        self._write(self.repomd, '<repomd>1</repomd>')
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors = True)
+
+    def _write(self, path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as wf:
+            wf.write(data)
+
+    def _build(self, name):
+        # as the cache is cleaned before rebuilt
+        shutil.rmtree(os.path.join(self.cachedir, 'solv', name),
+                      ignore_errors = True)
+        self._write(os.path.join(self.cachedir, 'solv', name, 'solv'), 'SOLV')
+        self._write(os.path.join(self.cachedir, 'solv', name, 'cookie'), 'C')
+
+    def testRevision(self):
+        rev = solvcache.get_revision(self.repomd, 'http://a/repo/')
+        self.assertEqual(rev, solvcache.get_revision(self.repomd,
+                                                     'http://a/repo'))
+        self.assertNotEqual(rev, solvcache.get_revision(self.repomd,
+                                                        'http://b/repo'))
+        self._write(self.repomd, '<repomd>2</repomd>')
+        self.assertNotEqual(rev, solvcache.get_revision(self.repomd,
+                                                        'http://a/repo'))
+
+    def testValidate(self):
+        rev = solvcache.get_revision(self.repomd, 'http://a/repo')
+        self.assertFalse(self.cache.is_valid('oss', rev))
+        self._build('oss')
+        self.cache.save('oss', rev)
+        self.assertTrue(self.cache.is_valid('oss', rev))
+        self.assertFalse(self.cache.is_valid('oss', 'other'))
+        self.assertFalse(self.cache.is_valid('oss', None))
+
+        self.cache.invalidate('oss')
+        self.assertFalse(self.cache.is_valid('oss', rev))
+
+    def testPool(self):
+        rev = solvcache.get_revision(self.repomd, 'http://a/repo')
+        self.assertFalse(self.cache.restore('oss', rev))
+        self._build('oss')
+        self.cache.save('oss', rev)
+
+        # the same repo under another name
+        self.assertTrue(self.cache.restore('oss-copy', rev))
+        self.assertTrue(self.cache.is_valid('oss-copy', rev))
+        self.assertTrue(os.path.samefile(
+                os.path.join(self.cachedir, 'solv', 'oss', 'solv'),
+                os.path.join(self.cachedir, 'solv', 'oss-copy', 'solv')))
+
+        # the outdated revision is dropped from the pool
+        self._build('oss')
+        self.cache.save('oss', 'newrev')
+        self.assertFalse(self.cache.restore('other', rev))
+        self.assertTrue(self.cache.is_valid('oss-copy', rev))
+
+if __name__ == "__main__":
+    unittest.main()
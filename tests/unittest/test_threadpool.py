@@ -0,0 +1,46 @@
+#!/usr/bin/python
+
+import time
+import unittest
+from mic.utils import threadpool
+
+def suite():
+    return unittest.makeSuite(ThreadPoolTest)
+
+class ThreadPoolTest(unittest.TestCase):
+
+    def testOrderKept(self):
+        def _slow_square(n):
+            time.sleep(0.01 * (10 - n))
+            return n * n
+        results = threadpool.map_parallel(_slow_square, range(10), 4)
+        self.assertEqual([(n * n, None) for n in range(10)], results)
+
+    def testErrorPerItem(self):
+        def _check(n):
+            if n % 2:
+                raise ValueError(n)
+            return n
+        results = threadpool.map_parallel(_check, range(4), 2)
+        self.assertEqual((0, None), results[0])
+        self.assertTrue(isinstance(results[1][1], ValueError))
+        self.assertEqual((2, None), results[2])
+        self.assertTrue(isinstance(results[3][1], ValueError))
+
+    def testSystemExit(self):
+        def _exit(n):
+            if n == 1:
+                raise SystemExit(1)
+            return n
+        for workers in (1, 2):
+            results = threadpool.map_parallel(_exit, range(3), workers)
+            self.assertEqual((0, None), results[0])
+            self.assertTrue(isinstance(results[1][1], SystemExit))
+            self.assertEqual((2, None), results[2])
+
+    def testEmptyAndSerial(self):
+        self.assertEqual([], threadpool.map_parallel(str, [], 4))
+        self.assertEqual([('1', None)], threadpool.map_parallel(str, [1], '1'))
+
+if __name__ == "__main__":
+    unittest.main()
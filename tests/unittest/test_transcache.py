@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from mic.utils import transcache
+
+def suite():
+    return unittest.makeSuite(TransCacheTest)
+
+class TransCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix = 'transcache-')
+        self.repomd = os.path.join(self.cachedir, 'repomd.xml')
+        self._write_repomd('<repomd>1</repomd>')
+        self.repos = [{'name': 'oss', 'baseurl': 'http://a/oss',
+                       'repomd': self.repomd}]
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors = True)
+
+    def _write_repomd(self, data):
+        with open(self.repomd, 'w') as wf:
+            wf.write(data)
+
+    def _key(self, packages = ('bash', 'rpm'), arch = 'i686'):
+        return transcache.get_key(self.repos, arch, list(packages),
+                                  [('base', 'default')], ['doc'], 'zypp')
+
+    def testKey(self):
+        key = self._key()
+        self.assertEqual(key, self._key(('rpm', 'bash')))
+        self.assertNotEqual(key, self._key(('bash',)))
+        self.assertNotEqual(key, self._key(arch = 'armv7l'))
+
+        # any change of the repos invalidates it
+        self._write_repomd('<repomd>2</repomd>')
+        self.assertNotEqual(key, self._key())
+
+    def testLoadSave(self):
+        cache = transcache.TransactionCache(self.cachedir)
+        key = self._key()
+        self.assertEqual(None, cache.load(key))
+
+        resolved = [('package', 'bash', '4.2-1', 'i686', 'oss'),
+                    ('package', 'rpm', '4.9-1', 'i686', 'oss')]
+        cache.save(key, resolved)
+        self.assertEqual(resolved, cache.load(key))
+
+        cache.discard(key)
+        self.assertEqual(None, cache.load(key))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import os
+import bz2
+import gzip
+import shutil
+import hashlib
+import tempfile
+import unittest
+from mic.utils import urlfetch
+from mic.utils.errors import CreatorError
+
+CONTENT = 'mic urlfetch test data\n' * 1000
+
+def suite():
+    return unittest.makeSuite(UrlFetchTest)
+
+class UrlFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp(prefix = 'urlfetch-src-')
+        self.dstdir = tempfile.mkdtemp(prefix = 'urlfetch-dst-')
+        self.checksum = hashlib.sha256(CONTENT).hexdigest()
+
+        wf = gzip.open(os.path.join(self.srcdir, 'data.xml.gz'), 'wb')
+        wf.write(CONTENT)
+        wf.close()
+        with open(os.path.join(self.srcdir, 'data.xml.bz2'), 'wb') as wf:
+            wf.write(bz2.compress(CONTENT))
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir, ignore_errors = True)
+        shutil.rmtree(self.dstdir, ignore_errors = True)
+
+    def _fetch(self, name, checksum):
+        return urlfetch.fetch('file://%s/%s' % (self.srcdir, name),
+                              os.path.join(self.dstdir, name),
+                              None, 'sha256', checksum)
+
+    def testFetchDecompress(self):
+        for name in ('data.xml.gz', 'data.xml.bz2'):
+            path = self._fetch(name, self.checksum)
+            self.assertEqual(os.path.join(self.dstdir, 'data.xml'), path)
+            with open(path) as rf:
+                self.assertEqual(CONTENT, rf.read())
+            self.assertTrue(urlfetch.is_cached(path, 'sha256', self.checksum))
+            os.unlink(path)
+
+    def testChecksumMismatch(self):
+        self.assertRaises(CreatorError, self._fetch, 'data.xml.gz', 'bad')
+        self.assertFalse(os.path.exists(os.path.join(self.dstdir,
+                                                     'data.xml')))
+
+    def testCorrupt(self):
+        names = ['bad.xml.gz', 'bad.xml.bz2']
+        if urlfetch.lzma:
+            names.append('bad.xml.xz')
+        for name in names:
+            with open(os.path.join(self.srcdir, name), 'wb') as wf:
+                wf.write('not compressed data' * 100)
+            self.assertRaises(CreatorError, self._fetch, name, self.checksum)
+        # no temp file left behind, only the lock files
+        self.assertEqual([], [fname for fname in os.listdir(self.dstdir)
+                              if not fname.endswith('.lock')])
+
+    def testRawCopy(self):
+        rawcopy = os.path.join(self.dstdir, 'mirror', 'data.xml.gz')
+        os.makedirs(os.path.dirname(rawcopy))
+        self.assertRaises(CreatorError, urlfetch.fetch,
+                          'file://%s/data.xml.gz' % self.srcdir,
+                          os.path.join(self.dstdir, 'data.xml.gz'),
+                          None, 'sha256', 'bad', rawcopy = rawcopy)
+        self.assertFalse(os.path.exists(rawcopy))
+
+        urlfetch.fetch('file://%s/data.xml.gz' % self.srcdir,
+                       os.path.join(self.dstdir, 'data.xml.gz'),
+                       None, 'sha256', self.checksum, rawcopy = rawcopy)
+        with open(rawcopy) as rf:
+            with open(os.path.join(self.srcdir, 'data.xml.gz')) as orig:
+                self.assertEqual(orig.read(), rf.read())
+
+    def testCacheInvalidated(self):
+        path = self._fetch('data.xml.gz', self.checksum)
+        self.assertFalse(urlfetch.is_cached(path, 'sha256', 'other'))
+        with open(path, 'a') as wf:
+            wf.write('changed')
+        self.assertFalse(urlfetch.is_cached(path, 'sha256', self.checksum))
+
+    def testRevalidate(self):
+        url = 'file://%s/data.xml.gz' % self.srcdir
+        path = os.path.join(self.dstdir, 'repomd.xml')
+        self.assertRaises(CreatorError, urlfetch.revalidate,
+                          url, path, None, 0, True)
+        self.assertEqual((path, True), urlfetch.revalidate(url, path))
+
+        # cached copy is trusted within expire, or in offline mode
+        url = 'file://%s/nonexist' % self.srcdir
+        self.assertEqual((path, False),
+                         urlfetch.revalidate(url, path, None, 3600))
+        self.assertEqual((path, False),
+                         urlfetch.revalidate(url, path, None, 0, True))
+        self.assertRaises(CreatorError, urlfetch.revalidate, url, path)
+
+if __name__ == "__main__":
+    unittest.main()